@@ -2,8 +2,13 @@ from .core    import *
 from .aux     import * 
 from .queue   import *
 from .usocket import USocket
+from .workers import *
+from .threads import *
+from .processes import *
 from .        import websockets
 from .streams import *
+from .profiler import *
+from .pollers import *
 from .        import core
 
 
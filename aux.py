@@ -1,11 +1,13 @@
 from .core import *
+from .core import OwnedFuture, _Task
 from collections import deque
 from time import time
 from . import core
 
 
 __all__ = ["EventFuture", "Barrier", "sleep", "wrapFutureErrors", "doneFuture",
-           "errorFuture", "EventQueue", "RecurringEvent"]
+           "errorFuture", "EventQueue", "RecurringEvent", "ErrorGate",
+           "TaskGroup", "TaskGroupError"]
 
 # This is a special Future which has been completed. Is used whenever a function
 # that would return a Future for one branch, returns immediate completion on a
@@ -36,6 +38,8 @@ class EventFuture(Future):
 	    action is taken. Otherwise, the result/error is passed into the Future
 	    behaviour and the event is de-registered.
 	"""
+	__slots__ = ("fileNumber", "mask", "innerHandle", "moreArgs")
+	
 	def __init__(self, fileNumber, mask, handle, *moreArgs):
 		super().__init__()
 		self.fileNumber = fileNumber
@@ -44,6 +48,14 @@ class EventFuture(Future):
 		self.moreArgs = moreArgs
 		dispatcher.registerFileEvent(fileNumber, mask, self.__handle)
 	
+	def withdraw(self, cb):
+		# Only the waiter can withdraw, and only once.
+		if self.cb is not cb:
+			return
+		super().withdraw(cb)
+		if not self.isDone:
+			dispatcher.unregisterFileEvent(self.fileNumber, self.mask)
+	
 	def __handle(self, mask):
 		""" Handler called by the event system.
 		
@@ -56,7 +68,8 @@ class EventFuture(Future):
 			result = self.innerHandle(mask, *self.moreArgs)
 			self.setResultFast(result)
 		except IOEventAbort:
-			core.dispatcher.registerFileEvent(fileNumber, self.mask, self.__handle)
+			core.dispatcher.registerFileEvent(self.fileNumber, self.mask,
+			                                  self.__handle)
 		except Exception as error:
 			self.setErrorFast(error)
 
@@ -85,7 +98,7 @@ class EventQueue:
 		    system. If the EventQueue is closing then set an error on the
 		    returned future and do not add it to the queue.
 		"""
-		fut = Future()
+		fut = OwnedFuture(self)
 		if self.closing:
 			fut.setError(Exception("EventQueue is closed"))
 		else:
@@ -95,6 +108,15 @@ class EventQueue:
 				                             self.__handle)
 		return fut
 	
+	def withdrawWaiter(self, fut):
+		""" Remove a waiting `get' whose Future has been withdrawn.
+		"""
+		self.queue.remove(fut)
+		if len(self.queue) == 0:
+			dispatcher.unregisterFileEvent(self.fileNumber, self.mask)
+			if self.closing:
+				self.closeBarrier.release()
+	
 	def close(self):
 		""" Closes the EventQueue gracefully.
 		
@@ -144,30 +166,70 @@ class EventQueue:
 		    Future on the queue. The inner handle could also raise IOEventAbort,
 		    which terminates this function as no object was available in spite
 		    of what the event system thinks.
+		    
+		    When the dispatcher is edge-triggered, no further event will arrive
+		    for objects that are already waiting, so objects are retrieved
+		    until either the queue is empty or IOEventAbort is raised.
 		"""
-		# The innerHandle is used to retrieve the result for the queue.
-		fut = self.queue.popleft()
-		try:
-			getThing = self.innerHandle(mask, *self.moreArgs)
-			fut.setResult(getThing)
-		# IOEventAbort is raised by an innerHandle to signify that a result
-		# was not available. The future is not removed from the queue here.
-		except IOEventAbort:
-			self.queue.pushleft(fut)
-			return
-		# Any other exception should be raised on the Future from the queue.
-		except Exception as e:
-			fut.setError(e)
+		while True:
+			# The innerHandle is used to retrieve the result for the queue.
+			fut = self.queue.popleft()
+			try:
+				getThing = self.innerHandle(mask, *self.moreArgs)
+				fut.setResult(getThing)
+			# IOEventAbort is raised by an innerHandle to signify that a result
+			# was not available. The future is not removed from the queue here.
+			except IOEventAbort:
+				self.queue.appendleft(fut)
+				return
+			# Any other exception should be raised on the Future from the
+			# queue.
+			except Exception as e:
+				fut.setError(e)
+			
+			# If the EventQueue is empty then make sure to unregister the
+			# handle so that the event system is not trying to accept
+			# connections that are not being waited for.
+			if len(self.queue) == 0:
+				# in closing mode. This is the last thing that is being waited
+				# for so fulfill the closing barrier.
+				if self.closing:
+					self.closeBarrier.release()
+				dispatcher.unregisterFileEvent(self.fileNumber, self.mask)
+				return
+			
+			if not dispatcher.edgeTriggered:
+				return
+
+
+class _SleepFuture(Future):
+	""" The Future returned by sleep.
+	
+	    This holds on to the timer that will complete it so that the sleep can
+	    be cancelled when it is no longer wanted, e.g. a timeout that was not
+	    needed. A cancelled sleep will never complete, so it should only be
+	    cancelled once nothing is waiting on it.
+	"""
+	__slots__ = ("timer",)
+	
+	def __init__(self, forTime):
+		super().__init__()
+		self.timer = core.dispatcher.scheduleHandleByTime(time() + forTime,
+		                                                  self.setResult, None)
+	
+	def cancel(self):
+		""" Cancel the sleep and release its timer.
 		
-		# If the EventQueue is empty then make sure to unregister the handle
-		# so that the event system is not trying to accept connections that are
-		# not being waited for.
-		if len(self.queue) == 0:
-			# in closing mode. This is the last thing that is being waited for
-			# so fulfill the closing barrier.
-			if self.closing:
-				self.closeBarrier.release()
-			dispatcher.unregisterFileEvent(self.fileNumber, self.mask)
+		    Returns True if the sleep was cancelled and False if it had already
+		    completed.
+		"""
+		return self.timer.cancel()
+	
+	def withdraw(self, cb):
+		if self.cb is not cb:
+			return
+		super().withdraw(cb)
+		self.timer.cancel()
 
 
 def sleep(forTime):
@@ -175,18 +237,23 @@ def sleep(forTime):
 	
 	    Coroutine sleep does not guarantee that execution will be resumed at
 	    exactly the time supplied but guarantees that execution will be
-	    suspended for at least that amount of time.
+	    suspended for at least that amount of time. The returned Future can be
+	    cancelled through its `cancel' method.
 	"""
-	fut = Future()
-	def inner():
-		fut.setResult(None)
-	core.dispatcher.scheduleHandleByTime(time() + forTime, inner)
-	return fut
+	return _SleepFuture(forTime)
 
 
 class _ControlYield(Future):
+	__slots__ = ()
+	
 	def setCallback(self, cb):
-		core.dispatcher.scheduleLowPriority(lambda: cb.send(None))
+		core.dispatcher.scheduleLowPriority(self.__resume, cb)
+	
+	def __resume(self, cb):
+		# A task that was cancelled while yielding control has moved on, or
+		# completed.
+		if getattr(cb, "waiting", self) is self:
+			cb.send(None)
 	
 	def setResult(self, result):
 		raise(Exception("ControlYield cannot have a result"))
@@ -226,63 +293,236 @@ class RoundRobin:
 
 
 class FirstPastThePost(Future):
+	__slots__ = ()
+	
 	def setResult(self, result):
 		if not self.isDone:
 			super().setResult(result)
 	
 	def setError(self, error):
 		if not self.isDone:
-			super().setError(result)
+			super().setError(error)
 
 
 class ErrorGate(Future):
 	""" Error gate allows errors to be injected past another future into a
 	    waiting process.
+	
+	    Each Future passed through the gate is watched by a _Gated, which
+	    completes with the Future's result unless an error is set on the
+	    gate first. The _Gated are kept in a dict from which each removes
+	    itself when it completes, so the gate only ever holds those still
+	    waiting. `clearSchedule', which set how often the gate used to sweep
+	    its list of gated Futures, is still accepted and kept, but no longer
+	    has any effect.
 	"""
+	__slots__ = ("gatedFutures", "clearSchedule")
+	
 	def __init__(self, clearSchedule=20):
 		super().__init__()
-		self.gatedFutures = []
+		self.gatedFutures = {}
 		self.clearSchedule = clearSchedule
-		self.hookCount = 0
 	
-	def setResult(self):
+	def setResult(self, result):
 		raise(Exception("Cannot set a result on an ErrorGate"))
 	
 	def setError(self, error):
-		self.done()
+		# The gate holds the error for those that pass through it later.
+		self.isDone = True
 		self.error = error
-		for fut in self.gatedFutures:
-			fut.setError(error)
+		gatedFutures = self.gatedFutures
+		self.gatedFutures = {}
+		for gfut in gatedFutures:
+			gfut.setError(error)
 	
 	def __call__(self, thing):
 		if self.isDone:
 			return self
 		
-		self.hookCount += 1
-		
-		if isinstance(thing, Future):
-			fut = thing
-		else:
-			fut = async(thing)
-		
+		fut = async(thing)
 		if fut.isDone:
 			return fut
 		
-		# Periodically clear out the list of gated futures
-		if self.hookCount >= self.clearSchedule:
-			self.hookCount = 0
-			newList = []
-			for gfut in self.gatedFutures:
-				if not gfut.isDone:
-					newList.append(gfut)
-			self.gatedFutures = newList
-		
-		pfut = FirstPastThePost()
-		fut.setCallback(pfut)
-		
-		self.gatedFutures.append(pfut)
+		gfut = _Gated(self)
+		fut.setCallback(gfut)
+		self.gatedFutures[gfut] = None
+		return gfut
+
+
+class _Gated(FirstPastThePost):
+	""" The Future returned by an ErrorGate, which is also the callback of
+	    the Future that it gates.
+	"""
+	__slots__ = ("gate",)
+	
+	def __init__(self, gate):
+		super().__init__()
+		self.gate = gate
+	
+	def send(self, result):
+		if not self.isDone:
+			del self.gate.gatedFutures[self]
+			self.setResultFast(result)
+	
+	def throw(self, error):
+		if not self.isDone:
+			del self.gate.gatedFutures[self]
+			self.setErrorFast(error)
+
+
+class TaskGroupError(Exception):
+	""" The error of a TaskGroup in which one or more children failed.
+	
+	    The errors are kept, in the order in which they were raised, in
+	    `errors'.
+	"""
+	def __init__(self, errors):
+		super().__init__("%d task(s) in the group failed: %s"
+		                 % (len(errors), ", ".join(map(repr, errors))))
+		self.errors = errors
+
+
+class TaskGroup:
+	""" A group of child tasks that finish together.
+	
+	    Children are started with `spawn', which takes a coroutine or a
+	    Future, and are held in a dict from which each removes itself when it
+	    completes, so that the cost of the group is constant for each child,
+	    however many there have been. The first child to fail has every
+	    other child cancelled, and the group then fails with a TaskGroupError
+	    holding the errors of all the children that failed. Children that
+	    end with Cancelled are not counted as failed.
+	
+	    The Future returned by `wait' completes once there are no children
+	    left, so the group is left with `yield from group.wait()' or, in a
+	    native coroutine, by the end of an `async with' block. An error
+	    raised in the block cancels the children, which are still waited
+	    for. Children may be spawned until the group has finished.
+	"""
+	def __init__(self):
+		self.children = {}
+		self.errors = []
+		self.waiter = None
+		self.finished = False
+	
+	def spawn(self, thing):
+		""" Start `thing' as a child of the group.
 		
-		return pfut
+		    Returns a Future for the result of the child. A child that fails
+		    is reported by the group, so its error need not be retrieved.
+		"""
+		if self.finished:
+			raise(Exception("TaskGroup has finished"))
+		child = _Child(self, async(thing))
+		self.children[child] = None
+		if child.inner.isDone:
+			try:
+				child.send(child.inner.getResult())
+			except Exception as error:
+				child.throw(error)
+		else:
+			child.inner.setCallback(child)
+			if len(self.errors) > 0:
+				self.__cancelChild(child)
+		return child
+	
+	def cancel(self):
+		""" Cancel every child that is still running.
+		"""
+		for child in list(self.children):
+			self.__cancelChild(child)
+	
+	def wait(self):
+		""" Returns a Future that completes, or fails with a TaskGroupError,
+		    once every child has completed.
+		"""
+		if self.waiter is None:
+			self.waiter = OwnedFuture(self)
+			if len(self.children) == 0:
+				self.__finish()
+		return self.waiter
+	
+	def withdrawWaiter(self, fut):
+		""" Whatever was waiting on the group has been cancelled, so the
+		    children are cancelled too. They can be waited for again.
+		"""
+		self.waiter = None
+		self.cancel()
+	
+	def __aenter__(self):
+		fut = Future()
+		fut.setResult(self)
+		return fut
+	
+	@asynchronous
+	def __aexit__(self, errorType, error, traceback):
+		if error is not None:
+			self.cancel()
+		try:
+			yield from self.wait()
+		except Cancelled:
+			# Leaving is cancelled too: the children still end first.
+			try:
+				yield from self.wait()
+			except TaskGroupError:
+				pass
+			raise
+		except TaskGroupError as groupError:
+			if error is None or isinstance(error, Cancelled):
+				raise
+			raise(TaskGroupError([error] + groupError.errors)) from error
+		return False
+	
+	def _childDone(self, child, error):
+		del self.children[child]
+		if error is not None and not isinstance(error, Cancelled):
+			self.errors.append(error)
+			if len(self.errors) == 1:
+				self.cancel()
+		# Cancelling the other children may already have finished the group.
+		if len(self.children) == 0 and self.waiter is not None and \
+		   not self.finished:
+			self.__finish()
+	
+	def __cancelChild(self, child):
+		inner = child.inner
+		if isinstance(inner, _Task):
+			inner.cancel()
+		elif not inner.isDone:
+			inner.withdraw(child)
+			child.throw(Cancelled())
+	
+	def __finish(self):
+		self.finished = True
+		if len(self.errors) > 0:
+			self.waiter.setErrorFast(TaskGroupError(self.errors))
+		else:
+			self.waiter.setResultFast(None)
+
+
+class _Child(Future):
+	""" The Future for one child of a TaskGroup, which is also the callback
+	    of the child.
+	"""
+	__slots__ = ("group", "inner")
+	
+	def __init__(self, group, inner):
+		super().__init__()
+		self.group = group
+		self.inner = inner
+	
+	# The child completes before telling the group, which may finish and
+	# resume whatever is waiting on it straight away.
+	def send(self, result):
+		self.setResultFast(result)
+		self.group._childDone(self, None)
+	
+	def throw(self, error):
+		self.setErrorFast(error)
+		# The group reports the error, so it is not reported again.
+		if self.errorTracker is not None:
+			self.errorTracker.error = None
+		self.group._childDone(self, error)
 
 
 class Barrier(Future):
@@ -296,6 +536,8 @@ class Barrier(Future):
 	    wait until another process releases the Barrier; no error or value
 	    can be sent through it.
 	"""
+	__slots__ = ()
+	
 	def getResult(self):
 		pass
 	
@@ -318,6 +560,10 @@ class Barrier(Future):
 			self.cb = [cb]
 		else:
 			self.cb.append(cb)
+	
+	def withdraw(self, cb):
+		if self.cb is not None and cb in self.cb:
+			self.cb.remove(cb)
 
 class _Wrapper:
 	def __init__(self, cb):
@@ -345,54 +591,50 @@ class RecurringEvent:
 	    This class is used for scheduling an event that will repeat at a regular
 	    time interval. Once begun, an event will keep repeating at its set
 	    interval until `stop' is called; after this is called, the recurring
-	    event will be immediately stopped: No further callbacks will be acted
-	    on, even though one will be in the schedulers pipeline.
+	    event will be immediately stopped: The pending timer is cancelled, so
+	    no further callbacks will be acted on.
 	"""
 	def __init__(self, interval, callback, *args):
 		self.callback = callback
 		self.args = args
 		self.interval = interval
 		self.running = False
-		self.stopping = False
+		self.timer = None
 	
 	def __call__(self):
+		# The timer has fired, so the callback may stop and begin the event
+		# again, which schedules a timer of its own that must not be doubled.
+		self.timer = None
 		self.callback(*self.args)
-		if self.stopping:
-			self.running = False
-			self.stopping = False
-		else:
+		if self.running and self.timer is None:
 			self.__schedule()
 	
 	def begin(self):
 		""" Start the regular callbacks running.
 		
-		    This function sets the regular callbacks running. If the object
-		    was in the process of stopping, then this process will be halted and
-		    the previously scheduled callback will be run at the time it was
-		    scheduled for. If the object was otherwise not running, then the
-		    callback will be scheduled for `self.interval' seconds in the
-		    future. If the object was already running, an error is raised.
+		    This function sets the regular callbacks running. The callback will
+		    be scheduled for `self.interval' seconds in the future. If the
+		    object was already running, an error is raised.
 		"""
-		if self.stopping:
-			self.stopping = False
-		elif self.running:
+		if self.running:
 			raise(Exception("RecurringEvent was already running"))
-		else:
-			self.running = True
-			self.__schedule()
+		self.running = True
+		self.__schedule()
 		return self
 	
 	def stop(self):
 		""" Stop the regular callbacks from running.
 		
-		    This function stops the regular events running immediately. It is
-		    likely that a callback will be in the dispatcher pipeline but this
-		    is marked not to run by setting the current state to `stopping'. If
-		    the object was not running, an error is raised.
+		    This function stops the regular events running immediately by
+		    cancelling the timer for the next callback. If the object was not
+		    running, an error is raised.
 		"""
 		if not self.running:
 			raise(Exception("RecurringEvent was not running"))
-		self.stopping = True
+		self.running = False
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
 	
 	def __schedule(self):
 		""" Private function to handle scheduling.
@@ -400,4 +642,5 @@ class RecurringEvent:
 		    This function schedules this object's callback to run at the set
 		    time-point in the future.
 		"""
-		dispatcher.scheduleHandleByTime(time()+self.interval, self)
+		self.timer = dispatcher.scheduleHandleByTime(time() + self.interval,
+		                                             self)
@@ -0,0 +1,27 @@
+""" Micro-benchmarks for unstuck.
+
+    Each module in this package can be run on its own, for example
+    `python -m unstuck.benchmarks.timers', and prints a small table of results.
+"""
+from time import perf_counter
+
+
+def timed(function, *args):
+	""" Returns the wall-clock time, in seconds, taken to call `function'.
+	"""
+	start = perf_counter()
+	function(*args)
+	return perf_counter() - start
+
+
+def report(title, header, rows, file = None):
+	""" Print a table of benchmark results, to `file' if it is given.
+	"""
+	print(title, file = file)
+	widths = [max(len(str(row[i])) for row in [header] + rows)
+	          for i in range(len(header))]
+	for row in [header] + rows:
+		print("  " + "  ".join(str(cell).rjust(width)
+		                       for cell, width in zip(row, widths)),
+		      file = file)
+	print(file = file)
@@ -0,0 +1,109 @@
+""" Runs the benchmark suite against asyncio.
+
+    python -m unstuck.benchmarks [--only NAME ...] [--scale S] [--repeat N]
+                                 [--poller NAME] [--json FILE]
+                                 [--baseline FILE] [--list]
+
+    Prints a table of operations per second on each side and, with --json,
+    also writes the results, with a description of the machine that they
+    were taken on, to FILE, or to standard output for `-'. With --baseline
+    the table has a column for the change in unstuck's rate since the
+    results in FILE, so that two versions can be compared directly. With
+    --poller the dispatcher polls through the named backend.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+from time import strftime
+
+from ..core import dispatcher
+from ..pollers import POLLERS
+from . import report
+from .suite import CASES, runSuite
+
+
+def _machine():
+	return {"python": platform.python_version(),
+	        "implementation": platform.python_implementation(),
+	        "platform": platform.platform(),
+	        "processor": platform.processor(),
+	        "cpus": os.cpu_count(),
+	        "poller": dispatcher.pollerName,
+	        "time": strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "python -m unstuck.benchmarks",
+	                                 description = "Benchmark unstuck's core "
+	                                 "primitives against asyncio.")
+	parser.add_argument("--only", nargs = "+", metavar = "NAME",
+	                    help = "run only the cases starting with NAME")
+	parser.add_argument("--scale", type = float, default = 1.0,
+	                    help = "multiply the operations of every case")
+	parser.add_argument("--repeat", type = int, default = 3,
+	                    help = "runs of each case, of which the best is kept")
+	parser.add_argument("--poller", choices = sorted(POLLERS),
+	                    help = "the poller backend of the dispatcher")
+	parser.add_argument("--json", metavar = "FILE",
+	                    help = "write the results as JSON, `-' for stdout")
+	parser.add_argument("--baseline", metavar = "FILE",
+	                    help = "compare with the JSON results of an earlier run")
+	parser.add_argument("--list", action = "store_true",
+	                    help = "list the cases and exit")
+	args = parser.parse_args(argv)
+	
+	if args.list:
+		for name, operations, _, _ in CASES:
+			print("%-20s %d" % (name, operations))
+		return 0
+	
+	baseline = None
+	if args.baseline is not None:
+		with open(args.baseline) as baselineFile:
+			baseline = json.load(baselineFile)["results"]
+	
+	if args.poller is not None:
+		dispatcher.setPoller(args.poller)
+	results = runSuite(args.only, args.scale, args.repeat)
+	
+	rows = []
+	for name, result in results.items():
+		row = (name, result["operations"],
+		       "%.0f" % result["unstuck"]["perSecond"],
+		       "%.0f" % result["asyncio"]["perSecond"],
+		       "%.2f" % result["speedup"])
+		if baseline is not None:
+			before = baseline.get(name)
+			if before is None:
+				row += ("-",)
+			else:
+				change = result["unstuck"]["perSecond"] / \
+				         before["unstuck"]["perSecond"] - 1
+				row += ("%+.1f%%" % (change * 100),)
+		rows.append(row)
+	header = ("case", "operations", "unstuck/s", "asyncio/s", "speedup")
+	if baseline is not None:
+		header += ("vs baseline",)
+	# The table goes to stderr when the JSON is written to stdout.
+	report("Operations per second, best of %d" % args.repeat, header, rows,
+	       sys.stderr if args.json == "-" else None)
+	
+	if args.json is not None:
+		document = {"machine": _machine(),
+		            "scale": args.scale,
+		            "repeat": args.repeat,
+		            "results": results}
+		if args.json == "-":
+			json.dump(document, sys.stdout, indent = 2, sort_keys = True)
+			sys.stdout.write("\n")
+		else:
+			with open(args.json, "w") as jsonFile:
+				json.dump(document, jsonFile, indent = 2, sort_keys = True)
+				jsonFile.write("\n")
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
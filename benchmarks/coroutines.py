@@ -0,0 +1,75 @@
+""" Coroutine style benchmark.
+
+    Compares generator-based coroutines, chained with `yield from', against
+    native coroutines, chained with `await', when driven by a _Task. Each step
+    passes through a call chain of the given depth down to a Future, which is
+    then completed so that the result travels back up the chain. The Futures
+    are completed directly rather than through the dispatcher, so that the
+    results measure only the coroutine machinery.
+"""
+from ..core import Future, _Task, asynchronous
+from ..timers import inf
+from . import timed, report
+
+STEPS = 100000
+DEPTHS = (1, 4, 16)
+REPEAT = 3
+
+
+class _Driver:
+	def __init__(self):
+		self.pending = []
+	
+	def leaf(self):
+		future = Future()
+		self.pending.append(future)
+		return future
+	
+	def run(self, task):
+		task.send(None)
+		pending = self.pending
+		while pending:
+			pending.pop().setResultFast(1)
+
+
+@asynchronous
+def generatorChain(driver, depth):
+	if depth == 0:
+		return (yield from driver.leaf())
+	return (yield from generatorChain(driver, depth - 1))
+
+
+async def nativeChain(driver, depth):
+	if depth == 0:
+		return await driver.leaf()
+	return await nativeChain(driver, depth - 1)
+
+
+def generatorSteps(driver, depth, steps):
+	for _ in range(steps):
+		yield from generatorChain(driver, depth)
+
+
+async def nativeSteps(driver, depth, steps):
+	for _ in range(steps):
+		await nativeChain(driver, depth)
+
+
+def run(steps = STEPS, depths = DEPTHS):
+	rows = []
+	for depth in depths:
+		row = [depth]
+		for main in (generatorSteps, nativeSteps):
+			best = inf
+			for _ in range(REPEAT):
+				driver = _Driver()
+				task = _Task(main(driver, depth, steps))
+				best = min(best, timed(driver.run, task))
+			row.append("%.0f" % (best / steps * 1e9))
+		rows.append(row)
+	report("Coroutine chains (ns per step)", ("depth", "yield from", "await"),
+	       rows)
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,126 @@
+""" Scheduling fairness benchmark.
+
+    Runs a busy producer, which keeps rescheduling itself with callSoon and
+    does a little work in each handle, alongside a ticker, which sleeps for a
+    millisecond at a time, and a line echo over a socket pair. Without a
+    budget the producer starves the timers and file events until it stops,
+    so the lateness of the ticks and the round trips of the echo are as
+    long as the producer runs. With a budget they are bounded by the time
+    taken to run that many handles. Each budget is reported with the
+    latency percentiles, the handles that the producer ran and the
+    dispatcher's starvation counters.
+"""
+import socket
+from time import perf_counter, time
+
+from ..aux import sleep
+from ..core import Future, async, await, callSoon, dispatcher
+from ..stats import Histogram
+from ..streams import ReadWrapper, WriteWrapper
+from ..usocket import _SocketWrapper
+from . import report
+
+BUDGETS = (None, 1024, 64)
+DURATION = 0.5
+TICK = 0.001
+WORK = 200
+
+
+def _producer(until, done, counter):
+	total = 0
+	for index in range(WORK):
+		total += index
+	counter[0] += 1
+	if time() < until:
+		callSoon(_producer, until, done, counter)
+	else:
+		done.setResult(None)
+
+
+def _ticker(until, lateness):
+	while time() < until:
+		due = time() + TICK
+		yield from sleep(TICK)
+		lateness.record(max(0.0, time() - due))
+
+
+def _echo(until, roundTrips):
+	left, right = socket.socketpair()
+	clientReader = ReadWrapper(_SocketWrapper(left))
+	clientWriter = WriteWrapper(_SocketWrapper(left))
+	serverReader = ReadWrapper(_SocketWrapper(right))
+	serverWriter = WriteWrapper(_SocketWrapper(right))
+	def server():
+		while True:
+			line = yield from serverReader.readline()
+			yield from serverWriter.write(line)
+			if line == b"stop\n":
+				return
+	task = async(server())
+	while time() < until:
+		sent = perf_counter()
+		yield from clientWriter.write(b"ping\n")
+		yield from clientReader.readline()
+		roundTrips.record(perf_counter() - sent)
+	yield from clientWriter.write(b"stop\n")
+	yield from clientReader.readline()
+	yield from task
+	for wrapper in (clientReader, clientWriter, serverReader, serverWriter):
+		wrapper.forceRelease()
+	left.close()
+	right.close()
+
+
+def measure(budget, duration = DURATION):
+	""" Run the workload with `budget' and return the lateness and round
+	    trip histograms, the producer's handle count and the change in the
+	    starvation counters.
+	"""
+	original = dispatcher.budget
+	before = dict(dispatcher.starvation)
+	dispatcher.setBudget(budget)
+	lateness = Histogram()
+	roundTrips = Histogram()
+	counter = [0]
+	try:
+		until = time() + duration
+		done = Future()
+		ticker = async(_ticker(until, lateness))
+		echo = async(_echo(until, roundTrips))
+		callSoon(_producer, until, done, counter)
+		await(done)
+		await(ticker)
+		await(echo)
+	finally:
+		dispatcher.setBudget(original)
+	starvation = {name: count - before[name]
+	              for name, count in dispatcher.starvation.items()}
+	return lateness, roundTrips, counter[0], starvation
+
+
+def _ms(value):
+	return "-" if value is None else "%.2f" % (value * 1000)
+
+
+def run(budgets = BUDGETS, duration = DURATION):
+	rows = []
+	counters = []
+	for budget in budgets:
+		lateness, roundTrips, produced, starvation = measure(budget, duration)
+		name = "none" if budget is None else budget
+		rows.append((name, produced, lateness.count,
+		             _ms(lateness.percentile(50)), _ms(lateness.percentile(99)),
+		             roundTrips.count, _ms(roundTrips.percentile(50)),
+		             _ms(roundTrips.percentile(99))))
+		counters.append((name,) + tuple(starvation[key]
+		                                for key in sorted(starvation)))
+	report("Busy producer against timers and IO for %.1f s (latency in ms)"
+	       % duration,
+	       ("budget", "produced", "ticks", "tick p50", "tick p99",
+	        "echoes", "echo p50", "echo p99"), rows)
+	report("Starvation counters", ("budget",) + tuple(sorted(starvation)),
+	       counters)
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,91 @@
+""" Future allocation benchmark.
+
+    Measures the memory taken by a Future, and by a _Task, in bytes and in
+    allocated blocks, using tracemalloc. It then runs the line echo of the
+    registration benchmark and counts the Futures created, and the time taken,
+    per round trip.
+"""
+import tracemalloc
+
+from ..core import Future, _Task
+from . import timed, report
+from .registration import echo
+
+COUNT = 100000
+LINES = 10000
+
+
+def _done():
+	future = Future()
+	future.setResult(None)
+	return future
+
+
+def _failed():
+	future = Future()
+	future.setError(ValueError())
+	try:
+		future.getResult()
+	except ValueError:
+		pass
+	return future
+
+
+def _task():
+	def gen():
+		yield
+	return _Task(gen())
+
+
+def _blocks(snapshot):
+	return sum(stat.count for stat in snapshot.statistics("filename"))
+
+
+def footprint(factory, count = COUNT):
+	""" Returns the bytes and blocks allocated per object made by `factory'.
+	"""
+	objects = [None] * count
+	tracemalloc.start()
+	before = tracemalloc.take_snapshot()
+	for index in range(count):
+		objects[index] = factory()
+	after = tracemalloc.take_snapshot()
+	tracemalloc.stop()
+	size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+	return size / count, (_blocks(after) - _blocks(before)) / count
+
+
+def countFutures(function, *args):
+	""" Returns the number of Futures created while calling `function'.
+	"""
+	created = [0]
+	init = Future.__init__
+	def counted(self):
+		created[0] += 1
+		init(self)
+	Future.__init__ = counted
+	try:
+		function(*args)
+	finally:
+		Future.__init__ = init
+	return created[0]
+
+
+def run(count = COUNT, lines = LINES):
+	rows = []
+	for name, factory in (("Future, result", _done),
+	                      ("Future, error", _failed),
+	                      ("_Task", _task)):
+		size, blocks = footprint(factory, count)
+		rows.append((name, "%.0f" % size, "%.1f" % blocks))
+	report("Footprint (per object)", ("object", "bytes", "blocks"), rows)
+	
+	futures = countFutures(echo, lines, 1)
+	elapsed = timed(echo, lines, 1)
+	report("Echo of %d lines (per round trip)" % lines,
+	       ("Futures", "us"),
+	       [("%.1f" % (futures / lines), "%.1f" % (elapsed / lines * 1e6))])
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,57 @@
+""" Fan-out benchmark.
+
+    Awaits a number of coroutines, each of which sleeps for a fixed time,
+    first one after another, as awaitAll used to, and then concurrently with
+    gather, and reports the latency of each. It then measures the cost per
+    item of gather and awaitAny over Futures that are completed through
+    callLater.
+"""
+from ..aux import sleep
+from ..core import Future, await, awaitAny, callLater, gather
+from . import timed, report
+
+FANOUT = (1, 10, 100)
+DELAY = 0.01
+ITEMS = 100000
+
+
+def _sleeper():
+	yield from sleep(DELAY)
+
+
+def _sequential(count):
+	def main():
+		for gen in [_sleeper() for _ in range(count)]:
+			yield from gen
+	await(main())
+
+
+def _gathered(count):
+	await(gather(*[_sleeper() for _ in range(count)]))
+
+
+def _futures(count):
+	futures = [Future() for _ in range(count)]
+	for future in futures:
+		callLater(future.setResult, None)
+	return futures
+
+
+def run(fanout = FANOUT, items = ITEMS):
+	rows = []
+	for count in fanout:
+		rows.append((count, "%.1f" % (timed(_sequential, count) * 1000),
+		             "%.1f" % (timed(_gathered, count) * 1000)))
+	report("Fan-out of coroutines sleeping %.0f ms (latency in ms)"
+	       % (DELAY * 1000), ("coroutines", "sequential", "gather"), rows)
+	rows = []
+	for name, combine in (("gather", gather), ("awaitAny", awaitAny)):
+		futures = _futures(items)
+		elapsed = timed(lambda: await(combine(*futures)))
+		rows.append((name, "%.0f" % (items / elapsed)))
+	report("Futures of %d combined (items per second)" % items,
+	       ("primitive", "items per second"), rows)
+
+
+if __name__ == "__main__":
+	run()
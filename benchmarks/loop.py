@@ -0,0 +1,69 @@
+""" Run loop benchmark.
+
+    Measures the rate at which a dispatcher runs ready handles, driving it one
+    handle at a time through runNextHandle, as the loop used to, and a batch
+    at a time through runOnce. Each of a number of concurrent chains of
+    handles schedules its successor when it runs, either at the back of the
+    queue (callLater) or at the front (callSoon), until the required number
+    of handles has been run. The best of several runs is reported.
+"""
+from ..events import Dispatcher
+from ..timers import inf
+from . import timed, report
+
+HANDLES = 200000
+CHAINS = (1, 100, 10000)
+REPEAT = 5
+
+
+class _Runner:
+	def __init__(self):
+		self.running = True
+
+
+def _chains(dispatcher, runner, chains, handles, highPriority):
+	if highPriority:
+		schedule = dispatcher.scheduleHighPriority
+	else:
+		schedule = dispatcher.scheduleMediumPriority
+	left = [handles]
+	def handle():
+		left[0] -= 1
+		if left[0] > 0:
+			schedule(handle)
+		else:
+			runner.running = False
+	for _ in range(chains):
+		schedule(handle)
+
+
+def oneAtATime(dispatcher, runner):
+	while runner.running:
+		dispatcher.runNextHandle()
+
+
+def batched(dispatcher, runner):
+	while runner.running:
+		dispatcher.runOnce(runner)
+
+
+def run(handles = HANDLES, chains = CHAINS):
+	rows = []
+	for count in chains:
+		for highPriority in (False, True):
+			row = [count, "callSoon" if highPriority else "callLater"]
+			for loop in (oneAtATime, batched):
+				best = inf
+				for _ in range(REPEAT):
+					dispatcher = Dispatcher()
+					runner = _Runner()
+					_chains(dispatcher, runner, count, handles, highPriority)
+					best = min(best, timed(loop, dispatcher, runner))
+				row.append("%.0f" % (handles / best))
+			rows.append(row)
+	report("Run loop (handles per second)",
+	       ("chains", "scheduled by", "runNextHandle", "runOnce"), rows)
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,60 @@
+""" Nested await benchmark.
+
+    Runs a number of concurrent tasks, each of which repeatedly calls a
+    synchronous function that awaits a Future from inside the task's step,
+    so that every await is nested inside a handle. The Futures are completed
+    through callLater. This is timed with the pool of loop greenlets
+    disabled and enabled, and the number of greenlets created for each run
+    is reported alongside. Concurrent nested awaits each hold a greenlet,
+    so the pool matters most with many tasks. The best of several runs is
+    reported.
+"""
+from ..core import Future, async, await, callLater, greenletPoolStats
+from ..core import setGreenletPool
+from ..timers import inf
+from . import timed, report
+
+AWAITS = 20000
+TASKS = (1, 10, 100)
+REPEAT = 3
+
+
+def _blocking():
+	future = Future()
+	callLater(future.setResult, None)
+	return await(future)
+
+
+def _task(count):
+	for _ in range(count):
+		_blocking()
+	yield from ()
+
+
+def _run(tasks, awaits):
+	def main():
+		running = [async(_task(awaits // tasks)) for _ in range(tasks)]
+		for task in running:
+			yield from task
+	await(main())
+
+
+def run(awaits = AWAITS, tasks = TASKS):
+	rows = []
+	for count in tasks:
+		row = [count]
+		for maxParked in (0, 64):
+			setGreenletPool(maxParked = maxParked)
+			before = greenletPoolStats()["created"]
+			best = inf
+			for _ in range(REPEAT):
+				best = min(best, timed(_run, count, awaits))
+			created = greenletPoolStats()["created"] - before
+			row += ["%.0f" % (awaits / best), created // REPEAT]
+		rows.append(row)
+	report("Nested await() (awaits per second, greenlets created per run)",
+	       ("tasks", "no pool", "created", "pool", "created"), rows)
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,73 @@
+""" Poller backend benchmark.
+
+    Runs the line echo of the registration benchmark, and a websocket echo
+    over a loopback TCP connection, on the global dispatcher with each of
+    the poller backends that is available here in turn, and reports the
+    round trips per second. The backend can also be chosen for any other
+    benchmark, when it is started, through the UNSTUCK_POLLER environment
+    variable, for example
+    `UNSTUCK_POLLER=io_uring python -m unstuck.benchmarks'.
+"""
+from ..core import async, await, dispatcher
+from ..pollers import availablePollers
+from ..usocket import USocket
+from ..websockets.websocket import Websocket
+from . import timed, report
+from .registration import echo
+
+LINES = 10000
+DEPTHS = (1, 16)
+MESSAGES = 5000
+MESSAGE = b"x" * 64
+
+
+def websocketEcho(messages):
+	""" Echo `messages' websocket messages over a loopback connection.
+	"""
+	listener = USocket.listener(("127.0.0.1", 0))
+	address = listener.socket.getsockname()
+	
+	def server():
+		connection = yield from listener.accept()
+		websocket = Websocket(connection)
+		for _ in range(messages):
+			message = yield from websocket.recv()
+			yield from websocket.send(message)
+		yield from websocket.close()
+	
+	def client():
+		connection = USocket()
+		yield from connection.connect(address)
+		websocket = Websocket(connection, receiveMask = False,
+		                      sendMask = True)
+		for _ in range(messages):
+			yield from websocket.send(MESSAGE)
+			yield from websocket.recv()
+		yield from websocket.close()
+	
+	serverTask = async(server())
+	await(client())
+	await(serverTask)
+	await(listener.close())
+
+
+def run(lines = LINES, depths = DEPTHS, messages = MESSAGES):
+	original = dispatcher.pollerClass
+	rows = []
+	try:
+		for name in availablePollers():
+			dispatcher.setPoller(name)
+			row = [name]
+			for depth in depths:
+				row.append("%.0f" % (lines / timed(echo, lines, depth)))
+			row.append("%.0f" % (messages / timed(websocketEcho, messages)))
+			rows.append(row)
+	finally:
+		dispatcher.setPoller(original)
+	report("Echo round trips per second by poller",
+	       ("poller",) + tuple("lines, depth %d" % depth for depth in depths)
+	       + ("websocket",), rows)
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,45 @@
+""" Process executor benchmark.
+
+    Sends payloads of increasing size through a ProcessExecutor to a worker
+    that reverses them, with the payloads passed either through shared memory
+    segments or pickled down the pipe, and reports the time per call.
+"""
+from ..core import await
+from ..processes import ProcessExecutor
+from ..timers import inf
+from . import timed, report
+
+SIZES = (1024, 65536, 1 << 20, 16 << 20)
+CALLS = 20
+
+
+def _reverse(data):
+	return data[::-1]
+
+
+def _calls(executor, payload, calls):
+	def main():
+		for _ in range(calls):
+			yield from executor.run(_reverse, payload)
+	await(main())
+
+
+def run(sizes = SIZES, calls = CALLS):
+	rows = []
+	for size in sizes:
+		payload = bytes(range(256)) * (size // 256)
+		row = [size]
+		for threshold in (inf, 0):
+			executor = ProcessExecutor(1, threshold)
+			# Start the worker before timing.
+			_calls(executor, b"", 1)
+			elapsed = timed(_calls, executor, payload, calls)
+			executor.shutdown()
+			row.append("%.0f" % (elapsed / calls * 1e6))
+		rows.append(row)
+	report("ProcessExecutor round trip (us per call)",
+	       ("bytes", "pickled", "shared memory"), rows)
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,65 @@
+""" Queue variant benchmark.
+
+    Moves a million items through the FIFO Queue, the LifoQueue and the
+    PriorityQueue, in three ways: putting them all into an unbounded queue
+    and getting them one at a time, the same with `getMany', and streaming
+    them from a producer to a consumer through a bounded queue, where both
+    sides keep blocking on each other. The priorities are a fixed shuffle,
+    so the heap of the PriorityQueue does real work, and every row is
+    reported as items per second.
+"""
+import random
+
+from ..core import async, await
+from ..queue import LifoQueue, PriorityQueue, Queue
+from . import timed, report
+
+ITEMS = 1000000
+BATCH = 256
+LENGTH = 1000
+KINDS = (("fifo", Queue), ("lifo", LifoQueue), ("priority", PriorityQueue))
+
+
+def _fillThenGet(kind, items):
+	queue = kind()
+	queue.putMany(items)
+	for _ in range(len(items)):
+		yield from queue.get()
+
+
+def _fillThenGetMany(kind, items):
+	queue = kind()
+	queue.putMany(items)
+	remaining = len(items)
+	while remaining > 0:
+		remaining -= len((yield from queue.getMany(BATCH)))
+
+
+def _stream(kind, items):
+	queue = kind(LENGTH)
+	def produce():
+		for item in items:
+			yield from queue.put(item)
+	producer = async(produce())
+	for _ in range(len(items)):
+		yield from queue.get()
+	yield from producer
+
+
+def run(items = ITEMS):
+	values = list(range(items))
+	random.Random(1).shuffle(values)
+	rows = []
+	for name, kind in KINDS:
+		row = [name]
+		for case in (_fillThenGet, _fillThenGetMany, _stream):
+			elapsed = timed(lambda: await(case(kind, values)))
+			row.append("%.0f" % (items / elapsed))
+		rows.append(row)
+	report("Queue variants with %d items (items per second)" % items,
+	       ("queue", "put, get", "put, getMany(%d)" % BATCH,
+	        "stream, length %d" % LENGTH), rows)
+
+
+if __name__ == "__main__":
+	run()
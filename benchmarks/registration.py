@@ -0,0 +1,89 @@
+""" File event registration benchmark.
+
+    Runs a line echo over a socket pair, with a ReadWrapper and WriteWrapper on
+    each end, and counts the epoll calls made by the dispatcher. The client
+    either waits for each line to come back before sending the next, or
+    pipelines its lines in batches. The workload is run with level-triggered
+    and edge-triggered polling, each with and without change-list mode, on the
+    global dispatcher.
+"""
+import socket
+
+from ..core import async, await, dispatcher
+from ..streams import ReadWrapper, WriteWrapper
+from ..usocket import _SocketWrapper
+from . import timed, report
+
+LINES = 10000
+DEPTHS = (1, 16)
+CALLS = ("register", "modify", "unregister", "poll")
+MODES = (("level", False, False), ("level, change-list", False, True),
+         ("edge", True, False), ("edge, change-list", True, True))
+
+
+class _CountingPoller:
+	""" Proxy for the dispatcher's epoll object that counts the calls made.
+	"""
+	def __init__(self, inner):
+		self.inner = inner
+		self.counts = dict.fromkeys(CALLS, 0)
+	
+	def __getattr__(self, name):
+		method = getattr(self.inner, name)
+		def counted(*args):
+			self.counts[name] += 1
+			return method(*args)
+		return counted
+
+
+def echo(lines, depth):
+	left, right = socket.socketpair()
+	leftReader = ReadWrapper(_SocketWrapper(left))
+	leftWriter = WriteWrapper(_SocketWrapper(left))
+	rightReader = ReadWrapper(_SocketWrapper(right))
+	rightWriter = WriteWrapper(_SocketWrapper(right))
+	
+	def server():
+		for _ in range(lines):
+			line = yield from rightReader.readline()
+			yield from rightWriter.write(line)
+	
+	def client():
+		for start in range(0, lines, depth):
+			for index in range(start, start + depth):
+				yield from leftWriter.write(b"line %d\n" % index)
+			for index in range(start, start + depth):
+				yield from leftReader.readline()
+	
+	serverTask = async(server())
+	await(client())
+	await(serverTask)
+	for wrapper in (leftReader, leftWriter, rightReader, rightWriter):
+		wrapper.forceRelease()
+	left.close()
+	right.close()
+
+
+def run(lines = LINES, depths = DEPTHS):
+	original = dispatcher.pollingObject
+	try:
+		for depth in depths:
+			rows = []
+			for name, edgeTriggered, coalesceChanges in MODES:
+				dispatcher.setEdgeTriggered(edgeTriggered)
+				dispatcher.setCoalesceChanges(coalesceChanges)
+				poller = dispatcher.pollingObject = _CountingPoller(original)
+				elapsed = timed(echo, lines, depth)
+				dispatcher.setCoalesceChanges(False)
+				rows.append((name,) +
+				            tuple(poller.counts[call] for call in CALLS) +
+				            ("%.1f" % (elapsed / lines * 1e6),))
+			report("Echo of %d lines, %d in flight (epoll calls, us per line)"
+			       % (lines, depth), ("mode",) + CALLS + ("time",), rows)
+	finally:
+		dispatcher.pollingObject = original
+		dispatcher.setEdgeTriggered(False)
+
+
+if __name__ == "__main__":
+	run()
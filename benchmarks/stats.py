@@ -0,0 +1,33 @@
+""" Stats overhead benchmark.
+
+    Runs the handle chains of the loop benchmark through runOnce with the
+    dispatcher's stats off and on. With the stats off the dispatcher runs
+    its ordinary methods, so the first column should match the runOnce
+    column of the loop benchmark. The best of several runs is reported.
+"""
+from ..events import Dispatcher
+from ..timers import inf
+from . import timed, report
+from .loop import HANDLES, CHAINS, REPEAT, _Runner, _chains, batched
+
+
+def run(handles = HANDLES, chains = CHAINS):
+	rows = []
+	for count in chains:
+		row = [count]
+		for enabled in (False, True):
+			best = inf
+			for _ in range(REPEAT):
+				dispatcher = Dispatcher()
+				dispatcher.setStats(enabled)
+				runner = _Runner()
+				_chains(dispatcher, runner, count, handles, False)
+				best = min(best, timed(batched, dispatcher, runner))
+			row.append("%.0f" % (handles / best))
+		rows.append(row)
+	report("Stats overhead (handles per second)",
+	       ("chains", "stats off", "stats on"), rows)
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,426 @@
+""" Benchmark suite for the core primitives, compared against asyncio.
+
+    Each case is a pair of implementations of the same workload, one on the
+    unstuck dispatcher and one on a fresh asyncio event loop, which are run
+    on the same machine, one after the other. A case is timed from inside
+    the loop, so that setting up and closing the asyncio loop is not
+    counted, and the best of several runs is kept.
+
+    Where asyncio has no equivalent of an unstuck primitive the nearest
+    thing is used: a nested await is compared with an ordinary await of the
+    same Future, and websocket framing, which asyncio does not provide, is
+    compared with the same header handling written over a StreamReader.
+    The websocket frames are unmasked, so that the framing, rather than
+    the masking of the payload, is measured.
+
+    The suite is run from the command line with
+    `python -m unstuck.benchmarks', which can write the results as JSON.
+"""
+import asyncio
+import socket
+import struct
+from time import perf_counter, time
+
+from ..aux import controlYield, doneFuture
+from ..core import Future, async, await, callAt, callLater, callSoon
+from ..queue import Queue
+from ..streams import ReadWrapper, WriteWrapper
+from ..usocket import _SocketWrapper
+from ..websockets.framing import OP_BINARY, readFragment, writeFragment
+
+__all__ = ["CASES", "runCase", "runSuite"]
+
+LINE = b"x" * 63 + b"\n"
+CHUNK = 64
+BLOCK = 1000
+PAYLOAD = b"x" * 125
+BUFFER = 1 << 16
+
+
+def _ticker(count, done):
+	""" Returns a callback that completes `done' on its `count'th call.
+	"""
+	remaining = [count]
+	def tick():
+		remaining[0] -= 1
+		if remaining[0] == 0:
+			done(None)
+	return tick
+
+
+def _noop():
+	return None
+	yield
+
+
+async def _asyncioNoop():
+	pass
+
+
+# Future create/resolve
+
+def _futureResolve(count):
+	for _ in range(count):
+		future = Future()
+		future.setResult(None)
+		yield from future
+
+
+async def _asyncioFutureResolve(count):
+	loop = asyncio.get_event_loop()
+	for _ in range(count):
+		future = loop.create_future()
+		future.set_result(None)
+		await future
+
+
+# Future resolved after the waiter has suspended
+
+def _futureWake(count):
+	for _ in range(count):
+		future = Future()
+		callSoon(future.setResult, None)
+		yield from future
+
+
+async def _asyncioFutureWake(count):
+	loop = asyncio.get_event_loop()
+	for _ in range(count):
+		future = loop.create_future()
+		loop.call_soon(future.set_result, None)
+		await future
+
+
+# Task spawn and step
+
+def _taskSpawn(count):
+	tasks = [async(_noop()) for _ in range(count)]
+	for task in tasks:
+		yield from task
+
+
+async def _asyncioTaskSpawn(count):
+	loop = asyncio.get_event_loop()
+	tasks = [loop.create_task(_asyncioNoop()) for _ in range(count)]
+	for task in tasks:
+		await task
+
+
+def _taskStep(count):
+	for _ in range(count):
+		yield from controlYield
+
+
+async def _asyncioTaskStep(count):
+	for _ in range(count):
+		await asyncio.sleep(0)
+
+
+# Queue ping-pong
+
+def _queuePingPong(count):
+	there = Queue()
+	back = Queue()
+	def pong():
+		for _ in range(count):
+			value = yield from there.get()
+			yield from back.put(value)
+	task = async(pong())
+	for index in range(count):
+		yield from there.put(index)
+		yield from back.get()
+	yield from task
+
+
+async def _asyncioQueuePingPong(count):
+	there = asyncio.Queue()
+	back = asyncio.Queue()
+	async def pong():
+		for _ in range(count):
+			value = await there.get()
+			await back.put(value)
+	task = asyncio.get_event_loop().create_task(pong())
+	for index in range(count):
+		await there.put(index)
+		await back.get()
+	await task
+
+
+# Callback and timer throughput
+
+def _callSoon(count):
+	done = Future()
+	tick = _ticker(count, done.setResult)
+	for _ in range(count):
+		callSoon(tick)
+	yield from done
+
+
+async def _asyncioCallSoon(count):
+	loop = asyncio.get_event_loop()
+	done = loop.create_future()
+	tick = _ticker(count, done.set_result)
+	for _ in range(count):
+		loop.call_soon(tick)
+	await done
+
+
+def _timers(count):
+	done = Future()
+	tick = _ticker(count, done.setResult)
+	now = time()
+	for index in range(count):
+		callAt(now + (index % 100) * 1e-6, tick)
+	yield from done
+
+
+async def _asyncioTimers(count):
+	loop = asyncio.get_event_loop()
+	done = loop.create_future()
+	tick = _ticker(count, done.set_result)
+	now = loop.time()
+	for index in range(count):
+		loop.call_at(now + (index % 100) * 1e-6, tick)
+	await done
+
+
+# Nested await
+
+def _nestedAwait(count):
+	def blocking():
+		future = Future()
+		callLater(future.setResult, None)
+		return await(future)
+	for _ in range(count):
+		blocking()
+	return
+	yield
+
+
+async def _asyncioNestedAwait(count):
+	loop = asyncio.get_event_loop()
+	for _ in range(count):
+		future = loop.create_future()
+		loop.call_soon(future.set_result, None)
+		await future
+
+
+# Stream reads over a socket pair
+
+def _streamRead(count, readline):
+	left, right = socket.socketpair()
+	reader = ReadWrapper(_SocketWrapper(left), BUFFER // 2, BUFFER)
+	writer = WriteWrapper(_SocketWrapper(right))
+	def write():
+		for start in range(0, count, BLOCK):
+			yield from writer.write(LINE * min(BLOCK, count - start))
+	task = async(write())
+	try:
+		if readline:
+			for _ in range(count):
+				yield from reader.readline()
+		else:
+			for _ in range(count):
+				yield from reader.read(CHUNK)
+		yield from task
+	finally:
+		reader.forceRelease()
+		writer.forceRelease()
+		left.close()
+		right.close()
+
+
+async def _asyncioStreamRead(count, readline):
+	loop = asyncio.get_event_loop()
+	left, right = socket.socketpair()
+	# Both ends are kept, as a StreamWriter closes its socket when it is
+	# collected.
+	reader, leftWriter = await asyncio.open_connection(sock = left,
+	                                                   limit = BUFFER)
+	rightReader, writer = await asyncio.open_connection(sock = right)
+	async def write():
+		for start in range(0, count, BLOCK):
+			writer.write(LINE * min(BLOCK, count - start))
+			await writer.drain()
+	task = loop.create_task(write())
+	try:
+		if readline:
+			for _ in range(count):
+				await reader.readline()
+		else:
+			for _ in range(count):
+				await reader.readexactly(CHUNK)
+		await task
+	finally:
+		writer.close()
+		leftWriter.close()
+
+
+def _readline(count):
+	return _streamRead(count, True)
+
+
+def _read(count):
+	return _streamRead(count, False)
+
+
+def _asyncioReadline(count):
+	return _asyncioStreamRead(count, True)
+
+
+def _asyncioRead(count):
+	return _asyncioStreamRead(count, False)
+
+
+# Websocket framing
+
+class _MemorySocket:
+	""" Stands in for a USocket, sending to and receiving from memory.
+	"""
+	def __init__(self, data = b""):
+		self.data = data
+		self.offset = 0
+		self.sent = []
+	
+	def send(self, data):
+		self.sent.append(data)
+		return doneFuture
+	
+	def recv(self, length):
+		future = Future()
+		future.setResult(self.data[self.offset:self.offset + length])
+		self.offset += length
+		return future
+
+
+class _MemoryWriter:
+	""" Stands in for an asyncio StreamWriter, writing to memory.
+	"""
+	def __init__(self):
+		self.sent = []
+	
+	def write(self, data):
+		self.sent.append(data)
+	
+	async def drain(self):
+		pass
+
+
+def _frames(count):
+	header = struct.pack("!BB", 0x80 | OP_BINARY, len(PAYLOAD))
+	return (header + PAYLOAD) * count
+
+
+def _frameEncode(count):
+	memory = _MemorySocket()
+	for _ in range(count):
+		yield from writeFragment(memory, False, OP_BINARY, PAYLOAD, True)
+
+
+def _frameDecode(count):
+	memory = _MemorySocket(_frames(count))
+	for _ in range(count):
+		yield from readFragment(memory, False)
+
+
+async def _asyncioFrameEncode(count):
+	writer = _MemoryWriter()
+	for _ in range(count):
+		length = len(PAYLOAD)
+		if length < 0x7e:
+			header = struct.pack("!BB", 0x80 | OP_BINARY, length)
+		elif length < 0x10000:
+			header = struct.pack("!BBH", 0x80 | OP_BINARY, 126, length)
+		else:
+			header = struct.pack("!BBQ", 0x80 | OP_BINARY, 127, length)
+		writer.write(header + PAYLOAD)
+		await writer.drain()
+
+
+async def _asyncioFrameDecode(count):
+	reader = asyncio.StreamReader(limit = BUFFER)
+	reader.feed_data(_frames(count))
+	reader.feed_eof()
+	for _ in range(count):
+		head, = struct.unpack("!H", await reader.readexactly(2))
+		if head & 0x7000:
+			raise(Exception("Reserved bits must be 0"))
+		opcode = (head & 0x0f00) >> 8
+		length = head & 0x7f
+		if length == 126:
+			length, = struct.unpack("!H", await reader.readexactly(2))
+		elif length == 127:
+			length, = struct.unpack("!Q", await reader.readexactly(8))
+		await reader.readexactly(length)
+		if opcode not in (0, 1, 2, 8, 9, 10):
+			raise(Exception("Invalid opcode"))
+
+
+# The cases, as (name, operations, unstuck, asyncio)
+
+CASES = (
+	("future.resolve", 200000, _futureResolve, _asyncioFutureResolve),
+	("future.wake", 100000, _futureWake, _asyncioFutureWake),
+	("task.spawn", 100000, _taskSpawn, _asyncioTaskSpawn),
+	("task.step", 100000, _taskStep, _asyncioTaskStep),
+	("queue.pingpong", 50000, _queuePingPong, _asyncioQueuePingPong),
+	("loop.callSoon", 200000, _callSoon, _asyncioCallSoon),
+	("loop.timers", 100000, _timers, _asyncioTimers),
+	("await.nested", 50000, _nestedAwait, _asyncioNestedAwait),
+	("stream.read", 50000, _read, _asyncioRead),
+	("stream.readline", 50000, _readline, _asyncioReadline),
+	("websocket.encode", 100000, _frameEncode, _asyncioFrameEncode),
+	("websocket.decode", 100000, _frameDecode, _asyncioFrameDecode),
+)
+
+
+def _runUnstuck(function, count):
+	start = perf_counter()
+	await(function(count))
+	return perf_counter() - start
+
+
+def _runAsyncio(function, count):
+	loop = asyncio.new_event_loop()
+	async def main():
+		start = perf_counter()
+		await function(count)
+		return perf_counter() - start
+	try:
+		return loop.run_until_complete(main())
+	finally:
+		loop.close()
+
+
+def _best(run, function, count, repeat):
+	return min(run(function, count) for _ in range(repeat))
+
+
+def runCase(case, scale = 1.0, repeat = 3):
+	""" Run one case of CASES and return its results as a dict.
+	
+	    The operations of the case are multiplied by `scale' and each side
+	    is run `repeat' times, of which the fastest run is kept.
+	"""
+	name, operations, unstuck, other = case
+	count = max(1, int(operations * scale))
+	unstuckTime = _best(_runUnstuck, unstuck, count, repeat)
+	asyncioTime = _best(_runAsyncio, other, count, repeat)
+	return {"operations": count,
+	        "unstuck": {"seconds": unstuckTime,
+	                    "perSecond": count / unstuckTime},
+	        "asyncio": {"seconds": asyncioTime,
+	                    "perSecond": count / asyncioTime},
+	        "speedup": asyncioTime / unstuckTime}
+
+
+def runSuite(names = None, scale = 1.0, repeat = 3):
+	""" Run the cases of CASES whose names start with any of `names', or all
+	    of them, and return a dict of their results keyed by name.
+	"""
+	results = {}
+	for case in CASES:
+		if names and not any(case[0].startswith(name) for name in names):
+			continue
+		results[case[0]] = runCase(case, scale, repeat)
+	return results
@@ -0,0 +1,62 @@
+""" TaskGroup benchmark.
+
+    Runs groups of increasing size, each child a coroutine that completes
+    on its first step, and reports the cost per child, which should not grow
+    with the size of the group. The children are spawned from a coroutine
+    that yields between batches, so that many are running at once. It then
+    measures how long a group of sleeping children takes to be cancelled
+    when one of them fails.
+"""
+from ..aux import TaskGroup, TaskGroupError, sleep
+from ..core import await
+from . import timed, report
+
+SIZES = (1000, 10000, 100000)
+BATCH = 1000
+CANCELLED = 10000
+
+
+def _child():
+	return None
+	yield
+
+
+def _failing():
+	yield from sleep(0)
+	raise(Exception("Child failed"))
+
+
+def _group(size):
+	group = TaskGroup()
+	for index in range(size):
+		group.spawn(_child())
+		if index % BATCH == 0:
+			yield from sleep(0)
+	yield from group.wait()
+
+
+def _cancelled(size):
+	group = TaskGroup()
+	for _ in range(size):
+		group.spawn(sleep(60))
+	group.spawn(_failing())
+	try:
+		yield from group.wait()
+	except TaskGroupError:
+		pass
+
+
+def run(sizes = SIZES, cancelled = CANCELLED):
+	rows = []
+	for size in sizes:
+		elapsed = timed(lambda: await(_group(size)))
+		rows.append((size, "%.2f" % (elapsed / size * 1e6)))
+	report("TaskGroup children (microseconds per child)",
+	       ("children", "per child"), rows)
+	elapsed = timed(lambda: await(_cancelled(cancelled)))
+	report("Cancelling a group on the first failure",
+	       ("children", "ms"), [(cancelled, "%.1f" % (elapsed * 1000))])
+
+
+if __name__ == "__main__":
+	run()
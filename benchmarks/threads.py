@@ -0,0 +1,46 @@
+""" Thread executor benchmark.
+
+    Submits batches of trivial calls to a ThreadExecutor and waits for all of
+    them, reporting the calls completed per second and the number of times
+    the loop was woken to collect the completions.
+"""
+from ..core import await
+from ..threads import ThreadExecutor
+from . import timed, report
+from .threadsafe import WakeCounter
+
+CALLS = 100000
+BATCHES = (1, 16, 256)
+WORKERS = (1, 4, 16)
+
+
+def _nothing():
+	pass
+
+
+def _runBatches(executor, calls, batch):
+	def main():
+		for _ in range(calls // batch):
+			futures = [executor.run(_nothing) for _ in range(batch)]
+			for future in futures:
+				yield from future
+	await(main())
+
+
+def run(calls = CALLS, batches = BATCHES, workers = WORKERS):
+	rows = []
+	for count in workers:
+		for batch in batches:
+			executor = ThreadExecutor(count)
+			counter = WakeCounter()
+			elapsed = timed(_runBatches, executor, calls, batch)
+			executor.shutdown()
+			counter.close()
+			rows.append((count, batch, "%.0f" % (calls / elapsed),
+			             counter.wakeups))
+	report("ThreadExecutor, %d calls" % calls,
+	       ("workers", "batch", "calls per second", "wake-ups"), rows)
+
+
+if __name__ == "__main__":
+	run()
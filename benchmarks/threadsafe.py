@@ -0,0 +1,112 @@
+""" Cross-thread scheduling benchmark.
+
+    Starts 1 to 16 producer threads, which between them schedule a fixed
+    number of handles on the loop with callSoonThreadsafe, and reports the
+    handles run per second and the number of times the loop was woken to
+    collect them. The producers only write to the loop's Waker for the first
+    handle after each collection, so the wake-ups should stay far below the
+    number of handles.
+
+    The same is then done with values put into a ThreadSafeQueue, one at a
+    time and in chunks with putMany, and taken on the loop with getMany.
+"""
+import threading
+
+from ..core import Future, await, callSoonThreadsafe, dispatcher
+from ..events import Waker
+from ..queue import ThreadSafeQueue
+from . import timed, report
+
+CALLS = 200000
+PRODUCERS = (1, 2, 4, 8, 16)
+ITEMS = 2000000
+CHUNK = 1000
+BATCH = 4096
+
+
+class WakeCounter:
+	""" Counts the wake-ups of the dispatcher's Waker until closed.
+	"""
+	def __init__(self):
+		self.wakeups = 0
+		self.waker = dispatcher.waker
+		self.waker.drain = self.__drain
+	
+	def __drain(self):
+		self.wakeups += 1
+		Waker.drain(self.waker)
+	
+	def close(self):
+		del self.waker.drain
+
+
+def _produce(calls, producers):
+	done = Future()
+	remaining = [calls]
+	def handle():
+		remaining[0] -= 1
+		if remaining[0] == 0:
+			done.setResult(None)
+	def producer(count):
+		for _ in range(count):
+			callSoonThreadsafe(handle)
+	threads = [threading.Thread(target = producer,
+	                            args = (calls // producers,))
+	           for _ in range(producers)]
+	for thread in threads:
+		thread.start()
+	await(done)
+	for thread in threads:
+		thread.join()
+
+
+def _consume(queue, items):
+	remaining = items
+	while remaining > 0:
+		remaining -= len((yield from queue.getMany(BATCH)))
+
+
+def _transfer(items, producers, chunk):
+	queue = ThreadSafeQueue()
+	def producer(count):
+		if chunk is None:
+			for index in range(count):
+				queue.put(index)
+		else:
+			values = list(range(chunk))
+			for _ in range(count // chunk):
+				queue.putMany(values)
+	threads = [threading.Thread(target = producer,
+	                            args = (items // producers,))
+	           for _ in range(producers)]
+	for thread in threads:
+		thread.start()
+	await(_consume(queue, items))
+	for thread in threads:
+		thread.join()
+
+
+def run(calls = CALLS, producers = PRODUCERS, items = ITEMS):
+	rows = []
+	for count in producers:
+		counter = WakeCounter()
+		elapsed = timed(_produce, calls - calls % count, count)
+		counter.close()
+		rows.append((count, "%.0f" % (calls / elapsed), counter.wakeups))
+	report("callSoonThreadsafe, %d calls" % calls,
+	       ("producers", "calls per second", "wake-ups"), rows)
+	for chunk in (None, CHUNK):
+		rows = []
+		for count in producers:
+			total = items - items % (count * (chunk or 1))
+			counter = WakeCounter()
+			elapsed = timed(_transfer, total, count, chunk)
+			counter.close()
+			rows.append((count, "%.0f" % (total / elapsed), counter.wakeups))
+		name = "put" if chunk is None else "putMany(%d)" % chunk
+		report("ThreadSafeQueue, %d items, %s" % (items, name),
+		       ("producers", "items per second", "wake-ups"), rows)
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,77 @@
+""" Timer store benchmark.
+
+    Compares the TimingWheel against the HeapTimerStore with 1k, 100k and 1M
+    pending timers. Timers are spread uniformly over the next minute, then the
+    clock is advanced as the event loop would advance it, sleeping until the
+    next timer is due but waking at least once per millisecond, until all
+    have expired. The clock is simulated so that the results measure only the
+    stores themselves.
+"""
+import random
+
+from ..timers import HeapTimerStore, TimerHandle, TimingWheel
+from . import timed, report
+
+SIZES = (1000, 100000, 1000000)
+SPREAD = 60.0
+STEP = 0.001
+
+
+def insertAll(store, deadlines):
+	push = store.push
+	timers = [TimerHandle(when, None, store) for when in deadlines]
+	for timer in timers:
+		push(timer)
+	return timers
+
+
+def cancelMost(timers):
+	for index, timer in enumerate(timers):
+		if index % 10:
+			timer.cancel()
+
+
+def expireAll(store, start):
+	fired = []
+	now = start
+	while len(store) > 0:
+		now += max(store.timeToNext(now), STEP)
+		store.expire(now, fired.append)
+	return fired
+
+
+def physicalSize(store):
+	if isinstance(store, HeapTimerStore):
+		return len(store.heap)
+	return store.size
+
+
+def run(sizes = SIZES):
+	rows = []
+	cancelRows = []
+	for size in sizes:
+		start = 1000000.0
+		deadlines = [start + random.uniform(0, SPREAD) for _ in range(size)]
+		for name, factory in (("heap", HeapTimerStore),
+		                      ("wheel", lambda: TimingWheel(now = start))):
+			store = factory()
+			insert = timed(insertAll, store, deadlines)
+			expire = timed(expireAll, store, start)
+			rows.append((size, name, "%.0f" % (insert / size * 1e9),
+			             "%.0f" % (expire / size * 1e9)))
+			
+			store = factory()
+			timers = insertAll(store, deadlines)
+			cancel = timed(cancelMost, timers)
+			left = physicalSize(store)
+			expire = timed(expireAll, store, start)
+			cancelRows.append((size, name, "%.0f" % (cancel / size * 1e9),
+			                   left, "%.0f" % (expire / size * 1e9)))
+	report("Timer stores (ns per timer)", ("timers", "store", "insert",
+	                                       "expire"), rows)
+	report("Timer stores, 90% cancelled (ns per timer)",
+	       ("timers", "store", "cancel", "entries left", "expire"), cancelRows)
+
+
+if __name__ == "__main__":
+	run()
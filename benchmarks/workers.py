@@ -0,0 +1,106 @@
+""" Multi-process server benchmark.
+
+    Runs a line echo server under a Supervisor with 1, 2 and 4 workers and
+    loads it from a pool of blocking client processes for a fixed time. The
+    workers either each bind their own SO_REUSEPORT listener or, in the
+    pre-fork model, all accept from one listener created before the fork
+    with exclusive wakeups. Scaling can only be seen on a machine with at
+    least as many free cores as there are workers plus clients.
+"""
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from ..core import async, await
+from ..usocket import USocket
+from ..workers import Supervisor
+from . import report
+
+WORKERS = (1, 2, 4)
+CLIENTS = 8
+DURATION = 2.0
+
+
+def _echo(connection):
+	try:
+		while True:
+			line = yield from connection.reader.readline()
+			yield from connection.send(line)
+	except Exception:
+		connection.forceClose()
+
+
+def _serve(listener):
+	while True:
+		connection = yield from listener.accept()
+		async(_echo(connection))
+
+
+def _reusePortWorker(port):
+	def target(index):
+		listener = USocket.listener(("127.0.0.1", port), 128, reusePort = True)
+		await(_serve(listener))
+	return target
+
+
+def _preforkWorker(port):
+	listener = USocket.listener(("127.0.0.1", port), 128, exclusive = True)
+	def target(index):
+		await(_serve(listener))
+	return target
+
+
+def _client(port):
+	""" Run echo round trips for DURATION seconds and return how many.
+	"""
+	connection = socket.create_connection(("127.0.0.1", port))
+	reader = connection.makefile("rb")
+	count = 0
+	deadline = time.monotonic() + DURATION
+	while time.monotonic() < deadline:
+		connection.sendall(b"ping\n")
+		reader.readline()
+		count += 1
+	connection.close()
+	return count
+
+
+def _freePort():
+	probe = socket.socket()
+	probe.bind(("127.0.0.1", 0))
+	port = probe.getsockname()[1]
+	probe.close()
+	return port
+
+
+def run(workers = WORKERS, clients = CLIENTS):
+	rows = []
+	for count in workers:
+		row = [count]
+		for worker in (_reusePortWorker, _preforkWorker):
+			port = _freePort()
+			pid = os.fork()
+			if pid == 0:
+				try:
+					Supervisor(worker(port), count, pinCpus = True).run()
+				finally:
+					os._exit(0)
+			# Give the workers time to bind their listeners.
+			time.sleep(0.5)
+			try:
+				with multiprocessing.Pool(clients) as pool:
+					total = sum(pool.map(_client, [port] * clients))
+			finally:
+				os.kill(pid, signal.SIGTERM)
+				os.waitpid(pid, 0)
+			row.append("%.0f" % (total / DURATION))
+		rows.append(row)
+	report("Echo server, %d clients, %d CPUs (round trips per second)"
+	       % (clients, os.cpu_count()), ("workers", "SO_REUSEPORT", "pre-fork"),
+	       rows)
+
+
+if __name__ == "__main__":
+	run()
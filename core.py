@@ -2,11 +2,15 @@ from inspect import isgeneratorfunction
 from collections import deque
 from time import time
 from greenlet import greenlet
+import types
 
 from .events import Dispatcher
 
 __all__ = ["dispatcher", "Future", "async", "await", "asynchronous", "callSoon",
-           "callLater", "callAt", "flushEvents","forkDispatcher", "awaitAll"]
+           "callLater", "callAt", "flushEvents","forkDispatcher", "awaitAll",
+           "callSoonThreadsafe", "greenletPoolStats", "setGreenletPool",
+           "gather", "awaitAny", "waitFor", "Cancelled", "Timeout",
+           "withTimeout"]
 
 dispatcher = Dispatcher()
 
@@ -15,6 +19,7 @@ forkDispatcher = dispatcher.handleFork
 callSoon = dispatcher.scheduleHighPriority
 callLater = dispatcher.scheduleMediumPriority
 callAt = dispatcher.scheduleHandleByTime
+callSoonThreadsafe = dispatcher.scheduleThreadsafe
 
 
 def asynchronous(inner):
@@ -22,7 +27,14 @@ def asynchronous(inner):
 	    those that are generators and will yield futures, those that will
 	    return instantiated asynchronous generators or those that will return
 	    a Future.
+	
+	    Generator functions are flagged as generator-based coroutines, so that
+	    they can be awaited from native `async def' coroutines and can
+	    themselves `yield from' native coroutines. The function is flagged in
+	    place, without a wrapper, so calling it costs nothing extra.
 	"""
+	if isgeneratorfunction(inner):
+		return types.coroutine(inner)
 	return inner
 
 
@@ -34,29 +46,25 @@ class Future:
 	    latter retrieval. In the second instance, another fibre waits on the
 	    Future before a result is set. In this case, a callback is scheduled so
 	    that the waiting fibre will be woken when the result is set later.
-
+	
 	    To maintain compatibility with generators, a Future can be "yielded
 	    from" but, in fact, this is just a wrapper for the fuure itself and
 	    will be slower than a basic "yield". A basic yield on something other
 	    than a future will cause problems, though, so "yield from" is preferred
 	    in cases of uncertainty.
+	
+	    An error that is stored on a Future, because nothing was waiting for
+	    it, is watched by an _ErrorTracker until it is retrieved, so that the
+	    error is still reported if the Future is garbage collected first.
+	    Futures that succeed have no finalizer at all.
 	"""
+	__slots__ = ("isDone", "cb", "result", "error", "errorTracker")
+	
 	def __init__(self):
 		self.isDone = False
 		self.cb = None
 		self.error = None
-
-	def __del__(self):
-		""" Garbage collection.
-	
-		    When a Future is garbage collected, and it has an error condition
-		    but this error condition was never accessed, then an error should be
-		    raised, informing the application that something failed silently.
-		"""
-		if self.error is not None and not self.errorAccessed:
-			raise self.error
-			raise Exception("Error failed silently at "
-			        "garbage collection [%s]"%self.error) from self.error
+		self.errorTracker = None
 	
 	def getResult(self):
 		""" Returns the result or raises the error.
@@ -67,7 +75,8 @@ class Future:
 		    then the result is returned. If it failed then the error is raised.
 		"""
 		if self.error is not None:
-			self.errorAccessed = True
+			if self.errorTracker is not None:
+				self.errorTracker.error = None
 			raise(self.error)
 		else:
 			return self.result
@@ -118,6 +127,13 @@ class Future:
 		else:
 			self.result = result
 	
+	def setResultThreadsafe(self, result):
+		""" As setResult but safe to call from a thread other than the loop's.
+		
+		    The result is set on the loop, through callSoonThreadsafe.
+		"""
+		dispatcher.scheduleThreadsafe(self.setResult, result)
+	
 	def setError(self, error):
 		""" Signal failure of a Future with an error object.
 		
@@ -130,11 +146,9 @@ class Future:
 		assert not self.isDone
 		self.isDone = True
 		if self.cb is not None:
-			# Schedule the helper function so that the silent-error mitigation
-			# can work properly.
-			dispatcher.scheduleHighPriority(self.__cbError, error)
+			dispatcher.scheduleHighPriority(self.cb.throw, error)
 		else:
-			self.errorAccessed = False
+			self.errorTracker = _ErrorTracker(error)
 			self.error = error
 	
 	def setErrorLate(self, error):
@@ -148,22 +162,15 @@ class Future:
 		assert not self.isDone
 		self.isDone = True
 		if self.cb is not None:
-			# Schedule the helper function so that the silent-error mitigation
-			# can work properly.
-			dispatcher.scheduleMediumPriority(self.__cbError, error)
+			dispatcher.scheduleMediumPriority(self.cb.throw, error)
 		else:
-			self.errorAccessed = False
+			self.errorTracker = _ErrorTracker(error)
 			self.error = error
 	
-	def __cbError(self, error):
-		""" Helper function for scheduling failure.
-		
-		    This function is used by setError to schedule a callback with error
-		    condition. It ensures that the book-keeping is updated so that the
-		    garbage collector will know that this error was accessed.
+	def setErrorThreadsafe(self, error):
+		""" As setError but safe to call from a thread other than the loop's.
 		"""
-		self.errorAccessed = True
-		self.cb.throw(error)
+		dispatcher.scheduleThreadsafe(self.setError, error)
 	
 	def setErrorFast(self, error):
 		""" As setError but with immediate callback behaviour.
@@ -177,10 +184,9 @@ class Future:
 		assert not self.isDone
 		self.isDone = True
 		if self.cb is not None:
-			self.errorAccessed = True
 			self.cb.throw(error)
 		else:
-			self.errorAccessed = False
+			self.errorTracker = _ErrorTracker(error)
 			self.error = error
 	
 	def setCallback(self, cb):
@@ -192,6 +198,18 @@ class Future:
 		"""
 		self.cb = cb
 	
+	def withdraw(self, cb):
+		""" Stop `cb' from waiting on the Future.
+		
+		    This is used when the waiter has been cancelled or has timed out.
+		    Subclasses that are owned by something that will complete them,
+		    such as a timer or a queue of waiters, also release themselves
+		    from it. A plain Future simply drops its result, or error, when it
+		    arrives.
+		"""
+		if self.cb is cb:
+			self.cb = _dropped
+	
 	def __iter__(self):
 		""" The function that 'yield from' hooks into
 		
@@ -206,7 +224,78 @@ class Future:
 	__await__ = __iter__
 
 
+class OwnedFuture(Future):
+	""" A Future that is waiting in a queue of waiters held by `owner', such
+	    as a Queue or a ReadWrapper.
+	
+	    When withdrawn, the Future is removed from its owner's queue through
+	    `owner.withdrawWaiter', so that the owner does not go on holding it,
+	    nor keep a file event registered for it.
+	"""
+	__slots__ = ("owner",)
+	
+	def __init__(self, owner):
+		super().__init__()
+		self.owner = owner
+	
+	def withdraw(self, cb):
+		# The owner is only told if `cb' was the waiter, so that a stale or
+		# foreign callback cannot take a live waiter away from it.
+		attached = self.cb is cb
+		super().withdraw(cb)
+		if attached and not self.isDone:
+			self.owner.withdrawWaiter(self)
+
+
+class _Dropped:
+	""" The callback of a Future that nothing is waiting on any more.
+	"""
+	__slots__ = ()
+	
+	def send(self, result):
+		pass
+	
+	def throw(self, error):
+		pass
+
+_dropped = _Dropped()
+
+
+class Cancelled(Exception):
+	""" Thrown into a task that has been cancelled.
+	"""
+	pass
+
+
+class Timeout(Exception):
+	""" The error of a withTimeout whose time ran out.
+	"""
+	pass
+
+
+class _ErrorTracker:
+	""" Watches an error that was stored on a Future.
+	
+	    When the tracker is garbage collected, along with its Future, and the
+	    error was never retrieved, the error is raised so that the application
+	    is informed that something failed silently.
+	"""
+	__slots__ = ("error",)
+	
+	def __init__(self, error):
+		self.error = error
+	
+	def __del__(self):
+		# Nothing need be told that a cancelled task was cancelled.
+		if self.error is not None and not isinstance(self.error, Cancelled):
+			raise self.error
+
+
 def await(thing):
+	# Refuse to nest any deeper before anything is started.
+	if _rootGreenlet is not None and _loopPool.stacked >= _loopPool.maxStacked:
+		raise(Exception("Nested await limit of %d reached"
+		                % _loopPool.maxStacked))
 	if not isinstance(thing, Future):
 		thing = _Task(thing)
 		thing.send(None)
@@ -217,10 +306,52 @@ def await(thing):
 
 
 def awaitAll(*things):
-	return tuple(await(_awaitAllInner(things)))
+	""" Await all of `things' concurrently and return a tuple of their results.
+	"""
+	return tuple(await(gather(*things)))
+
+
+def gather(*things):
+	""" Returns a Future for the results of all of `things', in order.
+	
+	    Each thing is a Future or a coroutine, which is started with async,
+	    so that the coroutines run concurrently and the Future completes when
+	    the slowest of them does. If any of them fails then the Future fails
+	    with the first error.
+	"""
+	countdown = _Countdown(len(things), len(things), True)
+	countdown.watch(things)
+	return countdown
 
-def _awaitAllInner(things):
-	return [(yield from thing) for thing in things]
+
+def awaitAny(*things):
+	""" Returns a Future for the first of `things' to complete.
+	
+	    The result is a tuple of the index of that thing and its result. If
+	    the first to complete fails then the Future fails with its error.
+	    Coroutines are started with async and, like the Futures, are left to
+	    complete in their own time; their results are dropped.
+	"""
+	if len(things) == 0:
+		raise(Exception("awaitAny needs at least one thing to await"))
+	race = _Race(1, 0, False)
+	race.watch(things)
+	return race
+
+
+def waitFor(things, count):
+	""" Returns a Future for the first `count' of `things' to complete.
+	
+	    The result is a list of (index, result) tuples in the order in which
+	    the things completed. If any fails before `count' have succeeded then
+	    the Future fails with its error. See awaitAny.
+	"""
+	if count > len(things):
+		raise(Exception("Cannot wait for %d of %d things"
+		                % (count, len(things))))
+	countdown = _Countdown(count, len(things), False)
+	countdown.watch(things)
+	return countdown
 
 
 def async(gen):
@@ -249,13 +380,65 @@ class _Task(Future):
 	    This class wraps a coroutine and functions like a Future. The coroutine
 	    will be fed Future results, in a similar manner to the await command but
 	    this class will not defer to the eventLoop, as that must be handled by
-	    an await command.
+	    an await command. The coroutine may be generator-based or a native
+	    `async def' coroutine, both of which are stepped directly through their
+	    `send' and `throw' methods.
 	    This class will also before like a generator itself so that it can be
 	    the target of a callback.
+	
+	    The Future that the coroutine is waiting on is kept until it completes,
+	    so that the task can be cancelled, which withdraws it from that Future
+	    and throws Cancelled into the coroutine.
 	"""
+	__slots__ = ("gen", "waiting", "__weakref__")
+	
 	def __init__(self, gen):
 		super().__init__()
 		self.gen = gen
+		self.waiting = None
+	
+	def cancel(self):
+		""" Cancel the task.
+		
+		    Cancelled is thrown into the coroutine where it is waiting, after
+		    any step that is already scheduled, and the Future that it was
+		    waiting on is withdrawn. The coroutine may catch Cancelled and
+		    carry on. Returns False if the task had already completed.
+		"""
+		if self.isDone:
+			return False
+		dispatcher.scheduleMediumPriority(self.__cancelNow)
+		return True
+	
+	def withdraw(self, cb):
+		""" A task that nothing is waiting on any more is cancelled.
+		
+		    Only the task's waiter can withdraw it, so a stale or foreign
+		    callback leaves the task running.
+		"""
+		if self.cb is not cb:
+			return
+		super().withdraw(cb)
+		self.cancel()
+	
+	def __cancelNow(self, seen = None):
+		if self.isDone:
+			return
+		waiting = self.waiting
+		if waiting is None or waiting.isDone:
+			# A step may still be to come, either the first or one with the
+			# result of a completed Future, and if so it is already queued,
+			# ahead of a handle scheduled now. So one retry is enough: if
+			# the task is still waiting on the same thing then, no step is
+			# coming, as when the Future was completed or withdrawn from
+			# outside, and the task is cancelled straight away.
+			if seen is None or seen[0] is not waiting:
+				dispatcher.scheduleMediumPriority(self.__cancelNow,
+				                                  (waiting,))
+				return
+		else:
+			waiting.withdraw(self)
+		self.throw(Cancelled())
 	
 	def send(self, result):
 		""" Receive a return value for the most recent yield.
@@ -267,33 +450,173 @@ class _Task(Future):
 		    completes, the result/error is set on this object for Future mode.
 		"""
 		try:
-			self.gen.send(result).setCallback(self)
+			self.waiting = fut = self.gen.send(result)
+			fut.setCallback(self)
 		
 		# Succesful completion of inner coroutine
 		except StopIteration as e:
+			self.waiting = None
 			self.setResultFast(e.value)
 		
 		# Failure of inner coroutine
 		except Exception as e:
+			self.waiting = None
 			self.setErrorFast(e)
-		
+	
 	def throw(self, error):
 		""" Receive an exception for the most recent yield.
 		
 		    see 'send' above.
 		"""
 		try:
-			self.gen.throw(error).setCallback(self)
+			self.waiting = fut = self.gen.throw(error)
+			fut.setCallback(self)
 		
 		# Succesful completion of inner coroutine
 		except StopIteration as e:
+			self.waiting = None
 			self.setResultFast(e.value)
 		
 		# Failure of inner coroutine
 		except Exception as e:
+			self.waiting = None
 			self.setErrorFast(e)
 
 
+def withTimeout(seconds, thing):
+	""" Returns a Future for the result of `thing', or a Timeout error if it
+	    has not completed within `seconds'.
+	
+	    `thing' is a Future or a coroutine, which is started with async. When
+	    the time runs out it is withdrawn from, so a task is cancelled and a
+	    waiting read, get or sleep is released by its owner. The timeout is
+	    a timer that is cancelled as soon as `thing' completes.
+	"""
+	fut = async(thing)
+	if fut.isDone:
+		return fut
+	timeout = _Timeout(fut)
+	timeout.timer = dispatcher.scheduleHandleByTime(time() + seconds,
+	                                                timeout.expire)
+	fut.setCallback(timeout)
+	return timeout
+
+
+class _Timeout(Future):
+	""" The Future returned by withTimeout, which is also the callback of the
+	    Future that it times.
+	"""
+	__slots__ = ("inner", "timer")
+	
+	def __init__(self, inner):
+		super().__init__()
+		self.inner = inner
+	
+	# The inner Future's step and the timer can both be queued in the same
+	# batch, as neither can then stop the other, so whichever runs second
+	# finds the timeout done and does nothing.
+	
+	def send(self, result):
+		if self.isDone:
+			return
+		self.timer.cancel()
+		self.setResultFast(result)
+	
+	def throw(self, error):
+		if self.isDone:
+			return
+		self.timer.cancel()
+		self.setErrorFast(error)
+	
+	def expire(self):
+		if self.isDone:
+			return
+		self.inner.withdraw(self)
+		self.setError(Timeout("Timed out"))
+	
+	def withdraw(self, cb):
+		if self.cb is not cb:
+			return
+		super().withdraw(cb)
+		if not self.isDone and self.timer.cancel():
+			self.inner.withdraw(self)
+
+
+class _Countdown(Future):
+	""" A Future completed once `remaining' of the Futures that it watches
+	    have completed, or as soon as one fails.
+	
+	    Each watched Future calls back through an _Arm, which carries nothing
+	    but its index, and the countdown completes its waiter directly from
+	    that callback. If `ordered' is set the results are kept by index,
+	    otherwise they are kept as (index, result) in order of completion.
+	"""
+	__slots__ = ("remaining", "results", "ordered")
+	
+	def __init__(self, count, size, ordered):
+		super().__init__()
+		self.remaining = count
+		self.ordered = ordered
+		self.results = [None] * size if ordered else []
+	
+	def watch(self, things):
+		if self.remaining == 0:
+			self.setResult(self.results)
+		for index, thing in enumerate(things):
+			fut = async(thing)
+			if not fut.isDone:
+				fut.setCallback(_Arm(self, index))
+				continue
+			try:
+				result = fut.getResult()
+			except Exception as error:
+				self.fail(error)
+			else:
+				self.complete(index, result)
+	
+	def complete(self, index, result):
+		if self.isDone:
+			return
+		if self.ordered:
+			self.results[index] = result
+		else:
+			self.results.append((index, result))
+		self.remaining -= 1
+		if self.remaining == 0:
+			self.setResultFast(self.results)
+	
+	def fail(self, error):
+		if not self.isDone:
+			self.setErrorFast(error)
+
+
+class _Race(_Countdown):
+	""" A _Countdown that completes with the (index, result) of the first
+	    Future to complete.
+	"""
+	__slots__ = ()
+	
+	def complete(self, index, result):
+		if not self.isDone:
+			self.setResultFast((index, result))
+
+
+class _Arm:
+	""" The callback through which one Future reports to a _Countdown.
+	"""
+	__slots__ = ("countdown", "index")
+	
+	def __init__(self, countdown, index):
+		self.countdown = countdown
+		self.index = index
+	
+	def send(self, result):
+		self.countdown.complete(self.index, result)
+	
+	def throw(self, error):
+		self.countdown.fail(error)
+
+
 class _GreenTask:
 	""" Wrapper class to enable a greenlet to behave like a coroutine.
 	
@@ -330,6 +653,7 @@ def _handleEvents(fut):
 	    the function that caused it to be satisfied has been completed.
 	"""
 	global _rootGreenlet
+	pool = _loopPool
 	thisTask = _GreenTask()
 	fut.setCallback(thisTask)
 	
@@ -345,9 +669,24 @@ def _handleEvents(fut):
 		origin.switch()
 	
 	# There is already a loop master so tell it to start a new event processor
-	# for this process
+	# for this process. Whichever greenlet resumes this one is still running
+	# the loop, so this one hands back to it, either when it has finished its
+	# handle or when it makes another nested await, rather than having a new
+	# event processor started.
 	else:
-		_, ret, success = _rootGreenlet.switch(None)
+		current = greenlet.getcurrent()
+		target = _rootGreenlet
+		if isinstance(current, _LoopGreenlet) and current.resumeTo is not None:
+			target, current.resumeTo = current.resumeTo, None
+		pool.stacked += 1
+		if pool.stacked > pool.maxStackedSeen:
+			pool.maxStackedSeen = pool.stacked
+		try:
+			origin, ret, success = target.switch(None)
+		finally:
+			pool.stacked -= 1
+		if isinstance(current, _LoopGreenlet):
+			current.resumeTo = origin
 	
 	if success:
 		return ret
@@ -365,11 +704,105 @@ def _eventLoop():
 	    current greenlet finishing its last handle, or the current greenlet has
 	    its future fulfilled, which will result in exit from the outside loop
 	    (in _handleEvents) too.
+	
+	    The greenlet is taken from the pool of parked loop greenlets if there
+	    is one, rather than being created.
 	"""
-	running = True
-	def inner():
-		while running:
-			dispatcher.runNextHandle()
-	ret = greenlet(inner).switch()
-	running = False
+	runner = _LoopRunner()
+	pool = _loopPool
+	if len(pool.parked) > 0:
+		loop = pool.parked.pop()
+		loop.parent = greenlet.getcurrent()
+		loop.runner = runner
+		pool.reused += 1
+	else:
+		loop = _LoopGreenlet(runner)
+		pool.created += 1
+	ret = loop.switch()
+	runner.running = False
 	return ret
+
+
+class _LoopGreenlet(greenlet):
+	""" An event-polling greenlet, which can be reused.
+	
+	    Once its runner has been stopped and it has finished its last handle,
+	    the greenlet parks itself in the pool and switches to the greenlet
+	    that resumed it from a nested await, if any, otherwise to its parent,
+	    as though it had returned. It is then ready to be given a new runner
+	    by _eventLoop. If the pool is full it returns instead, and so dies.
+	"""
+	def __init__(self, runner):
+		super().__init__()
+		self.runner = runner
+		self.resumeTo = None
+	
+	def run(self):
+		pool = _loopPool
+		while True:
+			runner = self.runner
+			while runner.running:
+				dispatcher.runOnce(runner)
+			target = self.resumeTo or self.parent
+			self.resumeTo = None
+			if len(pool.parked) >= pool.maxParked:
+				self.parent = target
+				return None
+			pool.parked.append(self)
+			target.switch(None)
+
+
+class _GreenletPool:
+	""" The parked loop greenlets and the figures kept on nested awaits.
+	
+	    `stacked' is the number of awaits that are currently suspended inside
+	    handles, each of which holds a greenlet and its stack, which is to say
+	    the depth to which the loop is nested. `maxStackedSeen' is the deepest
+	    it has been. An await that would take it beyond `maxStacked' raises
+	    instead, so that runaway nesting fails before it exhausts memory.
+	"""
+	__slots__ = ("parked", "maxParked", "maxStacked", "stacked",
+	             "maxStackedSeen", "created", "reused")
+	
+	def __init__(self, maxParked = 64, maxStacked = 10000):
+		self.parked = []
+		self.maxParked = maxParked
+		self.maxStacked = maxStacked
+		self.stacked = 0
+		self.maxStackedSeen = 0
+		self.created = 0
+		self.reused = 0
+
+_loopPool = _GreenletPool()
+
+
+def greenletPoolStats():
+	""" Returns the figures kept by the pool of loop greenlets as a dict.
+	"""
+	pool = _loopPool
+	return {"parked": len(pool.parked),
+	        "created": pool.created,
+	        "reused": pool.reused,
+	        "stacked": pool.stacked,
+	        "maxStacked": pool.maxStackedSeen}
+
+
+def setGreenletPool(maxParked = None, maxStacked = None):
+	""" Set the number of loop greenlets that may be parked for reuse and
+	    the depth to which awaits may be nested inside handles.
+	"""
+	pool = _loopPool
+	if maxParked is not None:
+		pool.maxParked = maxParked
+		del pool.parked[maxParked:]
+	if maxStacked is not None:
+		pool.maxStacked = maxStacked
+
+
+class _LoopRunner:
+	""" The state of an event-polling greenlet, as seen by the dispatcher.
+	"""
+	__slots__ = ("running",)
+	
+	def __init__(self):
+		self.running = True
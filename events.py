@@ -1,72 +1,277 @@
+import os
 import select
+import sys
 from collections import deque
-from time import time, mktime
-import heapq
+from time import perf_counter, time, mktime
+
+from .pollers import makePoller
+from .stats import DispatcherStats
+from .timers import HeapTimerStore, TimerHandle, inf
 
 errorCheckingMask = select.EPOLLERR | select.EPOLLHUP
 
-class HeapKeyValue:
-	def __init__(self, key, value):
-		self.key = key
-		self.value = value
-	
-	def __gt__(self, other):
-		return self.key > other.key
-	
-	def __gte__(self, other):
-		return self.key >= other.key
+# The counters kept in Dispatcher.starvation.
+STARVATION = ("budgetCuts", "deferredHandles", "admittedTimers",
+              "admittedEvents")
+
+_wakeValue = (1).to_bytes(8, sys.byteorder)
+
+
+class Waker:
+	""" A file descriptor through which other threads can wake the loop.
 	
-	def __lt__(self, other):
-		return self.key < other.key
+	    An eventfd is used where available, otherwise a pipe. Both ends are
+	    non-blocking: a wake that finds the pipe full is not needed, since the
+	    loop has yet to drain the earlier ones.
+	"""
+	def __init__(self):
+		if hasattr(os, "eventfd"):
+			self.readFd = self.writeFd = os.eventfd(0,
+			                              os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+		else:
+			self.readFd, self.writeFd = os.pipe()
+			os.set_blocking(self.readFd, False)
+			os.set_blocking(self.writeFd, False)
 	
-	def __lte__(self, other):
-		return self.key <= other.key
+	def wake(self):
+		""" Make the read end readable. Safe to call from any thread.
+		"""
+		try:
+			os.write(self.writeFd, _wakeValue)
+		except BlockingIOError:
+			pass
 	
-	def __eq__(self, other):
-		return self.key == other.key
+	def drain(self):
+		""" Consume all of the pending wakes.
+		"""
+		try:
+			while True:
+				os.read(self.readFd, 4096)
+		except BlockingIOError:
+			pass
 	
-	def __ne__(self, other):
-		return self.key != other.key
+	def close(self):
+		os.close(self.readFd)
+		if self.writeFd != self.readFd:
+			os.close(self.writeFd)
 
 
-inf = float("inf")
 class Schedule:
-	def __init__(self):
-		self.heap = []
+	""" Time-based scheduling of handles.
+	
+	    The timers themselves are held by a pluggable timer store, which must
+	    provide `push', `timeToNext', `expire' and `__len__'. By default a
+	    HeapTimerStore is used, which is the faster of the two at every size
+	    measured by benchmarks/timers.py. A TimingWheel can be supplied
+	    instead.
+	"""
+	def __init__(self, timerStore = None):
+		if timerStore is None:
+			timerStore = HeapTimerStore()
+		self.timers = timerStore
 	
 	def scheduleHandleByTime(self, when, what, *args):
-		heapq.heappush(self.heap, HeapKeyValue(when, (what, args)))
+		""" Schedule `what' to be called with `args' at time `when'.
+		
+		    Returns a TimerHandle, which can be used to cancel the call.
+		"""
+		timer = TimerHandle(when, (what, args), self.timers)
+		self.timers.push(timer)
+		return timer
 	
 	def scheduleHandleByDatetime(self, when, what, *args):
 		when = mktime(when.timetuple()) + when.microsecond / 1e6
-		return scheduleHandleByTime(when, what, *args)
+		return self.scheduleHandleByTime(when, what, *args)
 	
 	def readyTime(self):
-		if len(self.heap) == 0:
-			return inf
-		now = time()
-		return self.heap[0].key - now
+		return self.timers.timeToNext(time())
 	
-	def popHandle(self):
-		return heapq.heappop(self.heap).value
+	def expireHandles(self, append):
+		""" Pass all the handles whose time has come to `append'.
+		"""
+		self.timers.expire(time(), append)
 
 
 class Dispatcher(Schedule):
 	""" Central event-management, scheduling, and deferred callback mechanism.
-	    
+	
 	    Central object which, initialized only once as a global, is responsible
 	    for event polling, time-based scheduling, and giving up control of
 	    execution to another process (through the lowPriority scheduling).
 	"""
-	def __init__(self):
-		super().__init__()
+	def __init__(self, timerStore = None, edgeTriggered = False,
+	                   coalesceChanges = False, maxEvents = -1, budget = None,
+	                   poller = None):
+		super().__init__(timerStore)
+		self.stats = None
+		self.handleHook = None
+		# The most fds reported by each poll, -1 leaving the limit to epoll.
+		self.maxEvents = maxEvents
+		self.budget = budget
+		self.budgetSpent = 0
+		self.eventsPending = 0
+		self.starvation = dict.fromkeys(STARVATION, 0)
+		self.now = time()
 		self.handles = {}
 		self.handleQueue = deque()
+		self.batch = deque()
 		self.lowPriorityHandleQueue = deque()
-		self.handleFork()
+		self.registered = {}
+		self.changes = set()
+		self.dropped = set()
+		self.exclusive = set()
+		self.coalesceChanges = False
+		self.edgeTriggered = False
+		self.inbound = deque()
+		self.wakeSignalled = False
+		self.waker = Waker()
+		self.pollingObject = None
+		self.setPoller(poller)
+		self.setEdgeTriggered(edgeTriggered)
+		self.setCoalesceChanges(coalesceChanges)
+	
+	def setPoller(self, poller):
+		""" Switch to a new poller of the backend given by `poller', a class
+		    or name from the pollers module. None means epoll, unless another
+		    is named by the UNSTUCK_POLLER environment variable.
+		
+		    This must be done before any file events are registered.
+		"""
+		if len(self.handles) > 0:
+			raise(Exception("Cannot change poller with handles active"))
+		replacement = makePoller(poller)
+		if self.edgeTriggered and not replacement.edgeTriggered:
+			replacement.close()
+			raise(Exception("The %s poller cannot be edge-triggered"
+			                % replacement.name))
+		if self.pollingObject is not None:
+			self.pollingObject.close()
+		self.pollingObject = replacement
+		self.pollerClass = type(replacement)
+		self.pollerName = replacement.name
+		self.pollerEdgeTriggered = replacement.edgeTriggered
+		self.pollerExclusive = replacement.exclusive
+		self.changes.clear()
+		self.dropped.clear()
+		self.registered = {}
+		self.pollingObject.register(self.waker.readFd, select.EPOLLIN)
+	
+	def setEdgeTriggered(self, edgeTriggered):
+		""" Switch edge-triggered registration on or off.
+		
+		    Handles are then called only when an fd becomes ready, so the
+		    stream wrappers stay registered and track readiness themselves.
+		    This must be done before any file events are registered.
+		"""
+		if len(self.handles) > 0:
+			raise(Exception("Cannot change trigger mode with handles active"))
+		if edgeTriggered and not self.pollerEdgeTriggered:
+			raise(Exception("The %s poller cannot be edge-triggered"
+			                % self.pollerName))
+		self.edgeTriggered = edgeTriggered
+		self.pollFlags = select.EPOLLET if edgeTriggered else 0
+	
+	def setCoalesceChanges(self, coalesceChanges):
+		""" Switch change-list mode on or off.
+		
+		    In this mode the net change of interest in each fd is made with
+		    the kernel just before the next poll, as with the kqueue changelist.
+		    When switching off, any pending changes are made.
+		"""
+		if coalesceChanges and not self.coalesceChanges:
+			self.registered = {fd: self._interest(fd) for fd in self.handles}
+		elif self.coalesceChanges and not coalesceChanges:
+			self._applyChanges()
+			self.registered = {}
+		self.coalesceChanges = coalesceChanges
+	
+	def setExclusiveWakeup(self, fd, exclusive = True):
+		""" Mark `fd' to be registered with EPOLLEXCLUSIVE, or unmark it, so
+		    that an event on an fd shared by several processes wakes only one.
+		
+		    This must be done while no file events are registered on `fd'.
+		    Pollers other than epoll register the fd normally.
+		"""
+		if fd in self.handles:
+			raise(Exception("Exclusive wakeup changed on a registered fd"))
+		if exclusive:
+			self.exclusive.add(fd)
+		else:
+			self.exclusive.discard(fd)
+	
+	def setBudget(self, budget):
+		""" Set the number of handles run in an iteration before the file
+		    events and timers are admitted, or None for no limit.
+		
+		    Under a budget, handles scheduled during an iteration wait for the
+		    next, and how often events are admitted early is counted in
+		    `starvation'.
+		"""
+		if budget is not None and budget < 1:
+			raise(Exception("Budget must be at least one handle"))
+		# Without a budget there are no batches, so the rest of the current
+		# one goes back to the front of the ready queue.
+		if budget is None:
+			self.handleQueue.extendleft(reversed(self.batch))
+			self.batch.clear()
+		# The handles of polled events are only counted under a budget, so
+		# any of those ready may be one.
+		elif self.budget is None:
+			self.eventsPending = len(self.handleQueue)
+		self.budget = budget
+		self.budgetSpent = 0
+	
+	def setStats(self, enabled):
+		""" Start or stop keeping stats on the running of the loop, which
+		    cost nothing until then. See DispatcherStats.
+		
+		    Starting discards any stats kept previously.
+		"""
+		if enabled and self.stats is None:
+			self.stats = DispatcherStats(self)
+			self.stats.install()
+		elif self.stats is not None and not enabled:
+			self.stats.uninstall()
+			self.stats = None
+	
+	def getStats(self):
+		""" Returns a snapshot of the stats as a dict, or None if they are not
+		    being kept.
+		"""
+		if self.stats is None:
+			return None
+		return self.stats.snapshot()
 	
 	def handleFork(self):
-		self.pollingObject = select.epoll()
+		""" Prepare the dispatcher for use in a newly forked child.
+		
+		    The child shares the parent's poller, so a new one is created
+		    and every file event in `handles' is registered with it afresh.
+		    The pending timers and ready handles belong to the parent and are
+		    dropped, so that only the file events, such as that of a listening
+		    socket created before the fork, carry over into the child.
+		"""
+		self.pollingObject.close()
+		self.pollingObject = makePoller(self.pollerClass)
+		# The eventfd is shared with the parent too.
+		self.waker.close()
+		self.waker = Waker()
+		self.pollingObject.register(self.waker.readFd, select.EPOLLIN)
+		self.wakeSignalled = False
+		self.inbound.clear()
+		self.timers.clear()
+		self.handleQueue.clear()
+		self.batch.clear()
+		self.eventsPending = 0
+		self.lowPriorityHandleQueue.clear()
+		self.changes.clear()
+		self.dropped.clear()
+		for fd in self.handles:
+			self._addInterest(fd, self._interest(fd))
+		if self.coalesceChanges:
+			self.registered = {fd: self._interest(fd) for fd in self.handles}
+		if self.stats is not None:
+			self.stats.reset()
 	
 	def __del__(self):
 		self.flush()
@@ -83,7 +288,29 @@ class Dispatcher(Schedule):
 	def scheduleHighPriority(self, handle, *args):
 		self.handleQueue.appendleft((handle, args))
 	
+	def scheduleThreadsafe(self, handle, *args):
+		""" Schedule `handle' from a thread other than the loop's.
+		
+		    The handle is run after those already ready when the loop next
+		    collects the inbound queue. This is the only scheduling method
+		    that is safe to call from another thread. Only the first handle
+		    since the last collection wakes the loop.
+		"""
+		self.inbound.append((handle, args))
+		if not self.wakeSignalled:
+			self.wakeSignalled = True
+			self.waker.wake()
+	
 	def registerFileEvent(self, fd, mask, handle):
+		if self.coalesceChanges:
+			handleList = self.handles.setdefault(fd, {})
+			for om in handleList:
+				if om & mask:
+					raise(Exception("Mask clash"))
+			handleList[mask] = handle
+			self.changes.add(fd)
+			return
+		
 		try:
 			handleList = self.handles[fd]
 			# Check whether the current mask overlaps with extant handles
@@ -93,13 +320,13 @@ class Dispatcher(Schedule):
 				if om & mask:
 					raise(Exception("Mask clash"))
 				registerMask |= om
-			self.pollingObject.modify(fd, registerMask)
+			self._modifyInterest(fd, registerMask)
 			handleList[mask] = handle
 		
 		# Create the handle list if the current fd is not there.
 		except KeyError:
 			handleList = self.handles[fd] = {mask:handle}
-			self.pollingObject.register(fd, mask)
+			self._addInterest(fd, mask)
 	
 	def unregisterFileEvent(self, fd, mask):
 		try:
@@ -108,41 +335,248 @@ class Dispatcher(Schedule):
 		except KeyError:
 			raise(Exception("%d,%d was not registered" % (fd,mask)))
 		
-		if len(handleList) == 0:
+		if self.coalesceChanges:
+			if len(handleList) == 0:
+				del self.handles[fd]
+				self.dropped.add(fd)
+			self.changes.add(fd)
+		elif len(handleList) == 0:
 			self.pollingObject.unregister(fd)
 			del self.handles[fd]
 		else:
 			registerMask = 0
 			for om in handleList:
 				registerMask |= om
-			self.pollingObject.modify(fd, registerMask)
+			self._modifyInterest(fd, registerMask)
+	
+	def _interest(self, fd):
+		""" Returns the combined mask of the events registered for `fd'.
+		"""
+		registerMask = 0
+		for om in self.handles.get(fd, ()):
+			registerMask |= om
+		return registerMask
+	
+	def _addInterest(self, fd, registerMask):
+		""" Register `fd' with the kernel for the events in `registerMask'.
+		"""
+		if fd in self.exclusive and self.pollerExclusive:
+			registerMask |= select.EPOLLEXCLUSIVE
+		self.pollingObject.register(fd, registerMask | self.pollFlags)
+	
+	def _modifyInterest(self, fd, registerMask):
+		""" Change the events for which `fd' is registered with the kernel.
+		"""
+		# EPOLLEXCLUSIVE can only be given when an fd is added to the set.
+		if fd in self.exclusive and self.pollerExclusive:
+			self.pollingObject.unregister(fd)
+			self._addInterest(fd, registerMask)
+		else:
+			self.pollingObject.modify(fd, registerMask | self.pollFlags)
+	
+	def _applyChanges(self):
+		""" Make the net interest changes recorded in change-list mode.
+		
+		    An fd whose handles were all removed in the meantime may have been
+		    closed, which removes it from the epoll set, and its number then
+		    reused. Such an fd is therefore modified even when its net interest
+		    is unchanged, and registered afresh should the modify find that it
+		    is no longer in the set.
+		"""
+		changes, self.changes = self.changes, set()
+		dropped, self.dropped = self.dropped, set()
+		for fd in changes:
+			registerMask = self._interest(fd)
+			current = self.registered.get(fd, 0)
+			if registerMask == current and fd not in dropped:
+				continue
+			
+			# An fd registered and dropped again between polls never reached
+			# the kernel, so there is nothing to undo.
+			if registerMask == 0 and current == 0:
+				self.registered.pop(fd, None)
+			elif registerMask == 0:
+				del self.registered[fd]
+				try:
+					self.pollingObject.unregister(fd)
+				# The fd was closed, which has already unregistered it.
+				except OSError:
+					pass
+			elif current == 0:
+				self._addInterest(fd, registerMask)
+				self.registered[fd] = registerMask
+			else:
+				try:
+					self._modifyInterest(fd, registerMask)
+				except FileNotFoundError:
+					self._addInterest(fd, registerMask)
+				self.registered[fd] = registerMask
 	
 	def flush(self):
-		while len(self.handleQueue) > 0:
+		while len(self.handleQueue) > 0 or len(self.batch) > 0:
 			self.runNextHandle()
 	
 	def runNextHandle(self):
-		if len(self.handleQueue) == 0:
-			timeToNext = self.readyTime()
-			if timeToNext < 0.0:
-				while self.readyTime() < 0.0:
-					self.handleQueue.append(self.popHandle())
+		if self.eventsPending > 0:
+			self.eventsPending -= 1
+		if len(self.batch) > 0:
+			handle, args = self.batch.popleft()
+			handle(*args)
+			return
+		handleQueue = self.handleQueue
+		if len(handleQueue) == 0:
+			self.collectHandles()
+		handle, args = handleQueue.popleft()
+		handle(*args)
+	
+	def runOnce(self, runner, hook = None):
+		""" Run one iteration of the event loop.
+		
+		    If nothing is ready then the handles for the iteration are
+		    collected, after which the ready queue is drained in a tight loop.
+		    As with runNextHandle, nothing more is collected until the queue
+		    is empty, so handles scheduled with high or medium priority during
+		    the iteration are run within it in their usual order. It is
+		    abandoned as soon as `runner.running' goes false, which is how a
+		    greenlet hands the loop on to another.
+		
+		    With a budget, the iteration is bounded instead, see _runBudgeted.
+		
+		    With a `hook', or else the dispatcher's `handleHook', every handle
+		    is timed, and the hook is called with the handle and the seconds
+		    that it took, unless it handed the loop on. This is how stats and
+		    the SlowCallbackWatchdog see the handles, without a loop of their
+		    own.
+		"""
+		if hook is None:
+			hook = self.handleHook
+		if self.budget is not None:
+			self._runBudgeted(runner, hook)
+			return
+		handleQueue = self.handleQueue
+		if len(handleQueue) == 0:
+			self.collectHandles()
+		popleft = handleQueue.popleft
+		if hook is not None:
+			while handleQueue and runner.running:
+				handle, args = popleft()
+				before = perf_counter()
+				handle(*args)
+				if runner.running:
+					hook(handle, perf_counter() - before)
+			return
+		while handleQueue and runner.running:
+			handle, args = popleft()
+			handle(*args)
+	
+	def _runBudgeted(self, runner, hook):
+		""" Run one iteration of the event loop under a budget.
+		
+		    The iteration runs the batch, which is what was left of the last
+		    one or else everything on the ready queue as it starts. Once the
+		    budget has been spent, over however many iterations, the starved
+		    events are admitted to the batch before anything else is run.
+		"""
+		batch = self.batch
+		handleQueue = self.handleQueue
+		if len(batch) == 0:
+			if len(handleQueue) == 0:
+				self.collectHandles()
+			elif self.budgetSpent >= self.budget:
+				self.admitStarved()
+			if len(batch) == 0:
+				batch.extend(handleQueue)
+				handleQueue.clear()
+		budget = self.budget
+		popleft = batch.popleft
+		while batch and runner.running:
+			if self.budgetSpent >= budget:
+				self.admitStarved()
+				return
+			self.budgetSpent += 1
+			if self.eventsPending > 0:
+				self.eventsPending -= 1
+			handle, args = popleft()
+			if hook is None:
+				handle(*args)
+				continue
+			before = perf_counter()
+			handle(*args)
+			if runner.running:
+				hook(handle, perf_counter() - before)
+	
+	def admitStarved(self):
+		""" Add the handles of expired timers and of ready file events to the
+		    end of the batch, while handles are still ready.
+		
+		    The file events are not polled while the first `eventsPending'
+		    handles of the batch and then the ready queue include any from the
+		    last poll, since a level-triggered event is reported until it has
+		    been handled, and its handle would be queued twice.
+		"""
+		handleQueue = self.handleQueue
+		batch = self.batch
+		starvation = self.starvation
+		starvation["budgetCuts"] += 1
+		waiting = len(handleQueue)
+		starvation["deferredHandles"] += waiting + len(batch)
+		self.now = now = time()
+		self.timers.expire(now, handleQueue.append)
+		timers = len(handleQueue) - waiting
+		if self.eventsPending == 0:
+			self._pollEventsFast()
+		admitted = len(handleQueue) - waiting
+		starvation["admittedTimers"] += timers
+		starvation["admittedEvents"] += admitted - timers
+		# They are appended to the ready queue, as anywhere else, and so are
+		# moved from its end, which also leaves the stats counting them.
+		moved = [handleQueue.pop() for _ in range(admitted)]
+		moved.reverse()
+		if admitted > timers:
+			self.eventsPending = len(batch) + admitted
+		# Timers moved ahead of pending events in the ready queue put them
+		# further back.
+		elif self.eventsPending > len(batch):
+			self.eventsPending += admitted
+		batch.extend(moved)
+		self.budgetSpent = 0
+	
+	def collectHandles(self):
+		""" Fill the empty ready queue.
+		
+		    The loop clock, `now', is read once and used both to move all of
+		    the expired timers onto the ready queue and to decide how long to
+		    poll for.
+		    Since the starved events have been collected, any budget is
+		    restored, and they are not polled again to be admitted until the
+		    handles collected have run.
+		"""
+		handleQueue = self.handleQueue
+		timers = self.timers
+		# The timer store may only give a lower bound on the time to the next
+		# timer, so keep going until something is actually ready.
+		while len(handleQueue) == 0:
+			self.now = now = time()
+			timeToNext = timers.timeToNext(now)
+			if timeToNext <= 0.0:
+				timers.expire(now, handleQueue.append)
 			elif len(self.lowPriorityHandleQueue) > 0:
 				self._pollEventsFast()
 				handle = self.lowPriorityHandleQueue.popleft()
-				self.handleQueue.append(handle)
+				handleQueue.append(handle)
 			else:
 				self._pollEvents(timeToNext)
-		handle, args = self.handleQueue.popleft()
-		handle(*args)
+		self.budgetSpent = 0
+		self.eventsPending = len(handleQueue)
 	
 	def _pollEvents(self, timeout):
 		if timeout is inf:
 			timeout = -1
-		keys = self.pollingObject.poll(timeout)
+		if len(self.changes) > 0:
+			self._applyChanges()
+		keys = self.pollingObject.poll(timeout, self.maxEvents)
 		if keys == []:
-			while self.readyTime() < 0:
-				self.handleQueue.append(self.popHandle())
+			self.expireHandles(self.handleQueue.append)
 		else:
 			self._scheduleEvents(keys)
 	
@@ -150,12 +584,34 @@ class Dispatcher(Schedule):
 		""" Used when there is a low priority handle waiting, poll events but
 		    only what is currently waiting. I.e. do not use any timeout.
 		"""
-		keys = self.pollingObject.poll(0)
+		if len(self.changes) > 0:
+			self._applyChanges()
+		keys = self.pollingObject.poll(0, self.maxEvents)
 		if keys != []:
 			self._scheduleEvents(keys)
 	
+	def _collectInbound(self):
+		""" Move the handles scheduled by other threads onto the ready queue.
+		"""
+		# Drain the Waker before clearing the flag, and clear the flag before
+		# collecting. A thread that sets the flag before it is cleared has
+		# already queued its handle, which is collected below, and one that
+		# sets it after writes a wake that is not drained here. The other way
+		# round, a wake written between the clear and the drain is swallowed
+		# with the flag left set, and no thread wakes the loop again.
+		self.waker.drain()
+		self.wakeSignalled = False
+		inbound = self.inbound
+		append = self.handleQueue.append
+		while len(inbound) > 0:
+			append(inbound.popleft())
+	
 	def _scheduleEvents(self, events):
+		wakeFd = self.waker.readFd
 		for activeFD, activeMask in events:
+			if activeFD == wakeFd:
+				self._collectInbound()
+				continue
 			handleList = self.handles[activeFD]
 			for mask,handle in handleList.items():
 				mask = (mask | errorCheckingMask) & activeMask
@@ -0,0 +1,421 @@
+import ctypes
+import errno
+import math
+import mmap
+import os
+import select
+import struct
+
+__all__ = ["Poller", "EpollPoller", "PollPoller", "SelectPoller",
+           "UringPoller", "POLLERS", "makePoller", "availablePollers"]
+
+# Flags that only mean something to epoll itself.
+_EPOLL_ONLY = select.EPOLLET | select.EPOLLEXCLUSIVE | select.EPOLLONESHOT
+_ERROR = select.EPOLLERR | select.EPOLLHUP
+
+
+class Poller:
+	""" The interface between the Dispatcher and the kernel's readiness
+	    notification.
+	
+	    A poller provides `register(fd, mask)', `modify(fd, mask)',
+	    `unregister(fd)', `poll(timeout, maxEvents)', `close()' and
+	    `fileno()' with the semantics of select.epoll: masks are made of the
+	    EPOLL flags, the timeout is in seconds with -1 for none, poll returns
+	    a list of (fd, mask) and is level-triggered, errors and hang-ups are
+	    always reported, registering an fd twice raises FileExistsError, and
+	    modifying or unregistering one that is not registered raises
+	    FileNotFoundError.
+	
+	    `edgeTriggered' and `exclusive' say whether the poller honours
+	    EPOLLET and EPOLLEXCLUSIVE. Those that do not are never given them.
+	"""
+	name = None
+	edgeTriggered = False
+	exclusive = False
+
+
+class EpollPoller(Poller):
+	""" The epoll backend, and the default.
+	
+	    The methods are those of the select.epoll object itself, set on the
+	    instance, so that calling them costs no more than calling epoll.
+	"""
+	name = "epoll"
+	edgeTriggered = True
+	exclusive = True
+	
+	def __init__(self):
+		self.epoll = epoll = select.epoll()
+		self.register = epoll.register
+		self.modify = epoll.modify
+		self.unregister = epoll.unregister
+		self.poll = epoll.poll
+		self.close = epoll.close
+		self.fileno = epoll.fileno
+
+
+class PollPoller(Poller):
+	""" The poll(2) backend.
+	
+	    Every poll passes the whole set of fds to the kernel, so the cost
+	    grows with the number registered, not with the number ready.
+	"""
+	name = "poll"
+	
+	def __init__(self):
+		self.poller = select.poll()
+		self.fds = set()
+	
+	def register(self, fd, mask):
+		if fd in self.fds:
+			raise(FileExistsError(errno.EEXIST, "%d is registered" % fd))
+		self.poller.register(fd, mask & ~_EPOLL_ONLY & 0xffff)
+		self.fds.add(fd)
+	
+	def modify(self, fd, mask):
+		if fd not in self.fds:
+			raise(FileNotFoundError(errno.ENOENT, "%d is not registered" % fd))
+		self.poller.modify(fd, mask & ~_EPOLL_ONLY & 0xffff)
+	
+	def unregister(self, fd):
+		if fd not in self.fds:
+			raise(FileNotFoundError(errno.ENOENT, "%d is not registered" % fd))
+		self.fds.discard(fd)
+		self.poller.unregister(fd)
+	
+	def poll(self, timeout = -1, maxEvents = -1):
+		if timeout < 0:
+			timeout = None
+		else:
+			timeout = math.ceil(timeout * 1000)
+		events = self.poller.poll(timeout)
+		if maxEvents > 0:
+			events = events[:maxEvents]
+		# An fd that was closed while registered is reported as an error.
+		return [(fd, _ERROR if mask & select.POLLNVAL else mask)
+		        for fd, mask in events]
+	
+	def close(self):
+		self.fds.clear()
+	
+	def fileno(self):
+		raise(OSError(errno.EBADF, "The poll poller has no fd"))
+
+
+class SelectPoller(Poller):
+	""" The select(2) backend.
+	
+	    Only fds below FD_SETSIZE, normally 1024, can be registered. The
+	    lists of fds passed to select are rebuilt only after a change of
+	    registration.
+	"""
+	name = "select"
+	
+	def __init__(self):
+		self.masks = {}
+		self.lists = None
+	
+	def register(self, fd, mask):
+		if fd in self.masks:
+			raise(FileExistsError(errno.EEXIST, "%d is registered" % fd))
+		self.masks[fd] = mask
+		self.lists = None
+	
+	def modify(self, fd, mask):
+		if fd not in self.masks:
+			raise(FileNotFoundError(errno.ENOENT, "%d is not registered" % fd))
+		self.masks[fd] = mask
+		self.lists = None
+	
+	def unregister(self, fd):
+		if self.masks.pop(fd, None) is None:
+			raise(FileNotFoundError(errno.ENOENT, "%d is not registered" % fd))
+		self.lists = None
+	
+	def poll(self, timeout = -1, maxEvents = -1):
+		if self.lists is None:
+			masks = self.masks.items()
+			self.lists = ([fd for fd, mask in masks if mask & select.EPOLLIN],
+			              [fd for fd, mask in masks if mask & select.EPOLLOUT],
+			              [fd for fd, mask in masks if mask & select.EPOLLPRI])
+		readers, writers, urgent = self.lists
+		try:
+			readable, writable, exceptional = select.select(
+			             readers, writers, urgent, None if timeout < 0 else timeout)
+		except (OSError, ValueError):
+			# An fd was closed while registered: report it as an error.
+			events = [(fd, _ERROR) for fd in self.masks if not self.__valid(fd)]
+			if len(events) == 0:
+				raise
+			return events
+		events = dict.fromkeys(readable, select.EPOLLIN)
+		for fd in writable:
+			events[fd] = events.get(fd, 0) | select.EPOLLOUT
+		for fd in exceptional:
+			events[fd] = events.get(fd, 0) | select.EPOLLPRI
+		events = list(events.items())
+		if maxEvents > 0:
+			events = events[:maxEvents]
+		return events
+	
+	def close(self):
+		self.masks.clear()
+		self.lists = None
+	
+	def fileno(self):
+		raise(OSError(errno.EBADF, "The select poller has no fd"))
+	
+	def __valid(self, fd):
+		try:
+			os.fstat(fd)
+		except OSError:
+			return False
+		return True
+
+
+# io_uring, reached through the raw system calls, which have the same numbers
+# on every architecture.
+_SYS_IO_URING_SETUP = 425
+_SYS_IO_URING_ENTER = 426
+_OP_POLL_ADD = 6
+_OP_POLL_REMOVE = 7
+_ENTER_GETEVENTS = 1 << 0
+_ENTER_EXT_ARG = 1 << 3
+_FEAT_EXT_ARG = 1 << 8
+_OFF_SQ_RING = 0
+_OFF_CQ_RING = 0x8000000
+_OFF_SQES = 0x10000000
+_SQE = struct.Struct("<BBHiQQIIQHHiQQ")
+_CQE = struct.Struct("<QiI")
+_U32 = struct.Struct("<I")
+
+try:
+	_libc = ctypes.CDLL(None, use_errno = True)
+	_syscall = _libc.syscall
+	_syscall.restype = ctypes.c_long
+except (OSError, AttributeError):
+	_syscall = None
+
+
+class UringPoller(Poller):
+	""" An io_uring backend, for Linux 5.11 and later.
+	
+	    Interest in an fd is a one-shot poll request on the ring. Requests
+	    made by register, modify and unregister are queued on the submission
+	    ring and submitted together by the next poll, in the same system call
+	    that waits for completions, and the completions are reaped in bulk
+	    straight from the shared completion ring. An fd that was reported is
+	    polled for again at the next poll, which keeps the backend level-
+	    triggered, and that request too joins the batch. A loop iteration
+	    therefore costs one system call however many fds changed interest,
+	    where epoll costs one for each change as well as one for the wait.
+	
+	    The ring is reached through ctypes and the raw system calls, so no
+	    extension module is needed. If io_uring is not available, or has
+	    been disabled, construction raises OSError.
+	"""
+	name = "io_uring"
+	
+	def __init__(self, entries = 256):
+		if _syscall is None:
+			raise(OSError(errno.ENOSYS, "io_uring needs ctypes and libc"))
+		params = (ctypes.c_uint32 * 30)()
+		ringFd = _syscall(ctypes.c_long(_SYS_IO_URING_SETUP),
+		                  ctypes.c_long(entries), params)
+		if ringFd < 0:
+			error = ctypes.get_errno()
+			raise(OSError(error, "io_uring_setup: " + os.strerror(error)))
+		self.ringFd = ringFd
+		if not params[5] & _FEAT_EXT_ARG:
+			os.close(ringFd)
+			raise(OSError(errno.ENOSYS, "io_uring is too old for a poller"))
+		self.sqEntries = sqEntries = params[0]
+		cqEntries = params[1]
+		# The offsets of the fields of each ring within its mapping.
+		self.sqHead, self.sqTailOffset = params[10], params[11]
+		sqMask, sqArray = params[12], params[16]
+		self.cqHead, self.cqTail = params[20], params[21]
+		cqMask, self.cqes = params[22], params[25]
+		access = mmap.PROT_READ | mmap.PROT_WRITE
+		self.sqRing = mmap.mmap(ringFd, sqArray + sqEntries * 4,
+		                        mmap.MAP_SHARED, access, offset = _OFF_SQ_RING)
+		self.cqRing = mmap.mmap(ringFd, self.cqes + cqEntries * _CQE.size,
+		                        mmap.MAP_SHARED, access, offset = _OFF_CQ_RING)
+		self.sqes = mmap.mmap(ringFd, sqEntries * _SQE.size, mmap.MAP_SHARED,
+		                      access, offset = _OFF_SQES)
+		# Each submission slot always holds the entry of the same index.
+		for index in range(sqEntries):
+			_U32.pack_into(self.sqRing, sqArray + index * 4, index)
+		self.sqMask = _U32.unpack_from(self.sqRing, sqMask)[0]
+		self.cqMask = _U32.unpack_from(self.cqRing, cqMask)[0]
+		self.sqTail = _U32.unpack_from(self.sqRing, self.sqTailOffset)[0]
+		self.pending = 0
+		self.timespec = (ctypes.c_int64 * 2)()
+		self.getEventsArg = (ctypes.c_uint64 * 3)()
+		self.masks = {}
+		self.armed = {}
+		self.tokens = {}
+		self.nextToken = 1
+		self.reported = []
+	
+	def register(self, fd, mask):
+		if fd in self.masks:
+			raise(FileExistsError(errno.EEXIST, "%d is registered" % fd))
+		self.masks[fd] = mask & ~_EPOLL_ONLY
+		self.__arm(fd)
+	
+	def modify(self, fd, mask):
+		if fd not in self.masks:
+			raise(FileNotFoundError(errno.ENOENT, "%d is not registered" % fd))
+		self.masks[fd] = mask & ~_EPOLL_ONLY
+		self.__disarm(fd)
+		self.__arm(fd)
+	
+	def unregister(self, fd):
+		if self.masks.pop(fd, None) is None:
+			raise(FileNotFoundError(errno.ENOENT, "%d is not registered" % fd))
+		self.__disarm(fd)
+	
+	def poll(self, timeout = -1, maxEvents = -1):
+		masks = self.masks
+		armed = self.armed
+		for fd in self.reported:
+			if fd in masks and fd not in armed:
+				self.__arm(fd)
+		self.reported = []
+		cqRing = self.cqRing
+		ready = _U32.unpack_from(cqRing, self.cqTail)[0] != \
+		        _U32.unpack_from(cqRing, self.cqHead)[0]
+		if ready or timeout == 0:
+			if self.pending > 0:
+				self.__enter(0, 0)
+		else:
+			self.__enter(1, timeout)
+		return self.__reap(maxEvents)
+	
+	def close(self):
+		if self.ringFd is None:
+			return
+		for ring in (self.sqRing, self.cqRing, self.sqes):
+			ring.close()
+		os.close(self.ringFd)
+		self.ringFd = None
+	
+	def fileno(self):
+		return self.ringFd
+	
+	def __arm(self, fd):
+		token = self.nextToken
+		self.nextToken = token + 1
+		self.tokens[token] = fd
+		self.armed[fd] = token
+		self.__queue(_OP_POLL_ADD, fd, 0, self.masks[fd], token)
+	
+	def __disarm(self, fd):
+		token = self.armed.pop(fd, None)
+		if token is not None:
+			# The completion of the cancelled poll, if any, is ignored.
+			del self.tokens[token]
+			self.__queue(_OP_POLL_REMOVE, -1, token, 0, 0)
+	
+	def __queue(self, opcode, fd, address, events, token):
+		if self.pending == self.sqEntries:
+			self.__enter(0, 0)
+		tail = self.sqTail
+		_SQE.pack_into(self.sqes, (tail & self.sqMask) * _SQE.size, opcode, 0,
+		               0, fd, 0, address, 0, events, token, 0, 0, 0, 0, 0)
+		self.sqTail = (tail + 1) & 0xffffffff
+		self.pending += 1
+	
+	def __enter(self, minComplete, timeout):
+		""" Submit what is queued and, if `minComplete', wait up to `timeout'
+		    seconds for a completion.
+		"""
+		_U32.pack_into(self.sqRing, self.sqTailOffset, self.sqTail)
+		flags = _ENTER_EXT_ARG
+		arg = self.getEventsArg
+		arg[2] = 0
+		if minComplete:
+			flags |= _ENTER_GETEVENTS
+			if timeout >= 0:
+				seconds = int(timeout)
+				self.timespec[0] = seconds
+				self.timespec[1] = int((timeout - seconds) * 1e9)
+				arg[2] = ctypes.addressof(self.timespec)
+		result = _syscall(ctypes.c_long(_SYS_IO_URING_ENTER),
+		                  ctypes.c_long(self.ringFd),
+		                  ctypes.c_long(self.pending),
+		                  ctypes.c_long(minComplete), ctypes.c_long(flags),
+		                  ctypes.c_void_p(ctypes.addressof(arg)),
+		                  ctypes.c_long(ctypes.sizeof(arg)))
+		if result < 0:
+			error = ctypes.get_errno()
+			# The wait timed out or was interrupted, or the completion ring
+			# is full and must be reaped first.
+			if error in (errno.ETIME, errno.EINTR, errno.EBUSY):
+				result = 0
+			else:
+				raise(OSError(error, "io_uring_enter: " + os.strerror(error)))
+		head = _U32.unpack_from(self.sqRing, self.sqHead)[0]
+		self.pending = (self.sqTail - head) & 0xffffffff
+	
+	def __reap(self, maxEvents):
+		cqRing = self.cqRing
+		head = _U32.unpack_from(cqRing, self.cqHead)[0]
+		tail = _U32.unpack_from(cqRing, self.cqTail)[0]
+		tokens = self.tokens
+		armed = self.armed
+		cqMask = self.cqMask
+		cqes = self.cqes
+		events = []
+		while head != tail and len(events) != maxEvents:
+			token, result, _ = _CQE.unpack_from(cqRing,
+			                                    cqes + (head & cqMask) * 16)
+			head = (head + 1) & 0xffffffff
+			fd = tokens.pop(token, None)
+			if fd is None:
+				continue
+			del armed[fd]
+			if result < 0 or result & select.POLLNVAL:
+				result = _ERROR
+			events.append((fd, result))
+		_U32.pack_into(cqRing, self.cqHead, head)
+		self.reported = [fd for fd, _ in events]
+		return events
+
+
+POLLERS = {"epoll": EpollPoller, "poll": PollPoller, "select": SelectPoller,
+           "io_uring": UringPoller}
+
+
+def makePoller(poller = None):
+	""" Returns a new poller.
+	
+	    `poller' is a Poller class or the name of one in POLLERS. By default
+	    it is named by the UNSTUCK_POLLER environment variable, or is epoll,
+	    so that the backend of the global dispatcher can be chosen when the
+	    program is started.
+	"""
+	if poller is None:
+		poller = os.environ.get("UNSTUCK_POLLER", "epoll")
+	if isinstance(poller, str):
+		try:
+			poller = POLLERS[poller]
+		except KeyError:
+			raise(Exception("Unknown poller %r, expected one of %s"
+			                % (poller, ", ".join(POLLERS))))
+	return poller()
+
+
+def availablePollers():
+	""" Returns the names of the pollers that can be made on this system.
+	"""
+	names = []
+	for name, poller in POLLERS.items():
+		try:
+			poller().close()
+		except OSError:
+			continue
+		names.append(name)
+	return names
@@ -0,0 +1,366 @@
+import mmap
+import multiprocessing
+import os
+import select
+import struct
+import tempfile
+from collections import deque
+from multiprocessing.reduction import ForkingPickler
+
+from .core import Future, dispatcher
+
+__all__ = ["ProcessExecutor", "runInProcess"]
+
+# Results are framed by their length, so that the loop can read them from a
+# non-blocking pipe in pieces.
+_header = struct.Struct("!Q")
+_chunkSize = 1 << 16
+
+# Shared memory segments are files on this memory-backed filesystem, which
+# both sides map. Without it everything is pickled.
+_segmentDirectory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+class _Shared:
+	""" Stands in for a large bytes object that was placed in a shared
+	    memory segment, rather than being pickled through the pipe.
+	"""
+	__slots__ = ("path", "size")
+	
+	def __init__(self, path, size):
+		self.path = path
+		self.size = size
+	
+	def __getstate__(self):
+		return self.path, self.size
+	
+	def __setstate__(self, state):
+		self.path, self.size = state
+
+
+def _share(value, threshold, segments):
+	""" Returns `value', or a _Shared for it if it is bytes of at least
+	    `threshold' bytes, in which case the segment is added to `segments'.
+	"""
+	if _segmentDirectory is None or \
+	   not isinstance(value, (bytes, bytearray, memoryview)) or \
+	   len(value) < threshold:
+		return value
+	size = len(value)
+	fileNumber, path = tempfile.mkstemp(prefix = "unstuck-",
+	                                    dir = _segmentDirectory)
+	segments.append(path)
+	try:
+		# A file cannot be mapped with no length.
+		os.ftruncate(fileNumber, max(size, 1))
+		with mmap.mmap(fileNumber, max(size, 1)) as segment:
+			segment[:size] = value
+	finally:
+		os.close(fileNumber)
+	return _Shared(path, size)
+
+
+def _unshare(value, unlink = False):
+	""" Returns the bytes behind a _Shared, or `value' itself. The segment is
+	    unlinked too if `unlink' is set.
+	"""
+	if not isinstance(value, _Shared):
+		return value
+	fileNumber = os.open(value.path, os.O_RDONLY)
+	try:
+		with mmap.mmap(fileNumber, max(value.size, 1),
+		               access = mmap.ACCESS_READ) as segment:
+			return segment[:value.size]
+	finally:
+		os.close(fileNumber)
+		if unlink:
+			os.unlink(value.path)
+
+
+def _release(segments):
+	""" Unlink the segments at the paths in `segments'.
+	"""
+	for path in segments:
+		try:
+			os.unlink(path)
+		except FileNotFoundError:
+			pass
+
+
+def _writeAll(fileNumber, data):
+	view = memoryview(data)
+	while len(view) > 0:
+		view = view[os.write(fileNumber, view):]
+
+
+def _workerMain(jobs, results, threshold):
+	""" The body of a worker process.
+	
+	    Receives (function, args) jobs until it receives None and sends back
+	    (success, value) for each. Large bytes results are returned through a
+	    shared memory segment, which the loop unlinks once it has read it.
+	"""
+	fileNumber = results.fileno()
+	while True:
+		try:
+			job = jobs.recv()
+		except EOFError:
+			return
+		if job is None:
+			return
+		function, args = job
+		segments = []
+		try:
+			result = function(*[_unshare(arg) for arg in args])
+			message = (True, _share(result, threshold, segments))
+		except Exception as error:
+			_release(segments)
+			segments = []
+			message = (False, error)
+		try:
+			data = ForkingPickler.dumps(message)
+		except Exception as error:
+			# The result or error could not be pickled.
+			data = ForkingPickler.dumps((False, RuntimeError(repr(error))))
+		try:
+			_writeAll(fileNumber, _header.pack(len(data)))
+			_writeAll(fileNumber, data)
+		except OSError:
+			# The loop has gone, and will not unlink the result.
+			_release(segments)
+			return
+
+
+class _Worker:
+	""" The loop's end of one worker process.
+	
+	    Jobs are sent down one pipe, with blocking writes, since a worker is
+	    only sent a job while it is waiting for one. Results come back up a
+	    second pipe, which is non-blocking at the loop's end, so that a large
+	    result is collected as it arrives rather than by blocking the loop.
+	"""
+	def __init__(self, context, threshold):
+		remoteJobs, self.jobs = context.Pipe(False)
+		self.results, remoteResults = context.Pipe(False)
+		self.process = context.Process(target = _workerMain,
+		                               args = (remoteJobs, remoteResults,
+		                                       threshold),
+		                               daemon = True)
+		self.process.start()
+		remoteJobs.close()
+		remoteResults.close()
+		self.fileNumber = self.results.fileno()
+		os.set_blocking(self.fileNumber, False)
+		self.buffer = bytearray()
+		self.job = None
+		self.registered = False
+	
+	def read(self):
+		""" Read whatever the worker has sent so far.
+		
+		    Returns the pickled message once all of it has arrived, or None
+		    until then. Raises EOFError if the worker has exited.
+		"""
+		buffer = self.buffer
+		while True:
+			try:
+				chunk = os.read(self.fileNumber, _chunkSize)
+			except BlockingIOError:
+				break
+			if len(chunk) == 0:
+				raise(EOFError("The worker process has exited"))
+			buffer += chunk
+		if len(buffer) < _header.size:
+			return None
+		end = _header.size + _header.unpack_from(buffer)[0]
+		if len(buffer) < end:
+			return None
+		message = bytes(buffer[_header.size:end])
+		del buffer[:end]
+		return message
+	
+	def close(self):
+		""" Close the pipes and stop the process, which may be dead already.
+		"""
+		self.jobs.close()
+		self.results.close()
+		self.process.terminate()
+
+
+class ProcessExecutor:
+	""" Runs CPU-bound calls on a persistent pool of worker processes.
+	
+	    Each call submitted with `run' returns a Future, which is fulfilled on
+	    the loop once a worker has finished the call. Up to `maxWorkers'
+	    processes are started, as they are needed, and each runs one call at
+	    a time; calls are queued on the loop until a worker is free, so that
+	    the loop never blocks writing to a busy worker.
+	
+	    Arguments and results that are bytes-like and at least
+	    `sharedThreshold' bytes long are passed through a shared memory
+	    segment, a file in /dev/shm that both sides map, instead of being
+	    pickled down the pipe. The segment is created by the sender and
+	    unlinked by the loop once the call has completed. Setting up a
+	    segment costs several system calls, so below about a megabyte
+	    pickling is the cheaper of the two. Without /dev/shm, everything is
+	    pickled.
+	
+	    The pipe that each worker sends its results up is registered with
+	    the dispatcher while the worker has a call in progress, so that the
+	    result wakes the loop, and it is read without blocking as it arrives.
+	    A worker that dies is replaced, failing the call that it had. The
+	    called function and its arguments must be picklable.
+	"""
+	def __init__(self, maxWorkers = None, sharedThreshold = 1 << 20,
+	                   context = None):
+		if maxWorkers is None:
+			maxWorkers = os.cpu_count() or 1
+		if context is None:
+			context = multiprocessing.get_context()
+		self.maxWorkers = maxWorkers
+		self.sharedThreshold = sharedThreshold
+		self.context = context
+		self.workers = []
+		self.idle = []
+		self.pending = deque()
+	
+	def run(self, function, *args):
+		""" Call `function' with `args' in a worker process.
+		
+		    Returns a Future for the result of the call.
+		"""
+		fut = Future()
+		self.pending.append((fut, function, args))
+		if len(self.idle) == 0 and len(self.workers) < self.maxWorkers:
+			worker = _Worker(self.context, self.sharedThreshold)
+			self.workers.append(worker)
+			self.idle.append(worker)
+		if len(self.idle) > 0:
+			self.__startNext(self.idle.pop())
+		return fut
+	
+	def shutdown(self):
+		""" Stop the worker processes, failing any calls still queued.
+		"""
+		while len(self.pending) > 0:
+			self.pending.popleft()[0].setError(
+			                       Exception("ProcessExecutor was shut down"))
+		for worker in self.workers:
+			if worker.job is not None:
+				self.__finish(worker, False,
+				              Exception("ProcessExecutor was shut down"))
+			self.__unregister(worker)
+			try:
+				worker.jobs.send(None)
+			except OSError:
+				# The worker has died already.
+				worker.close()
+			else:
+				worker.jobs.close()
+				worker.results.close()
+			worker.process.join()
+		self.workers = []
+		self.idle = []
+	
+	def __startNext(self, worker):
+		""" Give the next queued call to the idle `worker'.
+		
+		    A call that cannot be pickled fails by itself, whereas one that
+		    cannot be written means that the worker has died, and it is
+		    replaced.
+		"""
+		fut, function, args = self.pending.popleft()
+		segments = []
+		try:
+			args = tuple(_share(arg, self.sharedThreshold, segments)
+			             for arg in args)
+			data = ForkingPickler.dumps((function, args))
+		except Exception as error:
+			_release(segments)
+			fut.setError(error)
+			self.__unregister(worker)
+			self.idle.append(worker)
+			return
+		try:
+			worker.jobs.send_bytes(data)
+		except OSError as error:
+			_release(segments)
+			fut.setError(error)
+			self.__replace(worker)
+			return
+		worker.job = (fut, segments)
+		# The pipe stays registered while the worker is kept busy.
+		if not worker.registered:
+			handle = lambda mask: self.__handleResult(worker)
+			dispatcher.registerFileEvent(worker.fileNumber, select.EPOLLIN,
+			                             handle)
+			worker.registered = True
+	
+	def __unregister(self, worker):
+		if worker.registered:
+			dispatcher.unregisterFileEvent(worker.fileNumber, select.EPOLLIN)
+			worker.registered = False
+	
+	def __replace(self, worker):
+		""" Drop the dead `worker', starting another in its place if there
+		    are calls queued.
+		"""
+		self.__unregister(worker)
+		self.workers.remove(worker)
+		worker.close()
+		if len(self.pending) > 0:
+			replacement = _Worker(self.context, self.sharedThreshold)
+			self.workers.append(replacement)
+			self.__startNext(replacement)
+	
+	def __handleResult(self, worker):
+		""" Read from `worker', collecting the result of its call once all of
+		    it has arrived.
+		"""
+		try:
+			message = worker.read()
+		except (OSError, EOFError) as error:
+			# The worker died: replace it.
+			self.__finish(worker, False, error)
+			self.__replace(worker)
+			return
+		if message is None:
+			return
+		try:
+			success, value = ForkingPickler.loads(message)
+			if success:
+				value = _unshare(value, True)
+		except Exception as error:
+			success, value = False, error
+		self.__finish(worker, success, value)
+		if len(self.pending) > 0:
+			self.__startNext(worker)
+		else:
+			self.__unregister(worker)
+			self.idle.append(worker)
+	
+	def __finish(self, worker, success, value):
+		""" Complete the call in progress on `worker'.
+		"""
+		fut, segments = worker.job
+		worker.job = None
+		_release(segments)
+		if success:
+			fut.setResult(value)
+		else:
+			fut.setError(value)
+
+
+_defaultExecutor = None
+
+
+def runInProcess(function, *args):
+	""" Call `function' with `args' on the default ProcessExecutor.
+	
+	    Returns a Future for the result. Used to keep CPU-bound work, such as
+	    payload transforms or checksums, from stalling the loop.
+	"""
+	global _defaultExecutor
+	if _defaultExecutor is None:
+		_defaultExecutor = ProcessExecutor()
+	return _defaultExecutor.run(function, *args)
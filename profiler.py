@@ -0,0 +1,218 @@
+import gc
+import logging
+import sys
+import threading
+import weakref
+from collections import Counter
+from time import time
+
+from greenlet import greenlet
+
+from .core import Future, _GreenTask, _Task, dispatcher
+
+__all__ = ["SlowCallbackWatchdog", "SamplingProfiler", "describeHandle"]
+
+_log = logging.getLogger(__name__)
+_waitCode = Future.__iter__.__code__
+
+
+def _generatorFrames(gen):
+	""" Returns the frames of a suspended generator or coroutine, outermost
+	    first, following the chain of generators that it is delegating to.
+	"""
+	frames = []
+	while gen is not None:
+		frame = getattr(gen, "gi_frame", None) or getattr(gen, "cr_frame", None)
+		if frame is None:
+			break
+		frames.append(frame)
+		gen = getattr(gen, "gi_yieldfrom", None) or \
+		      getattr(gen, "cr_await", None)
+	return frames
+
+
+def _running(gen):
+	running = getattr(gen, "gi_running", None)
+	if running is None:
+		running = getattr(gen, "cr_running", False)
+	return running
+
+
+def _frameStack(frame):
+	""" Returns `frame' and its callers, outermost first.
+	"""
+	frames = []
+	while frame is not None:
+		frames.append(frame)
+		frame = frame.f_back
+	frames.reverse()
+	return frames
+
+
+def _where(frame):
+	code = frame.f_code
+	return "%s (%s:%d)" % (getattr(code, "co_qualname", code.co_name),
+	                       code.co_filename, frame.f_lineno)
+
+
+def describeHandle(handle):
+	""" Returns a description of `handle' for reporting.
+	
+	    This is the qualified name of the handle and, where the handle steps
+	    a task, generator or greenlet, the place where that is now suspended.
+	"""
+	name = getattr(handle, "__qualname__", None) or repr(handle)
+	code = getattr(handle, "__code__", None)
+	if code is not None:
+		name += " (%s:%d)" % (code.co_filename, code.co_firstlineno)
+	owner = getattr(handle, "__self__", None)
+	if isinstance(owner, _Task):
+		owner = owner.gen
+	if isinstance(owner, _GreenTask):
+		frames = _frameStack(owner.green.gr_frame)
+	else:
+		frames = _generatorFrames(owner)
+	# Name the code that is waiting, not the Future that it waits on.
+	if len(frames) > 1 and frames[-1].f_code is _waitCode:
+		frames.pop()
+	if len(frames) > 0:
+		name += ", suspended at %s" % _where(frames[-1])
+	return name
+
+
+class SlowCallbackWatchdog:
+	""" Reports the handles that run for longer than `threshold' seconds.
+	
+	    While started, the watchdog is the dispatcher's handleHook, so that
+	    runOnce times every handle, and each handle that takes too long is
+	    passed, with the time it took, to `report'. By default this logs a
+	    warning naming the handle and, for a step of a task, the frame at
+	    which the task is now suspended, which is just after the code that
+	    was slow. Stats, when kept, pass each handle on to the hook.
+	
+	    A handle that makes a nested await is suspended while other handles
+	    run, so it is not timed.
+	"""
+	def __init__(self, threshold = 0.05, report = None,
+	                   dispatcher = dispatcher):
+		self.threshold = threshold
+		self.report = report if report is not None else self.log
+		self.dispatcher = dispatcher
+	
+	def start(self):
+		self.dispatcher.handleHook = self.__check
+	
+	def stop(self):
+		self.dispatcher.handleHook = None
+	
+	def log(self, handle, elapsed):
+		_log.warning("Slow callback took %.3f s: %s", elapsed,
+		             describeHandle(handle))
+	
+	def __check(self, handle, elapsed):
+		if elapsed >= self.threshold:
+			self.report(handle, elapsed)
+
+
+class SamplingProfiler:
+	""" A statistical profiler for code running on the dispatcher.
+	
+	    Every `interval' seconds a sampling thread records three kinds of
+	    stack: that of the loop's thread, which is whatever is running; that
+	    of every suspended greenlet, each blocked in a nested await; and
+	    that of every suspended task, each waiting on a Future. These are
+	    rooted at `running', `greenlet' and `task' respectively, so one
+	    profile shows both where the loop spends its time and where the
+	    coroutines spend theirs waiting.
+	
+	    Finding the greenlets and tasks means a scan of the objects tracked
+	    by the garbage collector, which is too slow to make at every sample,
+	    so it is made every `scanInterval' seconds and the objects found are
+	    sampled until the next scan. They are only weakly referenced in
+	    between, so that sampling does not keep finished ones alive.
+	
+	    The samples are written by `write' as collapsed stacks, one line per
+	    distinct stack with its count, which is the input expected by
+	    flamegraph.pl and by speedscope.
+	"""
+	def __init__(self, interval = 0.005, scanInterval = 1.0):
+		self.interval = interval
+		self.scanInterval = scanInterval
+		self.samples = Counter()
+		self.thread = None
+	
+	def start(self):
+		""" Start sampling the calling thread, which must run the loop.
+		"""
+		self.loopThread = threading.get_ident()
+		self.stopping = threading.Event()
+		self.thread = threading.Thread(target = self.__sample, daemon = True)
+		self.thread.start()
+	
+	def stop(self):
+		self.stopping.set()
+		self.thread.join()
+		self.thread = None
+	
+	def write(self, fileObject):
+		""" Write the samples to `fileObject' as collapsed stacks.
+		"""
+		for stack, count in sorted(self.samples.items()):
+			fileObject.write("%s %d\n" % (stack, count))
+	
+	def __sample(self):
+		greenlets = tasks = ()
+		nextScan = 0
+		while not self.stopping.wait(self.interval):
+			if time() >= nextScan:
+				greenlets, tasks = self.__scan()
+				nextScan = time() + self.scanInterval
+			self.__sampleOnce(greenlets, tasks)
+	
+	def __sampleOnce(self, greenlets, tasks):
+		# The greenlets and tasks are only held strongly for this sample,
+		# and are skipped if they have died, or are running, since the loop
+		# may resume one while its frames are walked here. A stack is only
+		# recorded if it was not resumed by the end of the walk.
+		frame = sys._current_frames().get(self.loopThread)
+		if frame is None:
+			return
+		self.__record("running", _frameStack(frame))
+		del frame
+		for reference in greenlets:
+			green = reference()
+			if green is None or green.gr_frame is None:
+				continue
+			frames = _frameStack(green.gr_frame)
+			if green.gr_frame is not None:
+				self.__record("greenlet", frames)
+		for reference in tasks:
+			task = reference()
+			if task is None or task.isDone or _running(task.gen):
+				continue
+			frames = _generatorFrames(task.gen)
+			if not _running(task.gen):
+				self.__record("task", frames)
+	
+	def __scan(self):
+		# Only weak references are kept between scans, so that the profiler
+		# does not keep finished greenlets and tasks, or their frames, alive.
+		greenlets = []
+		tasks = []
+		for thing in gc.get_objects():
+			if isinstance(thing, greenlet):
+				greenlets.append(weakref.ref(thing))
+			elif isinstance(thing, _Task):
+				tasks.append(weakref.ref(thing))
+		return greenlets, tasks
+	
+	def __record(self, root, frames):
+		if len(frames) == 0:
+			return
+		stack = [root]
+		for frame in frames:
+			code = frame.f_code
+			stack.append("%s (%s:%d)" % (getattr(code, "co_qualname",
+			                                     code.co_name),
+			                             code.co_filename, code.co_firstlineno))
+		self.samples[";".join(stack)] += 1
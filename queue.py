@@ -1,6 +1,57 @@
 from .core import *
+from .core import OwnedFuture
 from .aux import *
 from collections import deque
+from functools import partial
+from itertools import count
+import heapq
+
+_empty = object()
+
+class _BatchWaiter(OwnedFuture):
+	""" A `getMany' waiting on an empty Queue.
+	
+	    A single `put' fulfills it with a list of its one value, whereas
+	    `putMany' hands it up to `maxItems' values at once.
+	"""
+	__slots__ = ("maxItems",)
+	
+	def __init__(self, owner, maxItems):
+		OwnedFuture.__init__(self, owner)
+		self.maxItems = maxItems
+	
+	def setResult(self, value):
+		OwnedFuture.setResult(self, [value])
+	
+	def setResults(self, values):
+		OwnedFuture.setResult(self, values)
+
+
+class _Batches:
+	""" Iterates over the Queue `queue' in lists of up to `size' items.
+	
+	    In an `async for' loop each list is awaited directly. In a generator
+	    based coroutine each step of a plain `for' loop gives a Future, from
+	    which the list is taken with `yield from'. Either way one Future is
+	    made for each batch, rather than for each item, and the iteration
+	    waits forever on an empty Queue.
+	"""
+	def __init__(self, queue, size):
+		self.queue = queue
+		self.size = size
+	
+	def __iter__(self):
+		return self
+	
+	def __next__(self):
+		return self.queue.getMany(self.size)
+	
+	def __aiter__(self):
+		return self
+	
+	def __anext__(self):
+		return self.queue.getMany(self.size)
+
 
 class Queue:
 	""" An asynchronous Queue implementation.
@@ -17,15 +68,63 @@ class Queue:
 	    a process then waiting to put, its value will be shifted on to the deque
 	    and it will be unblocked. If the Queue is empty, the `get' will block
 	    until released by a `put'.
+	    Items can also be moved in bulk with `putMany', `getMany' and `drain',
+	    and consumed in batches with `batches'.
+	
+	    The Queue holds at most `length' values, or any number if `length' is
+	    None, or negative, in which case a `put' never blocks. A length of 0
+	    hands each value straight from a `put' to a `get'.
+	
+	    Watermarks let a producer stop before it has to block. Once the Queue
+	    holds `high' values, counting those of blocked `put's, `onHigh' is
+	    called, and once it has fallen back to `low' values `onLow' is
+	    called, so that, for example, a producer fed by a ReadWrapper can stop
+	    reading, and leave its file unregistered, in between. `high' defaults
+	    to `length' and `low' to half of `high'. The callbacks are called
+	    directly by the `put' or `get' that crossed the mark, so they must not
+	    block, and each is only called after the other.
 	"""
-	def __init__(self, length = -1):
-		if length == -1:
-			self.values = deque()
-		else:
-			self.values = deque(maxlen=length)
+	# Set by subclasses to a test of whether an item must be taken alone.
+	_alone = None
+	# Cleared by subclasses whose store does not give values back in the
+	# order that they were put.
+	_fifo = True
+	
+	def __init__(self, length = None, high = None, low = None,
+	             onHigh = None, onLow = None):
+		if length is not None and length < 0:
+			length = None
+		self._makeStore()
 		self.getwaiters = deque()
 		self.putwaiters = deque()
 		self.length = length
+		
+		if onHigh is None and onLow is None:
+			high = low = None
+		else:
+			if high is None:
+				high = length
+			if high is None or high < 1:
+				raise(Exception("Watermarks need a high mark of at least 1"))
+			if low is None:
+				low = high // 2
+			if not 0 <= low < high:
+				raise(Exception("The low mark must be below the high mark"))
+		self.high = high
+		self.low = low
+		self.onHigh = onHigh
+		self.onLow = onLow
+		self.isHigh = False
+	
+	def _makeStore(self):
+		# Create the store of values, `values', and bind its operations.
+		# Entries are pushed in the order that they are put, and popped in
+		# the order that they are to be got.
+		self.values = deque()
+		self._push = self.values.append
+		self._pushMany = self.values.extend
+		self._pop = self.values.popleft
+		self._peek = partial(self.values.__getitem__, 0)
 	
 	def sumSize(self):
 		""" Returns the `virtual' length of the Queue.
@@ -37,6 +136,30 @@ class Queue:
 		"""
 		return len(self.values) + len(self.putwaiters) - len(self.getwaiters)
 	
+	def _checkHigh(self):
+		if len(self.values) + len(self.putwaiters) >= self.high:
+			self.isHigh = True
+			if self.onHigh is not None:
+				self.onHigh()
+	
+	def _checkLow(self):
+		if len(self.values) + len(self.putwaiters) <= self.low:
+			self.isHigh = False
+			if self.onLow is not None:
+				self.onLow()
+	
+	def _store(self, entry):
+		# Buffer `entry' if there is space, otherwise block until there is.
+		if self.length is None or len(self.values) < self.length:
+			self._push(entry)
+			result = doneFuture
+		else:
+			result = OwnedFuture(self)
+			self.putwaiters.append((result, entry))
+		if self.high is not None and not self.isHigh:
+			self._checkHigh()
+		return result
+	
 	@asynchronous
 	def put(self, value):
 		""" Add an item to the Queue, blocking if it is full.
@@ -49,13 +172,135 @@ class Queue:
 		if len(self.getwaiters) > 0:
 			self.getwaiters.popleft().setResult(value)
 			return doneFuture
-		elif self.length > len(self.values):
-			self.values.append(value)
+		return self._store(value)
+	
+	@asynchronous
+	def putMany(self, items):
+		""" Add all of `items' to the Queue, blocking if it fills up.
+		
+		    Waiting `get's are handed an item each and waiting `getMany's as
+		    many items as they asked for, in one pass over the waiters. What
+		    is left is added to the internal deque while there is space, and
+		    any remainder waits behind a single Future, which is done when the
+		    last of the items has been taken. In a Queue that is not first in,
+		    first out, the items for the waiters are stored first, so that
+		    they are handed out in the Queue's order.
+		"""
+		items = list(items)
+		return self._putMany(items, items)
+	
+	def _putMany(self, items, entries):
+		# Waiters are given `items', and the deque `entries', which are the
+		# same items in the form in which the Queue stores them.
+		index = 0
+		count = len(items)
+		getwaiters = self.getwaiters
+		if len(getwaiters) > 0 and not self._fifo:
+			index = self._serveStored(entries)
+		while len(getwaiters) > 0 and index < count:
+			waiter = getwaiters.popleft()
+			if type(waiter) is _BatchWaiter:
+				end = index + waiter.maxItems
+				waiter.setResults(items[index:end])
+				index = min(end, count)
+			else:
+				waiter.setResult(items[index])
+				index += 1
+		if index >= count:
+			if self.high is not None and not self.isHigh:
+				self._checkHigh()
 			return doneFuture
+		if self.length is None:
+			room = count - index
 		else:
-			getBarrier = Future()
-			self.putwaiters.append((getBarrier, value))
-			return getBarrier
+			room = self.length - len(self.values)
+		if room > 0:
+			self._pushMany(entries[index:index + room])
+			index += room
+		if index >= count:
+			result = doneFuture
+		else:
+			result = OwnedFuture(self)
+			self.putwaiters.extend((result, entry)
+			                       for entry in entries[index:])
+		if self.high is not None and not self.isHigh:
+			self._checkHigh()
+		return result
+	
+	def _serveStored(self, entries):
+		# Store as many of `entries' as the waiting getters want and the
+		# space left will hold, and hand the getters theirs from the store,
+		# in its order. Returns the number of entries stored. The getters
+		# are given entries, which these stores keep as the values.
+		if self.length is None:
+			wanted = len(entries)
+		else:
+			wanted = self.length - len(self.values)
+			for waiter in self.getwaiters:
+				if type(waiter) is _BatchWaiter:
+					wanted += waiter.maxItems
+				else:
+					wanted += 1
+		stored = min(len(entries), wanted)
+		self._pushMany(entries[:stored])
+		getwaiters = self.getwaiters
+		while len(getwaiters) > 0 and len(self.values) > 0:
+			waiter = getwaiters.popleft()
+			if type(waiter) is _BatchWaiter:
+				waiter.setResults(self._take(waiter.maxItems))
+			else:
+				waiter.setResult(self._takeOne())
+		return stored
+	
+	def _takePut(self):
+		# Take the first blocked value, releasing its producer if this was
+		# its last value.
+		putwaiters = self.putwaiters
+		getBarrier, value = putwaiters.popleft()
+		if len(putwaiters) == 0 or putwaiters[0][0] is not getBarrier:
+			getBarrier.setResult(None)
+		return value
+	
+	def _takeOne(self):
+		# Take the next stored entry, or return _empty if there is none. A
+		# blocked value is only left over when the store is full, or when
+		# the length is 0, and it is pushed before the pop so that it is
+		# ordered along with the stored values.
+		if len(self.putwaiters) > 0:
+			self._push(self._takePut())
+		elif len(self.values) == 0:
+			return _empty
+		entry = self._pop()
+		if self.isHigh:
+			self._checkLow()
+		return entry
+	
+	def _take(self, maxItems):
+		# Take up to `maxItems' stored entries, in order, shifting blocked
+		# values on to the deque as space opens up.
+		alone = self._alone
+		taken = []
+		while len(taken) < maxItems:
+			if alone is not None:
+				if len(self.values) > 0:
+					entry = self._peek()
+				elif len(self.putwaiters) > 0:
+					entry = self.putwaiters[0][1]
+				else:
+					break
+				if alone(entry) and len(taken) > 0:
+					break
+			if len(self.putwaiters) > 0:
+				self._push(self._takePut())
+			elif len(self.values) == 0:
+				break
+			entry = self._pop()
+			taken.append(entry)
+			if alone is not None and alone(entry):
+				break
+		if self.isHigh:
+			self._checkLow()
+		return taken
 	
 	@asynchronous
 	def get(self):
@@ -64,70 +309,243 @@ class Queue:
 		    Tries to retrieve a single value from the Queue. If no value is
 		    available then this will block until a value is available.
 		"""
-		fut = Future()
-		if len(self.putwaiters) > 0:
-			getBarrier, value = self.putwaiters.popleft()
-			if self.length > 0:
-				myValue = self.values.popleft()
-				self.values.append(value)
-			else:
-				myValue = value
-			getBarrier.setResult(None)
-		elif len(self.values) > 0:
-			value = self.values.popleft()
+		fut = OwnedFuture(self)
+		value = self._takeOne()
+		if value is _empty:
+			self.getwaiters.append(fut)
 		else:
+			fut.setResult(value)
+		return fut
+	
+	@asynchronous
+	def getMany(self, maxItems):
+		""" Retrieve up to `maxItems' items from the Queue as a list.
+		
+		    Returns whatever is available, without waiting, if there is
+		    anything. If the Queue is empty then this will block until at
+		    least one item has been put.
+		"""
+		if maxItems < 1:
+			raise(Exception("getMany needs a maxItems of at least 1"))
+		fut = _BatchWaiter(self, maxItems)
+		taken = self._take(maxItems)
+		if len(taken) == 0:
 			self.getwaiters.append(fut)
-			return fut
-		fut.setResult(value)
+		else:
+			fut.setResults(taken)
 		return fut
+	
+	def drain(self):
+		""" Remove and return everything that is available in the Queue.
+		
+		    This never waits, returning an empty list for an empty Queue, and
+		    releases any blocked `put's whose values it takes.
+		"""
+		return self._take(len(self.values) + len(self.putwaiters))
+	
+	def batches(self, size):
+		""" Iterate over the Queue in lists of up to `size' items.
+		
+		    Each step is a `getMany(size)', so the lists hold what was available
+		    at the time, and a step waits while the Queue is empty. This works
+		    with `async for' and, in generator based coroutines, as
+		    `for batch in queue.batches(size): items = yield from batch'.
+		"""
+		return _Batches(self, size)
+	
+	def withdrawWaiter(self, fut):
+		""" Remove a waiting `get' or `put' whose Future has been withdrawn.
+		
+		    A withdrawn `putMany' removes all of its values that are still
+		    waiting.
+		"""
+		if any(waiter is fut for waiter, _ in self.putwaiters):
+			self.putwaiters = deque(entry for entry in self.putwaiters
+			                        if entry[0] is not fut)
+			if self.isHigh:
+				self._checkLow()
+			return
+		self.getwaiters.remove(fut)
+	
+	def __aiter__(self):
+		return self
+	
+	def __anext__(self):
+		""" Get the next item from the Queue in an `async for' loop, which
+		    will wait forever on an empty Queue.
+		"""
+		return self.get()
+
+
+class LifoQueue(Queue):
+	""" A Queue that gives back the most recently put value first.
+	
+	    A value that has been blocked by a full LifoQueue counts as put when
+	    it is let in, which is as the next value is taken, so it is the one
+	    that is taken.
+	"""
+	_fifo = False
+	
+	def _makeStore(self):
+		self.values = []
+		self._push = self.values.append
+		self._pushMany = self.values.extend
+		self._pop = self.values.pop
+		self._peek = partial(self.values.__getitem__, -1)
+
+
+class PriorityQueue(Queue):
+	""" A Queue that gives back the value with the lowest priority first.
+	
+	    The priority of a value is `key(value)', or the value itself without
+	    a `key', and values of equal priority are got in the order that they
+	    were put, without the values themselves being compared. Values that
+	    are blocked by a full PriorityQueue wait in the order that they were
+	    put, and each is ordered by its priority as it is let in.
+	"""
+	_fifo = False
+	
+	def __init__(self, length = None, key = None, high = None, low = None,
+	             onHigh = None, onLow = None):
+		self.key = key
+		Queue.__init__(self, length, high, low, onHigh, onLow)
+	
+	def _makeStore(self):
+		heap = self.values = []
+		key = self.key
+		order = count()
+		
+		def push(value):
+			priority = value if key is None else key(value)
+			heapq.heappush(heap, (priority, next(order), value))
+		
+		def pushMany(values):
+			for value in values:
+				push(value)
+		
+		def pop():
+			return heapq.heappop(heap)[2]
+		
+		def peek():
+			return heap[0][2]
+		
+		self._push = push
+		self._pushMany = pushMany
+		self._pop = pop
+		self._peek = peek
+
+
+class ThreadSafeQueue(Queue):
+	""" An unbounded Queue that any thread can put values into.
+	
+	    `put' and `putMany' only add to an inbox, which is safe from any
+	    thread, and the first value since the inbox was last emptied
+	    schedules the emptying on the loop with scheduleThreadsafe. So a
+	    burst of values from any number of threads costs one write to the
+	    dispatcher's Waker, and one pass over the waiting getters, which is
+	    best consumed with `getMany' or `batches'. Neither blocks, and both
+	    return the done Future, so that code written for a Queue can still
+	    wait on them. The getting side, along with the watermark callbacks,
+	    belongs to the loop as with any Queue.
+	"""
+	def __init__(self, high = None, low = None, onHigh = None, onLow = None):
+		Queue.__init__(self, None, high, low, onHigh, onLow)
+		self.inbox = deque()
+		self.flushPending = False
+	
+	def put(self, value):
+		""" Add `value' to the Queue, from any thread.
+		"""
+		self.inbox.append(value)
+		if not self.flushPending:
+			self.flushPending = True
+			dispatcher.scheduleThreadsafe(self.__flush)
+		return doneFuture
+	
+	def putMany(self, items):
+		""" Add all of `items' to the Queue, from any thread.
+		"""
+		self.inbox.extend(items)
+		if not self.flushPending:
+			self.flushPending = True
+			dispatcher.scheduleThreadsafe(self.__flush)
+		return doneFuture
+	
+	def __flush(self):
+		# Clear the flag before emptying the inbox, so that a value that
+		# misses this flush will schedule another.
+		self.flushPending = False
+		inbox = self.inbox
+		popleft = inbox.popleft
+		items = [popleft() for _ in range(len(inbox))]
+		if len(items) > 0:
+			self._putMany(items, items)
+
+
+def _isError(entry):
+	return not entry[0]
 
 
 class XQueue(Queue):
+	""" A Queue of results and errors.
+	
+	    Values are put with `putResult' or `putError', and a `get' returns a
+	    result or raises an error in the order that they were put. A batch
+	    from `getMany', `drain' or `batches' holds results up to the next
+	    error, and an error at the front of the Queue is raised by itself.
+	"""
+	_alone = staticmethod(_isError)
+	
 	def putResult(self, value):
 		if len(self.getwaiters) > 0:
 			self.getwaiters.popleft().setResult(value)
 			return doneFuture
-		elif self.length > len(self.values):
-			self.values.append((True, value))
-			return doneFuture
-		else:
-			getBarrier = Future()
-			self.putwaiters.append((getBarrier, (True, value)))
-			return getBarrier
+		return self._store((True, value))
 	
 	def putError(self, error):
 		if len(self.getwaiters) > 0:
 			self.getwaiters.popleft().setError(error)
 			return doneFuture
-		elif self.length > len(self.values):
-			self.values.append((False, value))
-			return doneFuture
-		else:
-			getBarrier = Future()
-			self.putwaiters.append((getBarrier, (False, value)))
-			return getBarrier
+		return self._store((False, error))
+	
+	def putMany(self, values):
+		""" Put each of `values' as a result, as with `Queue.putMany'.
+		"""
+		values = list(values)
+		return self._putMany(values, [(True, value) for value in values])
 	
 	def get(self):
-		fut = Future()
-		if len(self.putwaiters) > 0:
-			getBarrier, value = self.putwaiters.popleft()
-			if self.length > 0:
-				myValue = self.values.popleft()
-				self.values.append(value)
-			else:
-				myValue = value
-			getBarrier.setResult(None)
-		elif len(self.values) > 0:
-			myValue = self.values.popleft()
-		else:
+		fut = OwnedFuture(self)
+		entry = self._takeOne()
+		if entry is _empty:
 			self.getwaiters.append(fut)
 			return fut
 		
-		success, value = myValue
+		success, value = entry
 		if success:
 			fut.setResult(value)
 		else:
 			fut.setError(value)
 		return fut
-
-
+	
+	def getMany(self, maxItems):
+		if maxItems < 1:
+			raise(Exception("getMany needs a maxItems of at least 1"))
+		fut = _BatchWaiter(self, maxItems)
+		taken = self._take(maxItems)
+		if len(taken) == 0:
+			self.getwaiters.append(fut)
+		elif taken[0][0]:
+			fut.setResults([value for _, value in taken])
+		else:
+			fut.setError(taken[0][1])
+		return fut
+	
+	def drain(self):
+		""" Remove and return the results at the front of the Queue, raising
+		    the error instead if one is at the front.
+		"""
+		taken = self._take(len(self.values) + len(self.putwaiters))
+		if len(taken) > 0 and not taken[0][0]:
+			raise(taken[0][1])
+		return [value for _, value in taken]
@@ -0,0 +1,299 @@
+from collections import deque
+from time import perf_counter, time
+
+__all__ = ["Histogram", "DispatcherStats"]
+
+
+class Histogram:
+	""" A latency histogram in the manner of HdrHistogram.
+	
+	    Values are counted in multiples of `unit' and kept to `precision'
+	    significant bits, so that every recorded value is within one part in
+	    2**precision of the truth, whatever its magnitude, while the number of
+	    buckets grows only with the logarithm of the range covered. Buckets
+	    are held sparsely in a dict keyed by their lowest value.
+	"""
+	__slots__ = ("unit", "precision", "counts", "count", "total", "min", "max")
+	
+	def __init__(self, unit = 1e-6, precision = 5):
+		self.unit = unit
+		self.precision = precision
+		self.reset()
+	
+	def reset(self):
+		self.counts = {}
+		self.count = 0
+		self.total = 0
+		self.min = None
+		self.max = None
+	
+	def record(self, value):
+		self.count += 1
+		self.total += value
+		if self.min is None or value < self.min:
+			self.min = value
+		if self.max is None or value > self.max:
+			self.max = value
+		bucket = int(value / self.unit)
+		shift = bucket.bit_length() - self.precision
+		if shift > 0:
+			bucket = bucket >> shift << shift
+		counts = self.counts
+		counts[bucket] = counts.get(bucket, 0) + 1
+	
+	def percentile(self, percent):
+		""" Returns the value below which `percent' per cent of the recorded
+		    values fall, to the precision of the histogram.
+		"""
+		if self.count == 0:
+			return None
+		target = self.count * percent / 100
+		seen = 0
+		for bucket in sorted(self.counts):
+			seen += self.counts[bucket]
+			if seen >= target:
+				return bucket * self.unit
+		return self.max
+	
+	def snapshot(self):
+		""" Returns a dict summarising the recorded values.
+		"""
+		return {"count": self.count,
+		        "mean": self.total / self.count if self.count else None,
+		        "min": self.min,
+		        "max": self.max,
+		        "p50": self.percentile(50),
+		        "p90": self.percentile(90),
+		        "p99": self.percentile(99),
+		        "p99.9": self.percentile(99.9)}
+
+
+_classes = ("high", "medium", "low", "io", "timer", "threadsafe")
+
+
+class _CountingDeque(deque):
+	""" A deque that counts the items added to it by class.
+	
+	    Items added at the left are `high'. Those added at the right are
+	    counted against `kind', which is `medium' unless one of the stats
+	    wrappers is adding items of another class. Items that the deque is
+	    created with are not counted.
+	"""
+	def __init__(self, *args):
+		super().__init__(*args)
+		self.kind = "medium"
+		self.counts = dict.fromkeys(_classes, 0)
+	
+	def append(self, item):
+		self.counts[self.kind] += 1
+		deque.append(self, item)
+	
+	def appendleft(self, item):
+		self.counts["high"] += 1
+		deque.appendleft(self, item)
+
+
+class DispatcherStats:
+	""" Instrumentation for a Dispatcher, installed by Dispatcher.setStats.
+	
+	    Nothing in the dispatcher checks whether stats are being kept.
+	    Instead, while installed, the methods of the loop that are to be
+	    measured are shadowed by instance attributes which wrap the originals,
+	    the ready queue is replaced by a counting deque and every timer that
+	    is pushed has its entry wrapped to record how late it ran. When the
+	    stats are uninstalled all of this is undone, so the loop runs exactly
+	    as before.
+	
+	    Handles are counted as they join the ready queue, by the class
+	    through which they joined it: `high' and `medium' for those scheduled
+	    directly, `low' for those promoted from the low priority queue, `io'
+	    for file events, `timer' for expired timers and `threadsafe' for those
+	    collected from other threads. Each class is counted where it is
+	    queued, so the timers and events admitted by a budget are counted as
+	    such, and handles already queued when the stats are installed are not
+	    counted at all. These are not counts of handles run, which are given
+	    by the `count' of `handleTime'.
+	
+	    A handle that makes a nested await is suspended while other handles
+	    run, so it is not timed. If a SlowCallbackWatchdog is started then it
+	    is passed the handles that are slow from this loop.
+	
+	    The dispatcher's starvation counters, which count the iterations cut
+	    short by its budget and the handles admitted as a result, are
+	    reported as they have changed since the stats were reset.
+	"""
+	def __init__(self, dispatcher):
+		self.dispatcher = dispatcher
+		self.handleTime = Histogram()
+		self.iterationTime = Histogram()
+		self.readyDepth = Histogram(1, 5)
+		self.pollWait = Histogram()
+		self.eventsPerPoll = Histogram(1, 5)
+		self.timerLateness = Histogram()
+		self.reset()
+	
+	def reset(self):
+		""" Discard everything recorded so far.
+		"""
+		self.started = time()
+		self.iterations = 0
+		self.polls = 0
+		self.pollTime = 0.0
+		self.events = 0
+		self.maxDepth = {"ready": 0, "lowPriority": 0, "timers": 0}
+		self.starvationBase = dict(self.dispatcher.starvation)
+		for histogram in (self.handleTime, self.iterationTime,
+		                  self.readyDepth, self.pollWait,
+		                  self.eventsPerPoll, self.timerLateness):
+			histogram.reset()
+		queue = self.dispatcher.handleQueue
+		if isinstance(queue, _CountingDeque):
+			queue.counts = dict.fromkeys(_classes, 0)
+	
+	def install(self):
+		dispatcher = self.dispatcher
+		self.handleQueue = self.__swapQueue(dispatcher.handleQueue,
+		                                    _CountingDeque)
+		dispatcher.handleQueue = self.handleQueue
+		dispatcher.runOnce = self.__runOnce
+		dispatcher.collectHandles = self.__collectHandles
+		dispatcher._pollEvents = self.__timePoll(dispatcher._pollEvents)
+		dispatcher._pollEventsFast = self.__timePoll(dispatcher._pollEventsFast)
+		dispatcher._scheduleEvents = self.__scheduleEvents
+		dispatcher._collectInbound = self.__collectInbound
+		timers = dispatcher.timers
+		timers.push = self.__pushTimer
+		timers.expire = self.__expireTimers
+		self.timers = timers
+	
+	def uninstall(self):
+		dispatcher = self.dispatcher
+		dispatcher.handleQueue = self.__swapQueue(dispatcher.handleQueue, deque)
+		for name in ("runOnce", "collectHandles", "_pollEvents",
+		             "_pollEventsFast", "_scheduleEvents", "_collectInbound"):
+			delattr(dispatcher, name)
+		del self.timers.push
+		del self.timers.expire
+	
+	def snapshot(self):
+		""" Returns a dict of everything recorded since the stats were
+		    installed or last reset, with the current depth of each queue.
+		"""
+		dispatcher = self.dispatcher
+		return {"elapsed": time() - self.started,
+		        "iterations": self.iterations,
+		        "handles": dict(self.handleQueue.counts),
+		        "depth": {"ready": len(dispatcher.handleQueue)
+		                           + len(dispatcher.batch),
+		                  "lowPriority": len(dispatcher.lowPriorityHandleQueue),
+		                  "timers": len(dispatcher.timers),
+		                  "inbound": len(dispatcher.inbound)},
+		        "maxDepth": dict(self.maxDepth),
+		        "budget": dispatcher.budget,
+		        "starvation": {name: count - self.starvationBase[name]
+		                       for name, count in
+		                       dispatcher.starvation.items()},
+		        "readyDepth": self.readyDepth.snapshot(),
+		        "polls": self.polls,
+		        "pollTime": self.pollTime,
+		        "pollWait": self.pollWait.snapshot(),
+		        "events": self.events,
+		        "eventsPerPoll": self.eventsPerPoll.snapshot(),
+		        "timerLateness": self.timerLateness.snapshot(),
+		        "handleTime": self.handleTime.snapshot(),
+		        "iterationTime": self.iterationTime.snapshot()}
+	
+	def __swapQueue(self, queue, kind):
+		""" Returns a new deque of `kind' holding the items of `queue'.
+		
+		    `queue' is emptied, so that a runOnce that is draining it when the
+		    swap is made runs none of its handles twice. The items moved are
+		    not counted as queued.
+		"""
+		replacement = kind(queue)
+		queue.clear()
+		return replacement
+	
+	def __runOnce(self, runner):
+		dispatcher = self.dispatcher
+		handleQueue = dispatcher.handleQueue
+		batch = dispatcher.batch
+		if len(handleQueue) == 0 and len(batch) == 0:
+			dispatcher.collectHandles()
+		self.iterations += 1
+		depth = len(handleQueue) + len(batch)
+		self.readyDepth.record(depth)
+		maxDepth = self.maxDepth
+		if depth > maxDepth["ready"]:
+			maxDepth["ready"] = depth
+		depth = len(dispatcher.lowPriorityHandleQueue)
+		if depth > maxDepth["lowPriority"]:
+			maxDepth["lowPriority"] = depth
+		depth = len(dispatcher.timers)
+		if depth > maxDepth["timers"]:
+			maxDepth["timers"] = depth
+		started = perf_counter()
+		# If nothing was collected the loop is not run, as it would only
+		# collect again.
+		if len(handleQueue) > 0 or len(batch) > 0:
+			type(dispatcher).runOnce(dispatcher, runner, self.__handleDone)
+		self.iterationTime.record(perf_counter() - started)
+	
+	def __handleDone(self, handle, elapsed):
+		self.handleTime.record(elapsed)
+		hook = self.dispatcher.handleHook
+		if hook is not None:
+			hook(handle, elapsed)
+	
+	def __collectHandles(self):
+		# The only handles that collectHandles queues itself are those
+		# promoted from the low priority queue; the rest are queued by the
+		# wrappers below, which count them as their own.
+		self.__queueAs("low", type(self.dispatcher).collectHandles,
+		               self.dispatcher)
+	
+	def __queueAs(self, kind, function, *args):
+		""" Call `function' with `args', counting the handles that it adds
+		    to the end of the ready queue as `kind'.
+		"""
+		queue = self.handleQueue
+		outer = queue.kind
+		queue.kind = kind
+		try:
+			function(*args)
+		finally:
+			queue.kind = outer
+	
+	def __timePoll(self, poll):
+		def timed(*args):
+			events = self.events
+			before = perf_counter()
+			poll(*args)
+			elapsed = perf_counter() - before
+			self.polls += 1
+			self.pollTime += elapsed
+			self.pollWait.record(elapsed)
+			self.eventsPerPoll.record(self.events - events)
+		return timed
+	
+	def __scheduleEvents(self, events):
+		self.events += len(events)
+		self.__queueAs("io", type(self.dispatcher)._scheduleEvents,
+		               self.dispatcher, events)
+	
+	def __collectInbound(self):
+		self.__queueAs("threadsafe", type(self.dispatcher)._collectInbound,
+		               self.dispatcher)
+	
+	def __pushTimer(self, timer):
+		timer.entry = (self.__runTimer, (timer.when, timer.entry))
+		type(self.timers).push(self.timers, timer)
+	
+	def __expireTimers(self, now, append):
+		self.__queueAs("timer", type(self.timers).expire, self.timers, now,
+		               append)
+	
+	def __runTimer(self, when, entry):
+		self.timerLateness.record(max(0.0, time() - when))
+		handle, args = entry
+		handle(*args)
@@ -5,6 +5,7 @@ import os
 import struct
 
 from .core import *
+from .core import OwnedFuture
 from .aux import *
 from .events import errorCheckingMask
 
@@ -32,6 +33,11 @@ class ReadWrapper:
 	    buffer. All reads from the buffer will result in a future being
 	    returned, which can be awaited (explicitly or through yield) to allow
 	    blocking to be delayed.
+	    
+	    If the dispatcher is edge-triggered, the reader is registered once for
+	    the lifetime of the wrapper. An event then only marks the file as
+	    readable and the wrapper reads from it until EAGAIN, or until the
+	    buffer is full, in which case reading resumes when the buffer drains.
 	"""
 	def __init__(self, fileObject, lowBuffer = 128, highBuffer = 256):
 		setNonblocking(fileObject)
@@ -44,7 +50,9 @@ class ReadWrapper:
 		self.iread = fileObject.read
 		self.readWaitingSize = 0
 		self.readClosing = None
-		if self.bufSizeHigh > 0:
+		self.edgeTriggered = dispatcher.edgeTriggered
+		self.readable = False
+		if self.bufSizeHigh > 0 or self.edgeTriggered:
 			self.__registerReader()
 		else:
 			self.registeredReader = False
@@ -58,7 +66,7 @@ class ReadWrapper:
 		    that it returns a future, rather than the amount read. 'awaiting'
 		    the future will block until the entire read is finished.
 		"""
-		fut = Future()
+		fut = OwnedFuture(self)
 		if self.readClosing is not None:
 			# Cannot read from a closing wrapper
 			fut.setError(Exception("Read on released wrapper"))
@@ -80,13 +88,18 @@ class ReadWrapper:
 			self.buf = remainder + self.buf[len(sumBit):]
 			fut.setResult(b"".join(sumBit))
 			self.bufSize -= length
-			if not self.registeredReader and self.bufSize < self.bufSizeLow:
-				self.__registerReader()
+			if self.bufSize < self.bufSizeLow:
+				if self.edgeTriggered:
+					self.__drainReader()
+				elif not self.registeredReader:
+					self.__registerReader()
 		else:
 			if not self.registeredReader:
 				self.__registerReader()
 			self.readWaitingSize += length
 			self.readWaiters.append((fut, length))
+			if self.edgeTriggered:
+				self.__drainReader()
 		
 		return fut
 	
@@ -101,7 +114,7 @@ class ReadWrapper:
 		if self.readClosing is not None:
 			return errorFuture(InterruptedTransfer("Read on released wrapper"))
 		
-		fut = Future()
+		fut = OwnedFuture(self)
 		if len(self.readWaiters) == 0 and self.bufSize > 0:
 			if len(self.buf) > 1:
 				bufString = b"".join(self.buf)
@@ -119,8 +132,45 @@ class ReadWrapper:
 		self.readWaiters.append((fut, -1))
 		if not self.registeredReader:
 			self.__registerReader()
+		if self.edgeTriggered:
+			self.__drainReader()
 		return fut
 	
+	def withdrawWaiter(self, fut):
+		""" Remove a waiting read whose Future has been withdrawn.
+		
+		    Data already read towards it stays in the buffer. The reader is
+		    unregistered, as it would be had the read completed, if nothing
+		    else is waiting.
+		"""
+		for index, (waiter, length) in enumerate(self.readWaiters):
+			if waiter is fut:
+				break
+		else:
+			return
+		del self.readWaiters[index]
+		if length != -1:
+			self.readWaitingSize -= length
+		if self.registeredReader and len(self.readWaiters) == 0:
+			if self.readClosing is not None:
+				self.__completeRelease()
+			elif self.bufSize >= self.bufSizeHigh and not self.edgeTriggered:
+				self.__unregisterReader()
+	
+	def __aiter__(self):
+		return self
+	
+	@asynchronous
+	def __anext__(self):
+		""" Read the next line in an `async for' loop, which ends when the
+		    stream is closed or the wrapper released.
+		"""
+		try:
+			return (yield from self.readline())
+		# A _SocketWrapper reports the end of the stream as a broken pipe.
+		except (StreamClosed, InterruptedTransfer, BrokenPipeError):
+			raise StopAsyncIteration
+	
 	@asynchronous
 	def release(self):
 		""" Releases control of the underlying file object. Will wait until all
@@ -189,21 +239,18 @@ class ReadWrapper:
 		    as total requested data from all the futures waiting for data and
 		    then fulfill as much as possible.
 		"""
+		if self.edgeTriggered and not mask & errorCheckingMask:
+			self.readable = True
+			self.__drainReader()
+			return
+		
 		try:
 			if mask & errorCheckingMask:
 				if mask & select.EPOLLERR:
 					raise(Exception("Error on file object"))
 				else:
 					raise(StreamClosed("Stream closed"))
-			if len(self.readWaiters) > 0 and self.readWaiters[0][1] == -1:
-				data = self.iread(self.bufSizeHigh)
-			else:
-				data = self.iread(self.readWaitingSize + self.bufSizeHigh
-					                     - self.bufSize)
-			data = self.__fillWaiters(data)
-			# Add remaining data into the buffer.
-			self.buf.append(data)
-			self.bufSize += len(data)
+			self.__readChunk()
 		
 		except Exception as e:
 			if len(self.readWaiters) > 0:
@@ -227,9 +274,52 @@ class ReadWrapper:
 			
 			# If the buffer is full then temporarily removed the handle
 			# from the events.
-			elif self.bufSize >= self.bufSizeHigh:
+			elif self.bufSize >= self.bufSizeHigh and not self.edgeTriggered:
 				self.__unregisterReader()
 	
+	def __readChunk(self):
+		""" Read one chunk from the file into the waiting reads and buffer.
+		"""
+		if len(self.readWaiters) > 0 and self.readWaiters[0][1] == -1:
+			data = self.iread(self.bufSizeHigh)
+		else:
+			data = self.iread(self.readWaitingSize + self.bufSizeHigh
+				                     - self.bufSize)
+		# A non-blocking file object signals EAGAIN by returning None.
+		if data is None:
+			raise BlockingIOError
+		if data == b"":
+			raise(StreamClosed("Stream closed"))
+		data = self.__fillWaiters(data)
+		# Add remaining data into the buffer.
+		self.buf.append(data)
+		self.bufSize += len(data)
+	
+	def __drainReader(self):
+		""" Read from an edge-triggered file for as long as it is readable.
+		
+		    Reading continues until the file reports EAGAIN, at which point
+		    the next event will mark it as readable again, or until there are
+		    no waiting reads and the buffer is full. An error other than EAGAIN
+		    fails all the waiting reads. The file is left marked as readable
+		    so that later reads will see the same error.
+		"""
+		while self.readable and (len(self.readWaiters) > 0 or
+		                         self.bufSize < self.bufSizeHigh):
+			try:
+				self.__readChunk()
+			except BlockingIOError:
+				self.readable = False
+			except Exception as e:
+				while len(self.readWaiters) > 0:
+					self.readWaiters.popleft()[0].setError(e)
+				self.readWaitingSize = 0
+				break
+		
+		if len(self.readWaiters) == 0 and self.readClosing is not None and \
+		   self.registeredReader:
+			self.__completeRelease()
+	
 	def __fillWaiters(self, data):
 		""" Private method to supply data to the waiting reads.
 		
@@ -332,6 +422,11 @@ class WriteWrapper:
 	    result in a future being returned, which can be awaited (explicitly or
 	    through a yield) to allow blocking to be delayed. As soon as the write
 	    is called, the data will be scheduled to be sent, however. 
+	    
+	    If the dispatcher is edge-triggered, the writer is registered once for
+	    the lifetime of the wrapper. Writes are then made straight away while
+	    the file is known to be writable, and otherwise wait for the event
+	    that marks it writable again.
 	"""
 	def __init__(self, fileObject):
 		setNonblocking(fileObject)
@@ -339,6 +434,11 @@ class WriteWrapper:
 		self.fileObject = fileObject
 		self.writeWaitingSize = 0
 		self.writeClosing = None
+		self.edgeTriggered = dispatcher.edgeTriggered
+		self.writable = False
+		self.registeredWriter = False
+		if self.edgeTriggered:
+			self.__registerWriter()
 	
 	def __del__(self):
 		if self.writeClosing is None or not self.writeClosing.isDone:
@@ -349,19 +449,43 @@ class WriteWrapper:
 		    that it returns a future, rather than the amount written. 'awaiting'
 		    the future will block until the entire write is finished.
 		"""
-		fut = Future()
+		fut = OwnedFuture(self)
 		length = len(buf)
 		if self.writeClosing is not None:
 			fut.setError(InterruptedTransfer("Write on released wrapper"))
 		elif length == 0:
 			fut.setResult(0)
 		else:
-			if self.writeWaitingSize == 0 and length > 0:
+			if not self.registeredWriter:
 				self.__registerWriter()
 			self.writeWaitingSize += length
 			self.writeWaiters.append((fut, buf, len(buf)))
+			if self.writable:
+				self.__writeOut(0)
 		return fut
 	
+	def withdrawWaiter(self, fut):
+		""" Remove a waiting write whose Future has been withdrawn.
+		
+		    A write that has been partly made cannot be taken back, so the
+		    rest of it is still written, with nothing waiting on it.
+		"""
+		for index, (waiter, data, length) in enumerate(self.writeWaiters):
+			if waiter is fut:
+				break
+		else:
+			return
+		if index == 0 and len(data) < length:
+			return
+		del self.writeWaiters[index]
+		self.writeWaitingSize -= len(data)
+		if self.writeWaitingSize == 0:
+			if self.registeredWriter and (not self.edgeTriggered or
+			                              self.writeClosing is not None):
+				self.__unregisterWriter()
+			if self.writeClosing is not None:
+				self.writeClosing.release()
+	
 	def release(self):
 		""" Releases control of the underlying file object.
 		    
@@ -372,6 +496,8 @@ class WriteWrapper:
 			return self.writeClosing
 		self.writeClosing = Barrier()
 		if len(self.writeWaiters) == 0:
+			if self.registeredWriter:
+				self.__unregisterWriter()
 			self.writeClosing.release()
 		return self.writeClosing
 	
@@ -383,11 +509,11 @@ class WriteWrapper:
 		"""
 		if self.writeClosing is None:
 			self.writeClosing = Barrier()
-		if len(self.writeWaiters) > 0:
-			self.writeWaitingSize = 0
+		if self.registeredWriter:
 			self.__unregisterWriter()
-			while len(self.writeWaiters) > 0:
-				self.writeWaiters.popleft()[0].setError(error)
+		self.writeWaitingSize = 0
+		while len(self.writeWaiters) > 0:
+			self.writeWaiters.popleft()[0].setError(error)
 		self.writeClosing.release()
 	
 	@asynchronous
@@ -427,6 +553,17 @@ class WriteWrapper:
 		    is a future waiting to write data. Will write as much data as
 		    possible and then flush the stream at the end of all the writes.
 		"""
+		if self.edgeTriggered:
+			self.writable = True
+		self.__writeOut(mask)
+	
+	def __writeOut(self, mask):
+		""" Write as much of the waiting data as the file will accept.
+		
+		    If the file does not accept all of it then it is no longer
+		    writable, which matters only in edge-triggered mode, where the
+		    remaining writes must wait for the next event.
+		"""
 		try:
 			doneIndex = 0
 			oldWriteWaitingSize = self.writeWaitingSize
@@ -437,11 +574,18 @@ class WriteWrapper:
 					raise(StreamClosed("Stream closed"))
 			while self.writeWaitingSize > 0:
 				fut, writeBytes, totalLength = self.writeWaiters[doneIndex]
-				dataSize = self.fileObject.write(writeBytes)
+				try:
+					dataSize = self.fileObject.write(writeBytes)
+				except BlockingIOError:
+					dataSize = None
+				# A non-blocking file object signals EAGAIN by returning None.
+				if dataSize is None:
+					dataSize = 0
 				self.writeWaitingSize -= dataSize
 				if dataSize < len(writeBytes):
 					self.writeWaiters[doneIndex] = (fut, writeBytes[dataSize:],
 					                                totalLength)
+					self.writable = False
 					break
 				else:
 					doneIndex += 1
@@ -469,21 +613,25 @@ class WriteWrapper:
 					doneIndex -= 1
 		
 		# oldWriteWaitingSize is used as a check in case the wrapper has been
-		# released already but this is a queued handle.
+		# released already but this is a queued handle. An edge-triggered
+		# writer stays registered until it is released.
 		if self.writeWaitingSize == 0 and oldWriteWaitingSize > 0:
-			self.__unregisterWriter()
+			if not self.edgeTriggered or self.writeClosing is not None:
+				self.__unregisterWriter()
 			if self.writeClosing is not None:
 				self.writeClosing.releaseFast()
 	
 	def __registerWriter(self):
 		""" Register this writer with the event dispatcher
 		"""
+		self.registeredWriter = True
 		dispatcher.registerFileEvent(self.fileObject.fileno(),
 		                             select.EPOLLOUT, self.__handleWriteFrom)
 	
 	def __unregisterWriter(self):
 		""" Unregister this writer with the event dispatcher
 		"""
+		self.registeredWriter = False
 		dispatcher.unregisterFileEvent(self.fileObject.fileno(),
 		                               select.EPOLLOUT)
 
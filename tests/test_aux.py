@@ -0,0 +1,167 @@
+import unittest
+
+from ..aux import ErrorGate, TaskGroup, TaskGroupError, sleep
+from ..core import Cancelled, Future, async, await, dispatcher, withTimeout
+
+
+class TaskGroupTest(unittest.TestCase):
+	def setUp(self):
+		self.log = []
+	
+	def _child(self, seconds, name, error = None, onCancel = None):
+		# Logs how the child ended, and raises `onCancel' if cancelled.
+		try:
+			yield from sleep(seconds)
+		except Cancelled:
+			self.log.append("cancelled " + name)
+			if onCancel is not None:
+				raise(onCancel)
+			raise
+		self.log.append(name)
+		if error is not None:
+			raise(error)
+		return name
+	
+	def testResults(self):
+		def main():
+			group = TaskGroup()
+			children = [group.spawn(self._child(0.001 * index, str(index)))
+			            for index in range(3)]
+			yield from group.wait()
+			return [child.getResult() for child in children]
+		self.assertEqual(await(withTimeout(5, main())), ["0", "1", "2"])
+	
+	def testFailureCancelsSiblings(self):
+		""" The first failure cancels the other children, and the group
+		    fails once they have all ended.
+		"""
+		group = TaskGroup()
+		group.spawn(self._child(10, "slow"))
+		failure = ValueError("bad")
+		group.spawn(self._child(0.001, "failing", failure))
+		with self.assertRaises(TaskGroupError) as caught:
+			await(withTimeout(1, group.wait()))
+		self.assertEqual(caught.exception.errors, [failure])
+		self.assertEqual(self.log, ["failing", "cancelled slow"])
+		self.assertEqual(group.children, {})
+	
+	def testErrorsWhileCancelling(self):
+		""" Errors raised by children as they are cancelled are kept, in
+		    order, after the first.
+		"""
+		group = TaskGroup()
+		late = KeyError("late")
+		group.spawn(self._child(10, "stubborn", onCancel = late))
+		group.spawn(self._child(10, "quiet"))
+		first = ValueError("first")
+		group.spawn(self._child(0.001, "failing", first))
+		with self.assertRaises(TaskGroupError) as caught:
+			await(withTimeout(1, group.wait()))
+		self.assertEqual(caught.exception.errors, [first, late])
+	
+	def testSpawnAfterFailure(self):
+		""" A child spawned into a group that has failed is cancelled
+		    straight away, and one spawned after it has finished is refused.
+		"""
+		group = TaskGroup()
+		failure = ValueError("bad")
+		group.spawn(self._child(0, "failing", failure))
+		await(sleep(0.001))
+		group.spawn(self._child(10, "late"))
+		with self.assertRaises(TaskGroupError) as caught:
+			await(withTimeout(1, group.wait()))
+		self.assertEqual(caught.exception.errors, [failure])
+		self.assertEqual(self.log, ["failing", "cancelled late"])
+		with self.assertRaises(Exception):
+			group.spawn(self._child(0, "refused"))
+	
+	def testWaiterCancelled(self):
+		""" Cancelling the task that waits on the group cancels the
+		    children.
+		"""
+		group = TaskGroup()
+		def parent():
+			group.spawn(self._child(10, "child"))
+			yield from group.wait()
+		task = async(parent())
+		await(sleep(0.001))
+		task.cancel()
+		with self.assertRaises(Cancelled):
+			await(task)
+		await(sleep(0.001))
+		self.assertEqual(self.log, ["cancelled child"])
+		self.assertEqual(group.children, {})
+	
+	def testAsyncWith(self):
+		""" Leaving `async with' waits for the children, and an error raised
+		    in the body cancels them first.
+		"""
+		async def main():
+			async with TaskGroup() as group:
+				group.spawn(self._child(0.002, "a"))
+				group.spawn(self._child(0.001, "b"))
+			return self.log
+		self.assertEqual(await(withTimeout(1, main())), ["b", "a"])
+		
+		del self.log[:]
+		async def failing():
+			async with TaskGroup() as group:
+				group.spawn(self._child(10, "c"))
+				await sleep(0.001)
+				raise(KeyError("body"))
+		with self.assertRaises(KeyError):
+			await(withTimeout(1, failing()))
+		self.assertEqual(self.log, ["cancelled c"])
+	
+	def testFutureChildren(self):
+		""" Plain Futures can be children, and are withdrawn from when the
+		    group is cancelled.
+		"""
+		group = TaskGroup()
+		done = Future()
+		pending = Future()
+		first = group.spawn(done)
+		second = group.spawn(pending)
+		done.setResult(1)
+		await(sleep(0))
+		group.cancel()
+		await(withTimeout(1, group.wait()))
+		self.assertEqual(first.getResult(), 1)
+		with self.assertRaises(Cancelled):
+			second.getResult()
+		self.assertEqual(len(dispatcher.handleQueue), 0)
+
+
+class ErrorGateTest(unittest.TestCase):
+	def testErrorInjected(self):
+		""" An error set on the gate fails what is waiting through it and
+		    anything passed through it later, and an old `clearSchedule' is
+		    still accepted.
+		"""
+		gate = ErrorGate(clearSchedule = 5)
+		waiting = [gate(Future()) for _ in range(10)]
+		passed = Future()
+		passed.setResult("through")
+		self.assertEqual(await(gate(passed)), "through")
+		error = ValueError("injected")
+		gate.setError(error)
+		self.assertEqual(gate.gatedFutures, {})
+		for fut in waiting + [gate(Future())]:
+			with self.assertRaises(ValueError):
+				await(fut)
+	
+	def testGatedCompletion(self):
+		""" A gated Future completes with its own result, and leaves the
+		    gate.
+		"""
+		gate = ErrorGate()
+		inner = Future()
+		gated = gate(inner)
+		self.assertEqual(len(gate.gatedFutures), 1)
+		inner.setResult(3)
+		self.assertEqual(await(gated), 3)
+		self.assertEqual(gate.gatedFutures, {})
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,391 @@
+import select
+import socket
+import unittest
+
+from ..aux import EventFuture, controlYield, sleep
+from ..core import Cancelled, Future, Timeout, async, await, awaitAny
+from ..core import callLater, callSoon, dispatcher, gather, greenletPoolStats
+from ..core import asynchronous, setGreenletPool, waitFor, withTimeout
+from ..queue import Queue
+
+
+class CancelTest(unittest.TestCase):
+	def testCancelAfterOutsideCompletion(self):
+		""" A task whose Future was withdrawn from and then completed, so
+		    that no step is coming, is cancelled rather than left spinning.
+		"""
+		fut = Future()
+		def waiter():
+			yield from fut
+		task = async(waiter())
+		await(sleep(0))
+		fut.withdraw(task)
+		fut.setResult(None)
+		task.cancel()
+		with self.assertRaises(Cancelled):
+			await(task)
+		self.assertEqual(len(dispatcher.handleQueue), 0)
+	
+	def testCancelWithStepQueued(self):
+		""" A task cancelled with a step already queued takes the step and
+		    is cancelled at its next wait.
+		"""
+		fut = Future()
+		def waiter():
+			yield from fut
+			yield from sleep(10)
+		task = async(waiter())
+		await(sleep(0))
+		fut.setResult(None)
+		task.cancel()
+		with self.assertRaises(Cancelled):
+			await(task)
+	
+	def testCancelWhileYieldingControl(self):
+		""" A task cancelled while yielding control is not resumed once it
+		    has completed.
+		"""
+		def yielder():
+			yield from controlYield
+		task = async(yielder())
+		task.cancel()
+		await(sleep(0.01))
+		with self.assertRaises(Cancelled):
+			await(task)
+
+
+class TimeoutTest(unittest.TestCase):
+	def testExpiryInSameBatch(self):
+		""" A timeout that expires with its Future's step already queued
+		    completes only once, and the loop stays usable.
+		"""
+		fut = Future()
+		timeout = withTimeout(10, fut)
+		def both():
+			fut.setResult(1)
+			timeout.expire()
+		callSoon(both)
+		with self.assertRaises(Timeout):
+			await(timeout)
+		timeout.timer.cancel()
+		self.assertEqual(await(withTimeout(1, sleep(0))), None)
+	
+	def testCompletionInSameBatch(self):
+		""" A timeout whose Future completes just before the timer's handle
+		    runs keeps the result.
+		"""
+		fut = Future()
+		timeout = withTimeout(10, fut)
+		def both():
+			fut.setResultFast(1)
+			timeout.expire()
+		callSoon(both)
+		self.assertEqual(await(timeout), 1)
+		self.assertEqual(await(withTimeout(1, sleep(0))), None)
+
+
+class WithdrawTest(unittest.TestCase):
+	def testTaskForeignWithdraw(self):
+		""" A task withdrawn by a callback that is not its waiter is not
+		    cancelled.
+		"""
+		def child():
+			yield from sleep(0.01)
+			return 1
+		task = async(child())
+		def parent():
+			return (yield from task)
+		outer = async(parent())
+		await(sleep(0))
+		task.withdraw(_Callback())
+		self.assertEqual(await(outer), 1)
+	
+	def testSleepWithdraw(self):
+		""" A sleep keeps its timer when a foreign callback withdraws, and
+		    releases it on the first withdraw of its own.
+		"""
+		fut = sleep(10)
+		callback = _Callback()
+		fut.setCallback(callback)
+		fut.withdraw(_Callback())
+		self.assertTrue(fut.timer.pending)
+		fut.withdraw(callback)
+		fut.withdraw(callback)
+		self.assertFalse(fut.timer.pending)
+	
+	def testEventWithdrawTwice(self):
+		""" An EventFuture withdrawn twice, or by a foreign callback, only
+		    unregisters its event once.
+		"""
+		left, right = socket.socketpair()
+		try:
+			fut = EventFuture(left.fileno(), select.EPOLLIN,
+			                  lambda mask: left.recv(1))
+			callback = _Callback()
+			fut.setCallback(callback)
+			fut.withdraw(_Callback())
+			self.assertIn(left.fileno(), dispatcher.handles)
+			fut.withdraw(callback)
+			fut.withdraw(callback)
+			self.assertNotIn(left.fileno(), dispatcher.handles)
+		finally:
+			left.close()
+			right.close()
+
+
+class _Callback:
+	def __init__(self):
+		self.results = []
+	
+	def send(self, result):
+		self.results.append(result)
+
+
+class OwnedFutureTest(unittest.TestCase):
+	def testDoubleWithdraw(self):
+		""" A waiter that withdraws twice is only removed once.
+		"""
+		queue = Queue()
+		got = queue.get()
+		callback = _Callback()
+		got.setCallback(callback)
+		got.withdraw(callback)
+		got.withdraw(callback)
+		self.assertEqual(len(queue.getwaiters), 0)
+	
+	def testForeignWithdraw(self):
+		""" Withdrawing a callback that is not the waiter leaves the waiter
+		    in its owner's queue.
+		"""
+		queue = Queue()
+		got = queue.get()
+		callback = _Callback()
+		got.setCallback(callback)
+		got.withdraw(_Callback())
+		self.assertEqual(len(queue.getwaiters), 1)
+		queue.put(1)
+		await(sleep(0))
+		self.assertEqual(callback.results, [1])
+
+
+
+def _after(seconds, value, finished, error = None):
+	# Records `value' in `finished' once it has slept, whether or not it
+	# then fails, since a gathered Future can only be waited on once.
+	yield from sleep(seconds)
+	finished.append(value)
+	if error is not None:
+		raise(error)
+	return value
+
+
+class GatherTest(unittest.TestCase):
+	def setUp(self):
+		self.finished = []
+	
+	def _after(self, seconds, value, error = None):
+		return _after(seconds, value, self.finished, error)
+	
+	def testWaiterCancelled(self):
+		""" A task cancelled while it waits on a gather is cancelled, and
+		    the things gathered complete in their own time without effect.
+		"""
+		def waiter():
+			return (yield from gather(self._after(0.01, 1),
+			                          self._after(0.02, 2)))
+		task = async(waiter())
+		await(sleep(0))
+		task.cancel()
+		with self.assertRaises(Cancelled):
+			await(task)
+		await(sleep(0.03))
+		self.assertEqual(self.finished, [1, 2])
+		self.assertEqual(len(dispatcher.handleQueue), 0)
+	
+	def testThingCancelled(self):
+		""" A gathered task that is cancelled fails the gather with
+		    Cancelled, while the others carry on.
+		"""
+		doomed = async(self._after(10, 1))
+		gathered = gather(doomed, self._after(0.01, 2))
+		doomed.cancel()
+		with self.assertRaises(Cancelled):
+			await(gathered)
+		await(sleep(0.02))
+		self.assertEqual(self.finished, [2])
+	
+	def testTimedOut(self):
+		""" A gather or waitFor that times out leaves nothing behind when
+		    its things complete later.
+		"""
+		for make in (gather, lambda *things: waitFor(things, 2)):
+			del self.finished[:]
+			things = [self._after(0.01, index) for index in range(3)]
+			with self.assertRaises(Timeout):
+				await(withTimeout(0.001, make(*things)))
+			await(sleep(0.02))
+			self.assertEqual(sorted(self.finished), [0, 1, 2])
+			self.assertEqual(len(dispatcher.handleQueue), 0)
+	
+	def testRaceLosers(self):
+		""" awaitAny completes with the first thing, and the losers, even
+		    failing ones, complete later without effect.
+		"""
+		race = awaitAny(self._after(0.01, "slow"), self._after(0, "fast"),
+		                self._after(0.01, "late", ValueError()))
+		self.assertEqual(await(race), (1, "fast"))
+		await(sleep(0.02))
+		self.assertEqual(sorted(self.finished), ["fast", "late", "slow"])
+	
+	def testWaitForFailures(self):
+		""" waitFor fails with an error that comes before `count' things
+		    have completed, and ignores one that comes after.
+		"""
+		early = waitFor([self._after(0.01, 1),
+		                 self._after(0, 2, KeyError()),
+		                 self._after(0.01, 3)], 2)
+		with self.assertRaises(KeyError):
+			await(early)
+		late = waitFor([self._after(0, 1),
+		                self._after(0.01, 2, KeyError()),
+		                self._after(0.001, 3)], 2)
+		self.assertEqual(await(late), [(0, 1), (2, 3)])
+		await(sleep(0.02))
+		self.assertEqual(self.finished.count(2), 2)
+
+
+class GreenletPoolTest(unittest.TestCase):
+	def tearDown(self):
+		setGreenletPool(maxStacked = 10000)
+	
+	def _delta(self, before):
+		after = greenletPoolStats()
+		return {name: after[name] - before[name] for name in after}
+	
+	def testParkedReused(self):
+		""" The loop greenlets of finished nested awaits are parked and then
+		    reused, rather than created afresh.
+		"""
+		def nested():
+			await(sleep(0.001))
+		before = greenletPoolStats()
+		for _ in range(10):
+			callLater(nested)
+			await(sleep(0.005))
+		delta = self._delta(before)
+		self.assertEqual(delta["created"] + delta["reused"], 20)
+		self.assertLessEqual(delta["created"], 2)
+		self.assertGreater(greenletPoolStats()["parked"], 0)
+		self.assertEqual(greenletPoolStats()["stacked"], 0)
+	
+	def testInterleaved(self):
+		""" Nested awaits from several handles, completed in the reverse of
+		    the order in which they were made, each resume with their own
+		    result, including a second await made by a resumed handle.
+		"""
+		futures = [Future() for _ in range(5)]
+		seconds = [Future() for _ in range(5)]
+		results = []
+		def nested(index):
+			first = await(futures[index])
+			results.append((index, first, await(seconds[index])))
+		for index in range(5):
+			callLater(nested, index)
+		await(sleep(0.001))
+		self.assertEqual(greenletPoolStats()["stacked"], 5)
+		for index in reversed(range(5)):
+			futures[index].setResult(index * 10)
+		await(sleep(0.001))
+		self.assertEqual(greenletPoolStats()["stacked"], 5)
+		for index in range(5):
+			seconds[index].setResult(index * 100)
+		await(sleep(0.001))
+		self.assertEqual(sorted(results),
+		                 [(index, index * 10, index * 100)
+		                  for index in range(5)])
+		self.assertEqual(greenletPoolStats()["stacked"], 0)
+		self.assertGreaterEqual(greenletPoolStats()["maxStacked"], 5)
+	
+	def testStackedLimit(self):
+		""" An await that would nest beyond maxStacked raises at once, and
+		    those already stacked still resume.
+		"""
+		setGreenletPool(maxStacked = 2)
+		futures = [Future() for _ in range(3)]
+		outcomes = []
+		def nested(index):
+			try:
+				outcomes.append(await(futures[index]))
+			except Exception as error:
+				outcomes.append(str(error))
+		for index in range(3):
+			callLater(nested, index)
+		await(sleep(0.001))
+		self.assertEqual(outcomes, ["Nested await limit of 2 reached"])
+		for index in range(2):
+			futures[index].setResult(index)
+		await(sleep(0.001))
+		self.assertEqual(sorted(outcomes[1:]), [0, 1])
+		self.assertEqual(greenletPoolStats()["stacked"], 0)
+
+
+
+class NativeCoroutineTest(unittest.TestCase):
+	def testAwaited(self):
+		""" An `async def' coroutine is driven by await and async, and awaits
+		    Futures, generator-based coroutines and other native ones, which
+		    can in turn be awaited with `yield from'.
+		"""
+		@asynchronous
+		def doubled(value):
+			yield from sleep(0.001)
+			return value * 2
+		async def inner(value):
+			await sleep(0.001)
+			return await doubled(value)
+		@asynchronous
+		def wrapped(value):
+			return (yield from inner(value))
+		async def outer():
+			fut = Future()
+			callLater(fut.setResult, 1)
+			first = await fut
+			return first + await inner(2) + await wrapped(3)
+		self.assertEqual(await(outer()), 11)
+		self.assertEqual(await(async(outer())), 11)
+	
+	def testErrors(self):
+		""" Errors of awaited Futures are raised in the coroutine, and its
+		    own errors fail its task.
+		"""
+		async def failing():
+			fut = Future()
+			callLater(fut.setError, ValueError("inner"))
+			try:
+				await fut
+			except ValueError as error:
+				raise(KeyError(str(error)))
+		with self.assertRaises(KeyError):
+			await(async(failing()))
+	
+	def testCancel(self):
+		""" A task of a native coroutine is cancelled where it waits, and
+		    can catch Cancelled.
+		"""
+		log = []
+		async def waiting():
+			try:
+				await sleep(10)
+			except Cancelled:
+				log.append("cancelled")
+				raise
+		task = async(waiting())
+		await(sleep(0.001))
+		task.cancel()
+		with self.assertRaises(Cancelled):
+			await(withTimeout(1, task))
+		self.assertEqual(log, ["cancelled"])
+
+
+if __name__ == "__main__":
+	unittest.main()
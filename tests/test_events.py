@@ -0,0 +1,386 @@
+import os
+import select
+import socket
+import threading
+import unittest
+from time import time
+
+from ..aux import EventFuture, sleep
+from ..core import Future, Timeout, await, callAt, callLater, callSoon
+from ..core import callSoonThreadsafe, dispatcher, greenletPoolStats
+from ..core import forkDispatcher, withTimeout
+from ..events import Waker
+from ..streams import InterruptedTransfer, ReadWrapper
+from ..usocket import USocket, _SocketWrapper
+
+
+def _fromThread(function, *args):
+	thread = threading.Thread(target = function, args = args)
+	thread.start()
+	thread.join()
+
+
+class WakeupTest(unittest.TestCase):
+	def tearDown(self):
+		dispatcher.waker.__dict__.pop("drain", None)
+	
+	def testScheduleDuringCollection(self):
+		""" A handle scheduled by another thread while the loop is collecting
+		    the inbound queue must not leave later handles unwoken.
+		"""
+		waker = dispatcher.waker
+		raced = Future()
+		
+		def drain():
+			# Run a producer just as the loop drains the Waker, and only once.
+			del waker.drain
+			_fromThread(callSoonThreadsafe, raced.setResult, None)
+			Waker.drain(waker)
+		
+		first = Future()
+		waker.drain = drain
+		_fromThread(callSoonThreadsafe, first.setResult, None)
+		await(withTimeout(1, first))
+		await(withTimeout(1, raced))
+		
+		later = Future()
+		_fromThread(callSoonThreadsafe, later.setResult, None)
+		try:
+			await(withTimeout(1, later))
+		except Timeout:
+			self.fail("Wake-up lost with %d handles inbound"
+			          % len(dispatcher.inbound))
+	
+	def testManyProducers(self):
+		""" Every handle from many threads is run without another event to
+		    wake the loop.
+		"""
+		count = 20000
+		done = Future()
+		remaining = [count]
+		
+		def handle():
+			remaining[0] -= 1
+			if remaining[0] == 0:
+				done.setResult(None)
+		
+		def produce():
+			for _ in range(count // 8):
+				callSoonThreadsafe(handle)
+		
+		threads = [threading.Thread(target = produce) for _ in range(8)]
+		for thread in threads:
+			thread.start()
+		try:
+			await(withTimeout(10, done))
+		finally:
+			for thread in threads:
+				thread.join()
+
+
+class LoopTest(unittest.TestCase):
+	def _tree(self, order):
+		""" Schedule a tree of handles with both priorities, which appends
+		    150 names to `order' as it runs.
+		"""
+		def handle(name, depth):
+			order.append(name)
+			if depth < 3:
+				callLater(handle, name + "m", depth + 1)
+				callSoon(handle, name + "h", depth + 1)
+		for index in range(10):
+			callLater(handle, str(index), 0)
+	
+	def testOrderMatchesRunNextHandle(self):
+		""" Handles scheduled within a batch run in the order that they would
+		    one handle at a time.
+		"""
+		expected = []
+		self._tree(expected)
+		dispatcher.flush()
+		self.assertEqual(len(expected), 150)
+		order = []
+		self._tree(order)
+		await(sleep(0.01))
+		self.assertEqual(order, expected)
+	
+	def testNestedAwaitInBatch(self):
+		""" A handle that awaits in the middle of a batch resumes once its
+		    Future is done, and the rest of the batch runs in the meantime.
+		"""
+		order = []
+		fut = Future()
+		done = Future()
+		def waiter():
+			order.append("waiting")
+			order.append(await(fut))
+		callLater(order.append, "before")
+		callLater(waiter)
+		callLater(fut.setResult, "resumed")
+		callLater(done.setResult, None)
+		await(withTimeout(1, done))
+		self.assertEqual(order, ["before", "waiting", "resumed"])
+		self.assertEqual(greenletPoolStats()["stacked"], 0)
+
+
+class ForkTest(unittest.TestCase):
+	def testListenerAcceptsInChild(self):
+		""" An exclusive listener registered before a fork accepts in the
+		    child, where the parent's pending timers do not fire.
+		"""
+		listener = USocket.listener(("127.0.0.1", 0), 8, exclusive = True)
+		accepting = listener.accept()
+		fired = []
+		timer = callAt(time() + 0.01, fired.append, True)
+		readFd, writeFd = os.pipe()
+		pid = os.fork()
+		if pid == 0:
+			try:
+				os.close(readFd)
+				forkDispatcher()
+				accepted = await(withTimeout(2, accepting))
+				data = await(withTimeout(2, accepted.recv(4)))
+				await(sleep(0.05))
+				os.write(writeFd, b"%s %d" % (data, len(fired)))
+				accepted.forceClose()
+			finally:
+				os._exit(0)
+		os.close(writeFd)
+		client = socket.create_connection(listener.socket.getsockname())
+		try:
+			client.sendall(b"ping")
+			# Read without running the loop, so that only the child accepts.
+			report = os.read(readFd, 64)
+			os.waitpid(pid, 0)
+		finally:
+			os.close(readFd)
+			client.close()
+			timer.cancel()
+			listener.forceClose()
+		self.assertEqual(report, b"ping 0")
+		with self.assertRaises(InterruptedTransfer):
+			await(accepting)
+
+
+class BudgetTest(unittest.TestCase):
+	def tearDown(self):
+		dispatcher.setBudget(None)
+	
+	def _order(self, budget):
+		""" Returns the order in which a tree of handles, scheduled with
+		    both priorities, runs under `budget'.
+		"""
+		order = []
+		def handle(name, depth):
+			order.append(name)
+			if depth < 3:
+				callLater(handle, name + "m", depth + 1)
+				callSoon(handle, name + "h", depth + 1)
+		dispatcher.setBudget(budget)
+		for index in range(10):
+			callLater(handle, str(index), 0)
+		await(sleep(0.01))
+		return order
+	
+	def testEveryHandleRun(self):
+		""" A budget that cuts every few handles runs each of them once, and
+		    after the handle that scheduled it.
+		"""
+		expected = self._order(None)
+		self.assertEqual(len(expected), 150)
+		for budget in (1, 2, 7):
+			order = self._order(budget)
+			self.assertEqual(sorted(order), sorted(expected))
+			for index, name in enumerate(order):
+				self.assertLess(order.index(name[:-1] or name), index + 1)
+	
+	def testIterationBounded(self):
+		""" Handles scheduled during an iteration run after those that were
+		    ready when it started, whatever their priority, and starved
+		    timers run before them.
+		"""
+		order = []
+		def first():
+			order.append("first")
+			callSoon(order.append, "soon")
+		dispatcher.setBudget(100)
+		callLater(first)
+		callLater(order.append, "second")
+		await(sleep(0.01))
+		self.assertEqual(order, ["first", "second", "soon"])
+		
+		del order[:]
+		dispatcher.setBudget(1)
+		callLater(first)
+		callAt(time() - 1, order.append, "timer")
+		await(sleep(0.01))
+		self.assertEqual(order, ["first", "timer", "soon"])
+	
+	def testTimersAdmitted(self):
+		""" Expired timers run while handles that keep rescheduling
+		    themselves with medium priority are ready.
+		"""
+		dispatcher.setBudget(16)
+		running = [True]
+		def spin():
+			if running[0]:
+				callLater(spin)
+		callLater(spin)
+		try:
+			await(withTimeout(1, sleep(0.01)))
+		finally:
+			running[0] = False
+		self.assertGreater(dispatcher.starvation["admittedTimers"], 0)
+	
+	def testHighPrioritySpinner(self):
+		""" Expired timers run while a handle keeps rescheduling itself with
+		    high priority.
+		"""
+		dispatcher.setBudget(64)
+		admitted = dispatcher.starvation["admittedTimers"]
+		started = time()
+		running = [True]
+		# The spinner gives up after a second, so a starved sleep fails
+		# the test rather than hanging it.
+		def spin():
+			if running[0] and time() < started + 1:
+				callSoon(spin)
+		callSoon(spin)
+		try:
+			await(sleep(0.01))
+		finally:
+			running[0] = False
+		self.assertLess(time() - started, 0.1)
+		self.assertGreater(dispatcher.starvation["admittedTimers"], admitted)
+	
+	def testSocketReads(self):
+		""" While a handle keeps rescheduling itself, the handle of a file
+		    event still waiting to run is not queued again by the polls that
+		    admit starved events.
+		"""
+		left, right = socket.socketpair()
+		reader = ReadWrapper(_SocketWrapper(left))
+		dispatcher.setBudget(2)
+		running = [True]
+		def spin():
+			if running[0]:
+				callSoon(spin)
+		# Enough spinners that a batch outlasts the budget several times.
+		for _ in range(8):
+			callSoon(spin)
+		try:
+			right.send(b"abc")
+			first = await(withTimeout(1, reader.read(3)))
+			right.send(b"def")
+			second = await(withTimeout(1, reader.read(3)))
+			left.send(b"x")
+			mask = await(withTimeout(1, EventFuture(right.fileno(),
+			             select.EPOLLIN, lambda mask: mask)))
+			# Any duplicates run, and fail, while the spinners still do.
+			await(sleep(0.01))
+		finally:
+			running[0] = False
+			reader.forceRelease()
+			left.close()
+			right.close()
+		self.assertEqual((first, second), (b"abc", b"def"))
+		self.assertEqual(mask, select.EPOLLIN)
+
+
+class ChangeListTest(unittest.TestCase):
+	def setUp(self):
+		dispatcher.setCoalesceChanges(True)
+		self.left, self.right = socket.socketpair()
+	
+	def tearDown(self):
+		dispatcher.setCoalesceChanges(False)
+		self.left.close()
+		self.right.close()
+	
+	def testUnregisteredBeforePoll(self):
+		""" An fd registered and unregistered between polls never reaches the
+		    kernel, and the changes to other fds in the batch still are made.
+		"""
+		fd = self.left.fileno()
+		dispatcher.registerFileEvent(fd, select.EPOLLIN, None)
+		dispatcher.unregisterFileEvent(fd, select.EPOLLIN)
+		fut = EventFuture(self.right.fileno(), select.EPOLLIN,
+		                  lambda mask: mask)
+		self.left.send(b"x")
+		self.assertEqual(await(withTimeout(1, fut)), select.EPOLLIN)
+		self.assertNotIn(fd, dispatcher.registered)
+	
+	def testReleasedBeforePoll(self):
+		""" A ReadWrapper released before the loop next polls leaves the
+		    loop usable.
+		"""
+		reader = ReadWrapper(_SocketWrapper(self.left))
+		reader.forceRelease()
+		await(sleep(0.01))
+		self.assertNotIn(self.left.fileno(), dispatcher.registered)
+	
+	def testReregisteredBeforePoll(self):
+		""" An fd unregistered and registered again between polls, whether
+		    or not it was registered with the kernel before, gets its event.
+		"""
+		fd = self.right.fileno()
+		for polled in (False, True):
+			first = EventFuture(fd, select.EPOLLIN, lambda mask: mask)
+			if polled:
+				await(sleep(0.01))
+				self.assertIn(fd, dispatcher.registered)
+			first.withdraw(None)
+			second = EventFuture(fd, select.EPOLLIN, lambda mask: mask)
+			self.left.send(b"x")
+			self.assertEqual(await(withTimeout(1, second)), select.EPOLLIN)
+			self.right.recv(1)
+		await(sleep(0.01))
+		self.assertNotIn(fd, dispatcher.registered)
+
+
+class StatsTest(unittest.TestCase):
+	def tearDown(self):
+		dispatcher.setStats(False)
+		dispatcher.setBudget(None)
+	
+	def _handles(self, budget):
+		""" Returns the handle counts for a run in which a medium priority
+		    handle spins until a timer has expired, which only a budget lets
+		    happen, and the number of times that it was scheduled.
+		"""
+		dispatcher.setBudget(budget)
+		dispatcher.setStats(True)
+		spins = [0]
+		expired = [False]
+		def spin():
+			if not expired[0]:
+				spins[0] += 1
+				callLater(spin)
+		def main():
+			yield from sleep(0.005)
+			expired[0] = True
+		spins[0] += 1
+		callLater(spin)
+		for _ in range(3):
+			callSoon(lambda: None)
+		await(main())
+		handles = dispatcher.getStats()["handles"]
+		dispatcher.setStats(False)
+		return handles, spins[0]
+	
+	def testHandleClasses(self):
+		""" Each handle is counted once, by the class through which it was
+		    queued, including the timer that the budget admits.
+		"""
+		for budget in (2, 16):
+			handles, spins = self._handles(budget)
+			self.assertEqual(handles["medium"], spins)
+			self.assertEqual(handles["timer"], 1)
+			self.assertEqual(handles["io"], 0)
+			self.assertEqual(handles["threadsafe"], 0)
+			self.assertGreaterEqual(handles["high"], 3)
+		self.assertGreater(dispatcher.starvation["admittedTimers"], 0)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,156 @@
+import select
+import socket
+import threading
+import time
+import unittest
+
+from ..aux import EventFuture, sleep
+from ..core import Future, async, await, callSoonThreadsafe, dispatcher
+from ..core import withTimeout
+from ..pollers import availablePollers, makePoller
+from ..usocket import USocket
+
+
+class PollerTest(unittest.TestCase):
+	""" The Poller contract, for each backend that is available here.
+	"""
+	def setUp(self):
+		self.a, self.b = socket.socketpair()
+	
+	def tearDown(self):
+		self.a.close()
+		self.b.close()
+	
+	def testReadiness(self):
+		""" Readiness is level-triggered and follows the registered mask.
+		"""
+		fd = self.a.fileno()
+		for name in availablePollers():
+			with self.subTest(poller = name):
+				poller = makePoller(name)
+				try:
+					poller.register(fd, select.EPOLLIN)
+					self.assertEqual(poller.poll(0), [])
+					self.b.send(b"x")
+					self.assertEqual(poller.poll(1), [(fd, select.EPOLLIN)])
+					self.assertEqual(poller.poll(0), [(fd, select.EPOLLIN)])
+					poller.modify(fd, select.EPOLLOUT)
+					self.assertEqual(poller.poll(0), [(fd, select.EPOLLOUT)])
+					poller.unregister(fd)
+					self.assertEqual(poller.poll(0), [])
+					self.a.recv(1)
+				finally:
+					poller.close()
+	
+	def testRegistrationErrors(self):
+		fd = self.a.fileno()
+		for name in availablePollers():
+			with self.subTest(poller = name):
+				poller = makePoller(name)
+				try:
+					poller.register(fd, select.EPOLLIN)
+					with self.assertRaises(FileExistsError):
+						poller.register(fd, select.EPOLLIN)
+					poller.unregister(fd)
+					with self.assertRaises(FileNotFoundError):
+						poller.modify(fd, select.EPOLLIN)
+					with self.assertRaises(FileNotFoundError):
+						poller.unregister(fd)
+				finally:
+					poller.close()
+	
+	def testTimeout(self):
+		""" A poll with nothing ready waits out its timeout.
+		"""
+		self.a.setblocking(False)
+		for name in availablePollers():
+			with self.subTest(poller = name):
+				poller = makePoller(name)
+				try:
+					poller.register(self.a.fileno(), select.EPOLLIN)
+					before = time.monotonic()
+					self.assertEqual(poller.poll(0.05), [])
+					self.assertGreaterEqual(time.monotonic() - before, 0.04)
+				finally:
+					poller.close()
+
+
+class DispatcherPollerTest(unittest.TestCase):
+	""" The dispatcher running on each backend that is available here.
+	"""
+	def setUp(self):
+		self.original = dispatcher.pollerClass
+	
+	def tearDown(self):
+		dispatcher.setPoller(self.original)
+	
+	def testEcho(self):
+		""" Messages echo over a loopback connection.
+		"""
+		messages = [b"message %d" % index for index in range(50)]
+		for name in availablePollers():
+			with self.subTest(poller = name):
+				dispatcher.setPoller(name)
+				listener = USocket.listener(("127.0.0.1", 0))
+				address = listener.socket.getsockname()
+				
+				def server():
+					connection = yield from listener.accept()
+					for message in messages:
+						data = yield from connection.recv(len(message))
+						yield from connection.send(data)
+					yield from connection.close()
+				
+				def client():
+					connection = USocket()
+					yield from connection.connect(address)
+					echoed = []
+					for message in messages:
+						yield from connection.send(message)
+						data = yield from connection.recv(len(message))
+						echoed.append(data)
+					yield from connection.close()
+					return echoed
+				
+				serverTask = async(server())
+				self.assertEqual(await(withTimeout(5, client())), messages)
+				await(withTimeout(5, serverTask))
+				await(listener.close())
+	
+	def testEventFuture(self):
+		""" A file event wakes a loop that is waiting on it.
+		"""
+		for name in availablePollers():
+			with self.subTest(poller = name):
+				dispatcher.setPoller(name)
+				a, b = socket.socketpair()
+				try:
+					timer = threading.Timer(0.01, b.send, (b"x",))
+					timer.start()
+					readable = EventFuture(a.fileno(), select.EPOLLIN,
+					                       lambda mask: a.recv(1))
+					self.assertEqual(await(withTimeout(1, readable)), b"x")
+					timer.join()
+				finally:
+					a.close()
+					b.close()
+	
+	def testWakeFromThread(self):
+		""" A handle scheduled from another thread wakes a loop that is
+		    blocked in its poll.
+		"""
+		for name in availablePollers():
+			with self.subTest(poller = name):
+				dispatcher.setPoller(name)
+				woken = Future()
+				timer = threading.Timer(0.01, callSoonThreadsafe,
+				                        (woken.setResult, True))
+				timer.start()
+				self.assertTrue(await(withTimeout(1, woken)))
+				timer.join()
+				await(sleep(0.001))
+				self.assertEqual(dispatcher.handles, {})
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,85 @@
+import glob
+import os
+import unittest
+
+from ..core import await, gather, withTimeout
+from ..processes import ProcessExecutor
+from ..timers import inf
+
+
+def _reverse(data):
+	return data[::-1]
+
+
+def _exit():
+	os._exit(1)
+
+
+class ProcessExecutorTest(unittest.TestCase):
+	def setUp(self):
+		self.executor = ProcessExecutor(2, inf)
+	
+	def tearDown(self):
+		self.executor.shutdown()
+	
+	def testLargeResults(self):
+		""" Results much larger than a pipe's buffer are read in pieces
+		    without being mixed up between workers.
+		"""
+		payloads = [bytes([index]) * (3 << 20) for index in range(6)]
+		results = await(withTimeout(30, gather(*[
+		                self.executor.run(_reverse, payload)
+		                for payload in payloads])))
+		self.assertEqual(results, payloads)
+	
+	def testWorkerDiesDuringCall(self):
+		""" A worker that dies fails its call, and is replaced for the calls
+		    that are queued behind it.
+		"""
+		executor = ProcessExecutor(1, inf)
+		try:
+			dying = executor.run(_exit)
+			queued = executor.run(_reverse, b"abc")
+			with self.assertRaises(EOFError):
+				await(withTimeout(10, dying))
+			self.assertEqual(await(withTimeout(10, queued)), b"cba")
+		finally:
+			executor.shutdown()
+	
+	def testIdleWorkerDied(self):
+		""" A call given to an idle worker that has died fails, and the
+		    worker is replaced.
+		"""
+		await(withTimeout(10, self.executor.run(_reverse, b"")))
+		worker = self.executor.idle[-1]
+		worker.process.terminate()
+		worker.process.join()
+		with self.assertRaises(OSError):
+			await(withTimeout(10, self.executor.run(_reverse, b"abc")))
+		self.assertNotIn(worker, self.executor.workers)
+		self.assertNotIn(worker, self.executor.idle)
+		self.assertEqual(await(withTimeout(10,
+		                 self.executor.run(_reverse, b"abc"))), b"cba")
+
+	def testSharedMemory(self):
+		""" Arguments and results over the threshold pass through segments,
+		    which are all unlinked once the calls complete.
+		"""
+		executor = ProcessExecutor(2, 1024)
+		try:
+			payloads = [bytes([index]) * size for index, size in
+			            enumerate((0, 1023, 1024, 3 << 20))]
+			results = await(withTimeout(30, gather(*[
+			                executor.run(_reverse, payload)
+			                for payload in payloads])))
+			self.assertEqual(results, payloads)
+			self.assertEqual(await(withTimeout(10,
+			                 executor.run(_reverse, bytearray(b"x" * 2048)))),
+			                 bytearray(b"x" * 2048))
+		finally:
+			executor.shutdown()
+		self.assertEqual(glob.glob("/dev/shm/unstuck-*"), [])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,74 @@
+import io
+import unittest
+from time import perf_counter
+
+from ..aux import sleep
+from ..core import async, await, callLater
+from ..profiler import SamplingProfiler, SlowCallbackWatchdog, describeHandle
+
+
+def _busy(seconds):
+	until = perf_counter() + seconds
+	while perf_counter() < until:
+		pass
+
+
+def _slowTask():
+	yield from sleep(0)
+	_busy(0.05)
+	yield from sleep(0.001)
+
+
+class SlowCallbackWatchdogTest(unittest.TestCase):
+	def testSlowTaskStep(self):
+		""" A slow step of a task is reported, with the frame at which the
+		    task was suspended after it.
+		"""
+		reports = []
+		def report(handle, elapsed):
+			reports.append((describeHandle(handle), elapsed))
+		watchdog = SlowCallbackWatchdog(0.03, report)
+		watchdog.start()
+		try:
+			await(async(_slowTask()))
+		finally:
+			watchdog.stop()
+		self.assertEqual(len(reports), 1)
+		description, elapsed = reports[0]
+		self.assertGreaterEqual(elapsed, 0.05)
+		line = _slowTask.__code__.co_firstlineno + 3
+		self.assertIn("suspended at _slowTask (%s:%d)"
+		              % (__file__, line), description)
+
+
+class SamplingProfilerTest(unittest.TestCase):
+	def testCollapsedStacks(self):
+		""" Samples are written as collapsed stacks rooted at `running',
+		    `greenlet' and `task', each with its count.
+		"""
+		def nested():
+			await(sleep(0.1))
+		def waiting():
+			yield from sleep(0.1)
+		profiler = SamplingProfiler(0.001, 0.01)
+		profiler.start()
+		try:
+			task = async(waiting())
+			callLater(nested)
+			callLater(_busy, 0.05)
+			await(sleep(0.15))
+			await(task)
+		finally:
+			profiler.stop()
+		output = io.StringIO()
+		profiler.write(output)
+		roots = set()
+		for line in output.getvalue().splitlines():
+			stack, count = line.rsplit(" ", 1)
+			self.assertGreater(int(count), 0)
+			roots.add(stack.split(";")[0])
+		self.assertEqual(roots, {"running", "greenlet", "task"})
+
+
+if __name__ == "__main__":
+	unittest.main()
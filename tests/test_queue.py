@@ -0,0 +1,356 @@
+import threading
+import unittest
+
+from ..core import Timeout, async, await, dispatcher, withTimeout
+from ..events import Waker
+from ..queue import LifoQueue, PriorityQueue, Queue, ThreadSafeQueue, XQueue
+
+
+def _fromThread(function, *args):
+	thread = threading.Thread(target = function, args = args)
+	thread.start()
+	thread.join()
+
+
+def _consume(queue, count):
+	values = []
+	while len(values) < count:
+		values.extend((yield from queue.getMany(1024)))
+	return values
+
+
+class ThreadSafeQueueTest(unittest.TestCase):
+	def tearDown(self):
+		dispatcher.waker.__dict__.pop("drain", None)
+	
+	def testPutDuringCollection(self):
+		""" A flush scheduled by another thread while the loop is collecting
+		    the inbound queue must not strand the values put after it.
+		"""
+		waker = dispatcher.waker
+		first = ThreadSafeQueue()
+		racing = ThreadSafeQueue()
+		
+		def drain():
+			# Put from a thread just as the loop drains the Waker, and only
+			# once.
+			del waker.drain
+			_fromThread(racing.put, 2)
+			Waker.drain(waker)
+		
+		waker.drain = drain
+		_fromThread(first.put, 1)
+		self.assertEqual(await(withTimeout(1, first.getMany(10))), [1])
+		self.assertEqual(await(withTimeout(1, racing.getMany(10))), [2])
+		_fromThread(first.put, 3)
+		try:
+			self.assertEqual(await(withTimeout(1, first.getMany(10))), [3])
+		except Timeout:
+			self.fail("Value stranded, %d in the inbox" % len(first.inbox))
+	
+	def testManyProducers(self):
+		""" Every value put from many threads, one at a time and in bulk,
+		    reaches the loop, in order for each thread, without another
+		    event to wake the loop.
+		"""
+		queue = ThreadSafeQueue()
+		producers = 8
+		count = 20000
+		
+		def produce(producer):
+			for index in range(0, count, 100):
+				if index % 200 == 0:
+					for offset in range(100):
+						queue.put((producer, index + offset))
+				else:
+					queue.putMany((producer, index + offset)
+					              for offset in range(100))
+		
+		threads = [threading.Thread(target = produce, args = (producer,))
+		           for producer in range(producers)]
+		for thread in threads:
+			thread.start()
+		try:
+			values = await(withTimeout(10, _consume(queue,
+			                                        producers * count)))
+		except Timeout:
+			self.fail("Values stranded, %d in the inbox" % len(queue.inbox))
+		finally:
+			for thread in threads:
+				thread.join()
+		for producer in range(producers):
+			self.assertEqual([index for owner, index in values
+			                  if owner == producer], list(range(count)))
+	
+	def testQueueContract(self):
+		""" A ThreadSafeQueue can be put to like any other Queue.
+		"""
+		def relay(queue):
+			yield from queue.put(1)
+			yield from queue.putMany([2, 3])
+			return (yield from queue.getMany(3))
+		for queue in (ThreadSafeQueue(), Queue()):
+			self.assertEqual(await(withTimeout(5, relay(queue))), [1, 2, 3])
+
+
+
+class BulkTest(unittest.TestCase):
+	def testPutManyToWaiters(self):
+		""" putMany hands waiting `get's an item each and waiting `getMany's
+		    up to as many as they asked for, in the order that they waited,
+		    and stores the rest.
+		"""
+		queue = Queue()
+		one = queue.get()
+		many = queue.getMany(3)
+		other = queue.get()
+		self.assertTrue(queue.putMany(range(7)).isDone)
+		self.assertEqual(await(one), 0)
+		self.assertEqual(await(many), [1, 2, 3])
+		self.assertEqual(await(other), 4)
+		self.assertEqual(queue.drain(), [5, 6])
+		self.assertEqual(queue.drain(), [])
+	
+	def testPutManyBlocks(self):
+		""" A putMany that overfills a bounded Queue waits behind one Future,
+		    which is done once its last item has been let in.
+		"""
+		queue = Queue(2)
+		putting = queue.putMany(range(5))
+		self.assertFalse(putting.isDone)
+		self.assertEqual(queue.sumSize(), 5)
+		self.assertEqual(await(queue.getMany(2)), [0, 1])
+		self.assertFalse(putting.isDone)
+		self.assertEqual(await(queue.get()), 2)
+		self.assertTrue(putting.isDone)
+		self.assertEqual(queue.drain(), [3, 4])
+	
+	def testGetManyWaits(self):
+		""" getMany takes what is there without waiting, and waits on an
+		    empty Queue for the next put.
+		"""
+		queue = Queue()
+		queue.putMany([1, 2])
+		self.assertEqual(await(queue.getMany(5)), [1, 2])
+		waiting = queue.getMany(5)
+		self.assertFalse(waiting.isDone)
+		queue.put(3)
+		self.assertEqual(await(waiting), [3])
+		with self.assertRaises(Exception):
+			queue.getMany(0)
+	
+	def testWithdrawnPutMany(self):
+		""" A putMany that times out takes back the items still waiting.
+		"""
+		queue = Queue(1)
+		with self.assertRaises(Timeout):
+			await(withTimeout(0.01, queue.putMany([1, 2, 3])))
+		self.assertEqual(queue.drain(), [1])
+		self.assertEqual(queue.sumSize(), 0)
+	
+	def testBatches(self):
+		""" Batches hold what was there at the time, in order, and a batch
+		    waits for a producer when the Queue is empty.
+		"""
+		queue = Queue(4)
+		def produce():
+			for start in range(0, 20, 5):
+				yield from queue.putMany(range(start, start + 5))
+		def consume():
+			values = []
+			for batch in queue.batches(3):
+				items = yield from batch
+				self.assertLessEqual(len(items), 3)
+				values.extend(items)
+				if len(values) == 20:
+					return values
+		producer = async(produce())
+		self.assertEqual(await(withTimeout(5, consume())), list(range(20)))
+		await(producer)
+	
+	def testAsyncFor(self):
+		""" `async for' takes the values of a Queue, or its batches, as they
+		    are put, waiting while it is empty.
+		"""
+		queue = Queue(4)
+		def produce():
+			for value in range(20):
+				yield from queue.put(value)
+		async def consume():
+			values = []
+			async for value in queue:
+				values.append(value)
+				if len(values) == 10:
+					break
+			async for batch in queue.batches(3):
+				self.assertLessEqual(len(batch), 3)
+				values.extend(batch)
+				if len(values) == 20:
+					return values
+		producer = async(produce())
+		self.assertEqual(await(withTimeout(5, consume())), list(range(20)))
+		await(producer)
+	
+	def testXQueueBatchesStopAtErrors(self):
+		""" An XQueue batch holds the results up to the next error, which is
+		    raised by itself.
+		"""
+		queue = XQueue()
+		queue.putMany([1, 2])
+		queue.putError(ValueError("bad"))
+		queue.putResult(3)
+		self.assertEqual(await(queue.getMany(10)), [1, 2])
+		with self.assertRaises(ValueError):
+			await(queue.getMany(10))
+		self.assertEqual(queue.drain(), [3])
+
+
+class WatermarkTest(unittest.TestCase):
+	def _queue(self, *args, **kwargs):
+		self.calls = []
+		return Queue(*args, onHigh = lambda: self.calls.append("high"),
+		             onLow = lambda: self.calls.append("low"), **kwargs)
+	
+	def testCrossings(self):
+		""" Each callback is called as its mark is crossed, and only after
+		    the other.
+		"""
+		queue = self._queue(high = 4, low = 1)
+		queue.putMany(range(3))
+		self.assertEqual(self.calls, [])
+		queue.put(3)
+		queue.put(4)
+		self.assertEqual(self.calls, ["high"])
+		self.assertTrue(queue.isHigh)
+		queue.drain()
+		self.assertEqual(self.calls, ["high", "low"])
+		self.assertFalse(queue.isHigh)
+		queue.putMany(range(10))
+		queue.getMany(9)
+		self.assertEqual(self.calls, ["high", "low", "high", "low"])
+	
+	def testBlockedPutsCount(self):
+		""" Blocked puts count towards the marks.
+		"""
+		queue = self._queue(2, high = 4, low = 1)
+		queue.putMany(range(2))
+		blocked = queue.put(2)
+		self.assertFalse(blocked.isDone)
+		self.assertEqual(self.calls, [])
+		queue.put(3)
+		self.assertEqual(self.calls, ["high"])
+		self.assertEqual(await(queue.getMany(2)), [0, 1])
+		self.assertTrue(blocked.isDone)
+		self.assertEqual(self.calls, ["high"])
+		await(queue.get())
+		self.assertEqual(self.calls, ["high", "low"])
+	
+	def testDefaultMarks(self):
+		""" The marks default to the length and half of it.
+		"""
+		queue = self._queue(4)
+		self.assertEqual((queue.high, queue.low), (4, 2))
+		self.assertEqual((Queue(4).high, Queue(4).low), (None, None))
+	
+	def testBadMarks(self):
+		for kwargs in ({}, {"high": 0}, {"high": 4, "low": 4},
+		               {"high": 4, "low": -1}):
+			with self.subTest(**kwargs):
+				with self.assertRaises(Exception):
+					self._queue(**kwargs)
+	
+	def testLengths(self):
+		""" An unbounded Queue never blocks a put, and one of length 0 hands
+		    each value from a put to a get.
+		"""
+		for length in (None, -1):
+			queue = Queue(length)
+			self.assertIsNone(queue.length)
+			self.assertTrue(queue.putMany(range(10000)).isDone)
+		queue = Queue(0)
+		putting = queue.put(1)
+		self.assertFalse(putting.isDone)
+		self.assertEqual(await(queue.get()), 1)
+		self.assertTrue(putting.isDone)
+		getting = queue.get()
+		self.assertTrue(queue.put(2).isDone)
+		self.assertEqual(await(getting), 2)
+
+
+
+class _Unordered:
+	""" A value that cannot be compared, to show that equal priorities
+	    never fall back on comparing values.
+	"""
+	def __init__(self, priority):
+		self.priority = priority
+
+
+class VariantTest(unittest.TestCase):
+	def testLifo(self):
+		""" The most recently put value is got first, and a blocked value is
+		    let in as the next is taken, so it is the one taken.
+		"""
+		queue = LifoQueue(3)
+		queue.putMany(range(3))
+		self.assertEqual(await(queue.get()), 2)
+		queue.put(3)
+		blocked = queue.put(4)
+		self.assertFalse(blocked.isDone)
+		self.assertEqual(await(queue.get()), 4)
+		self.assertTrue(blocked.isDone)
+		self.assertEqual(await(queue.getMany(2)), [3, 1])
+		self.assertEqual(queue.drain(), [0])
+	
+	def testPriority(self):
+		""" The lowest value is got first, with blocked values ordered as
+		    they are let in.
+		"""
+		queue = PriorityQueue(3)
+		queue.putMany([5, 1, 3])
+		blocked = queue.putMany([0, 4])
+		self.assertEqual(await(queue.get()), 0)
+		self.assertFalse(blocked.isDone)
+		self.assertEqual(await(queue.getMany(2)), [1, 3])
+		self.assertTrue(blocked.isDone)
+		self.assertEqual(queue.drain(), [4, 5])
+	
+	def testPriorityKeyIsStable(self):
+		""" Values with a `key' are ordered by it, and those of equal
+		    priority in the order that they were put.
+		"""
+		values = [_Unordered(priority) for priority in (2, 1, 2, 1, 0, 2)]
+		queue = PriorityQueue(key = lambda value: value.priority)
+		queue.putMany(values)
+		expected = sorted(values, key = lambda value: value.priority)
+		self.assertEqual(queue.drain(), expected)
+	
+	def testWaitersShared(self):
+		""" Waiting gets are handed the values of a putMany in the order of
+		    the Queue, as they would be had the values been stored first.
+		"""
+		for kind, items, got, left in ((LifoQueue, [1, 2, 3], [3, 2], [1]),
+		                               (PriorityQueue, [3, 1, 2], [1, 2], [3])):
+			with self.subTest(kind = kind.__name__):
+				queue = kind()
+				getting = queue.getMany(2)
+				queue.putMany(items)
+				self.assertEqual(await(getting), got)
+				self.assertEqual(queue.drain(), left)
+	
+	def testWaitersOnBoundedQueue(self):
+		""" A bounded Queue stores only what its waiters and its space take
+		    from a putMany, and the rest waits to be let in.
+		"""
+		queue = PriorityQueue(1)
+		one = queue.get()
+		many = queue.getMany(2)
+		putting = queue.putMany([5, 1, 3, 4, 0])
+		self.assertEqual(await(one), 1)
+		self.assertEqual(await(many), [3, 4])
+		self.assertFalse(putting.isDone)
+		self.assertEqual(queue.drain(), [0, 5])
+		self.assertTrue(putting.isDone)
+
+if __name__ == "__main__":
+	unittest.main()
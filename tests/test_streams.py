@@ -0,0 +1,190 @@
+import socket
+import unittest
+
+from ..aux import sleep
+from ..core import async, await, dispatcher, gather, withTimeout
+from ..streams import InterruptedTransfer, ReadWrapper, StreamClosed
+from ..streams import WriteWrapper
+from ..usocket import USocket, _SocketWrapper
+
+
+class EdgeTriggeredTest(unittest.TestCase):
+	def setUp(self):
+		dispatcher.setEdgeTriggered(True)
+		self.left, self.right = socket.socketpair()
+		self.wrappers = []
+	
+	def tearDown(self):
+		# As in their __del__, only wrappers still open are released.
+		for wrapper in self.wrappers:
+			if isinstance(wrapper, ReadWrapper):
+				closing = wrapper.readClosing
+			else:
+				closing = wrapper.writeClosing
+			if closing is None or not closing.isDone:
+				wrapper.forceRelease()
+		self.left.close()
+		self.right.close()
+		dispatcher.setEdgeTriggered(False)
+	
+	def _wrap(self, sock, *args):
+		wrapper = _SocketWrapper(sock)
+		reader = ReadWrapper(wrapper, *args)
+		writer = WriteWrapper(wrapper)
+		self.wrappers += [reader, writer]
+		return reader, writer
+	
+	def testEcho(self):
+		""" Lines written on one end are read on the other and echoed back.
+		"""
+		clientReader, clientWriter = self._wrap(self.left)
+		serverReader, serverWriter = self._wrap(self.right)
+		def server():
+			for _ in range(100):
+				line = yield from serverReader.readline()
+				yield from serverWriter.write(line)
+		def client():
+			served = async(server())
+			lines = []
+			for index in range(100):
+				yield from clientWriter.write(b"line %d\n" % index)
+				lines.append((yield from clientReader.readline()))
+			yield from served
+			return lines
+		lines = await(withTimeout(5, client()))
+		self.assertEqual(lines, [b"line %d\n" % index for index in range(100)])
+	
+	def testPartialWrites(self):
+		""" A write larger than the socket buffer is made in pieces, each
+		    when the socket becomes writable again, and the writer stays
+		    registered.
+		"""
+		reader, _ = self._wrap(self.left)
+		_, writer = self._wrap(self.right)
+		payload = bytes(range(256)) * (16 << 10)
+		writes = [writer.write(payload), writer.write(b"end")]
+		self.assertFalse(writes[0].isDone)
+		data = await(withTimeout(10, reader.read(len(payload) + 3)))
+		self.assertEqual(data, payload + b"end")
+		self.assertEqual(await(withTimeout(1, gather(*writes))),
+		                 [len(payload), 3])
+		self.assertTrue(writer.registeredWriter)
+	
+	def testFullBufferResumes(self):
+		""" A reader stops at a full buffer with data still waiting, and
+		    resumes once reads have drained the buffer below its low mark.
+		"""
+		reader, _ = self._wrap(self.left, 128, 256)
+		payload = bytes(range(256)) * 16
+		self.right.sendall(payload)
+		await(sleep(0.01))
+		self.assertGreaterEqual(reader.bufSize, 256)
+		self.assertLess(reader.bufSize, len(payload))
+		self.assertTrue(reader.readable)
+		self.assertEqual(await(reader.read(200)), payload[:200])
+		self.assertGreaterEqual(reader.bufSize, 256)
+		rest = await(withTimeout(1, reader.read(len(payload) - 200)))
+		self.assertEqual(rest, payload[200:])
+	
+	def testEndOfStream(self):
+		""" Data sent before the other end shuts down is read, and a read
+		    that waits past the end fails.
+		"""
+		reader, _ = self._wrap(self.left)
+		line = reader.readline()
+		self.right.sendall(b"last\n")
+		self.right.shutdown(socket.SHUT_WR)
+		self.assertEqual(await(withTimeout(1, line)), b"last\n")
+		with self.assertRaises((BrokenPipeError, StreamClosed)):
+			await(withTimeout(1, reader.read(1)))
+	
+	def testRelease(self):
+		""" release waits for the reads and writes in progress, and then
+		    unregisters the wrappers.
+		"""
+		reader, writer = self._wrap(self.left)
+		fd = self.left.fileno()
+		reading = reader.read(4)
+		writing = writer.write(b"ping")
+		releases = [reader.release(), writer.release()]
+		self.assertFalse(releases[0].isDone)
+		self.right.sendall(b"pong")
+		self.assertEqual(await(withTimeout(1, reading)), b"pong")
+		self.assertEqual(await(withTimeout(1, writing)), 4)
+		await(withTimeout(1, gather(*releases)))
+		self.assertEqual(self.right.recv(4), b"ping")
+		self.assertNotIn(fd, dispatcher.handles)
+	
+	def testForceRelease(self):
+		""" forceRelease fails the waiting reads and unregisters at once.
+		"""
+		reader, writer = self._wrap(self.left)
+		reading = reader.read(4)
+		reader.forceRelease()
+		writer.forceRelease()
+		with self.assertRaises(InterruptedTransfer):
+			await(reading)
+		self.assertNotIn(self.left.fileno(), dispatcher.handles)
+	
+	def testAcceptBacklog(self):
+		""" Connections that are already waiting when the listener becomes
+		    readable are all accepted from the one event.
+		"""
+		listener = USocket.listener(("127.0.0.1", 0), 8)
+		address = listener.socket.getsockname()
+		clients = [socket.create_connection(address) for _ in range(3)]
+		try:
+			accepted = await(withTimeout(1, gather(
+			                 *[listener.accept() for _ in clients])))
+			for sock in accepted:
+				sock.forceClose()
+		finally:
+			listener.forceClose()
+			for client in clients:
+				client.close()
+		self.assertEqual(len(accepted), 3)
+
+
+
+class AsyncIterationTest(unittest.TestCase):
+	def setUp(self):
+		self.left, self.right = socket.socketpair()
+		self.reader = ReadWrapper(_SocketWrapper(self.left))
+	
+	def tearDown(self):
+		closing = self.reader.readClosing
+		if closing is None or not closing.isDone:
+			self.reader.forceRelease()
+		self.left.close()
+		self.right.close()
+	
+	async def _lines(self):
+		lines = []
+		async for line in self.reader:
+			lines.append(line)
+		return lines
+	
+	def testEndOfStream(self):
+		""" `async for' gives the lines of a stream and ends, rather than
+		    failing, when the other end shuts down.
+		"""
+		lines = async(self._lines())
+		self.right.sendall(b"one\ntwo\n")
+		await(sleep(0.01))
+		self.right.sendall(b"three\n")
+		self.right.shutdown(socket.SHUT_WR)
+		self.assertEqual(await(withTimeout(1, lines)),
+		                 [b"one\n", b"two\n", b"three\n"])
+	
+	def testReleased(self):
+		""" `async for' ends when the wrapper is released while it waits.
+		"""
+		lines = async(self._lines())
+		self.right.sendall(b"one\n")
+		await(sleep(0.01))
+		self.reader.forceRelease()
+		self.assertEqual(await(withTimeout(1, lines)), [b"one\n"])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,68 @@
+import threading
+import time
+import unittest
+
+from ..core import Timeout, await, gather, withTimeout
+from ..threads import ThreadExecutor
+
+
+def _square(value):
+	return value * value
+
+
+def _fail(value):
+	raise(ValueError(value))
+
+
+class ThreadExecutorTest(unittest.TestCase):
+	def setUp(self):
+		self.executor = ThreadExecutor(16)
+	
+	def tearDown(self):
+		self.executor.shutdown()
+	
+	def testManyWorkers(self):
+		""" Every Future of a burst of calls over many workers completes,
+		    one call at a time and in batches, without being stranded.
+		"""
+		for batch in (1, 16, 256):
+			for start in range(0, 20000, batch):
+				futures = [self.executor.run(_square, value)
+				           for value in range(start, start + batch)]
+				try:
+					results = await(withTimeout(5, gather(*futures)))
+				except Timeout:
+					self.fail("Calls stranded at batch %d, from %d"
+					          % (batch, start))
+				self.assertEqual(results, [value * value for value in
+				                           range(start, start + batch)])
+	
+	def testIdleWorkersCounted(self):
+		""" Workers are counted as idle only while they wait for a call,
+		    however many calls were queued behind them while they were busy.
+		"""
+		gate = threading.Event()
+		blocked = [self.executor.run(gate.wait, 5) for _ in range(16)]
+		queued = [self.executor.run(_square, value) for value in range(64)]
+		self.assertEqual(self.executor.idleWorkers, 0)
+		gate.set()
+		await(withTimeout(5, gather(*(blocked + queued))))
+		# The workers go back to waiting once their Futures are completed.
+		deadline = time.time() + 1
+		while self.executor.idleWorkers < 16 and time.time() < deadline:
+			time.sleep(0.001)
+		self.assertEqual(self.executor.idleWorkers, 16)
+		self.assertEqual(len(self.executor.threads), 16)
+		
+		reused = [self.executor.run(_square, value) for value in range(16)]
+		self.assertEqual(self.executor.idleWorkers, 0)
+		self.assertEqual(len(self.executor.threads), 16)
+		await(withTimeout(5, gather(*reused)))
+	
+	def testErrors(self):
+		with self.assertRaises(ValueError):
+			await(withTimeout(5, self.executor.run(_fail, 1)))
+
+
+if __name__ == "__main__":
+	unittest.main()
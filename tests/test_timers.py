@@ -0,0 +1,100 @@
+import random
+import unittest
+
+from ..timers import HeapTimerStore, TimerHandle, TimingWheel
+
+# A tick that floats represent exactly, so that timers set half way through
+# a tick and expired a quarter of the way through one fire at the same
+# expiry from the wheel, which may fire a tick late, as from the heap.
+RESOLUTION = 1.0 / 1024
+START = 1000
+
+
+def _at(tick, fraction):
+	return START + (tick + fraction) * RESOLUTION
+
+
+class TimingWheelTest(unittest.TestCase):
+	def _compare(self, wheelBits, seed):
+		""" Runs the same random pushes, cancellations and expiries through
+		    a TimingWheel with `wheelBits' and a HeapTimerStore, checking that
+		    they expire the same timers each time.
+		"""
+		rng = random.Random(seed)
+		wheel = TimingWheel(RESOLUTION, wheelBits, _at(0, 0.25))
+		heap = HeapTimerStore()
+		span = wheel.span
+		pending = {}
+		tick = 0
+		for step in range(2000):
+			for _ in range(rng.randrange(4)):
+				# Mostly within the bottom wheel, then the upper wheels, and
+				# then beyond the top wheel onto the overflow list.
+				reach = rng.choice((4, max(1, span // 4), span, span * 8))
+				when = _at(tick + rng.randrange(reach), 0.5)
+				key = len(pending), step
+				pending[key] = (TimerHandle(when, key, wheel),
+				                TimerHandle(when, key, heap))
+				wheel.push(pending[key][0])
+				heap.push(pending[key][1])
+			if len(pending) > 0 and rng.random() < 0.2:
+				cancelled = min(len(pending), rng.randint(1, 3))
+				for key in rng.sample(sorted(pending), cancelled):
+					for timer in pending.pop(key):
+						self.assertTrue(timer.cancel())
+			tick += rng.choice((0, 1, 1, 3, span // 2, span + 1, span * 3))
+			now = _at(tick, 0.25)
+			lowerBound = wheel.timeToNext(now)
+			fromWheel = []
+			fromHeap = []
+			wheel.expire(now, fromWheel.append)
+			heap.expire(now, fromHeap.append)
+			self.assertEqual(sorted(fromWheel), sorted(fromHeap),
+			                 "Step %d of %r" % (step, wheelBits))
+			if len(fromWheel) > 0:
+				self.assertLessEqual(lowerBound, 0.0)
+			for key in fromWheel:
+				self.assertFalse(pending.pop(key)[0].pending)
+			self.assertEqual(len(wheel), len(pending))
+			self.assertEqual(len(heap), len(pending))
+			if len(pending) > 0:
+				# The wheel may fire a tick late, so it may sleep until then.
+				soonest = min(timers[0].when for timers in pending.values())
+				self.assertLessEqual(now + wheel.timeToNext(now),
+				                     soonest + RESOLUTION)
+	
+	def testMatchesHeap(self):
+		""" The default wheels expire the same timers as a heap.
+		"""
+		self._compare((8, 6, 6, 6), 1)
+	
+	def testCascadeAndWrap(self):
+		""" Small wheels, which cascade and wrap round every few ticks and
+		    send most timers to the overflow list, expire the same timers as
+		    a heap.
+		"""
+		for seed, wheelBits in enumerate(((2, 2, 2), (3, 1), (1,))):
+			self._compare(wheelBits, seed)
+	
+	def testCompaction(self):
+		""" Cancelled timers are dropped once they outnumber the live ones,
+		    without the live ones being lost.
+		"""
+		for store in (TimingWheel(RESOLUTION, (2, 2, 2), _at(0, 0.25)),
+		              HeapTimerStore()):
+			timers = [TimerHandle(_at(tick, 0.5), tick, store)
+			          for tick in range(1000)]
+			for timer in timers:
+				store.push(timer)
+			for timer in timers[10:]:
+				timer.cancel()
+			self.assertEqual(len(store), 10)
+			self.assertLessEqual(store.tombstones, store.compactMinimum)
+			fired = []
+			store.expire(_at(1000, 0.25), fired.append)
+			self.assertEqual(sorted(fired), list(range(10)))
+			self.assertEqual(len(store), 0)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from ..aux import sleep
+from ..core import async, await, withTimeout
+from ..usocket import USocket
+from ..websockets.websocket import Websocket
+
+
+class WebsocketTest(unittest.TestCase):
+	def testAsyncFor(self):
+		""" `async for' receives the messages of a websocket, and ends when
+		    the other end closes it.
+		"""
+		listener = USocket.listener(("127.0.0.1", 0))
+		address = listener.socket.getsockname()
+		
+		async def server():
+			connection = await listener.accept()
+			messages = []
+			async for message in Websocket(connection):
+				messages.append(message)
+			return messages
+		
+		async def client():
+			connection = USocket()
+			await connection.connect(address)
+			websocket = Websocket(connection, receiveMask = False,
+			                      sendMask = True)
+			for message in ("one", b"two", "three"):
+				await websocket.send(message)
+			# A websocket gives nothing more once the close has arrived, so
+			# the server takes the messages first.
+			await sleep(0.01)
+			await websocket.close()
+		
+		served = async(server())
+		try:
+			await(withTimeout(5, client()))
+			self.assertEqual(await(withTimeout(5, served)),
+			                 ["one", b"two", "three"])
+		finally:
+			await(listener.close())
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,85 @@
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from ..core import await
+from ..usocket import USocket
+from ..workers import Supervisor
+
+
+def _freePort():
+	probe = socket.socket()
+	probe.bind(("127.0.0.1", 0))
+	port = probe.getsockname()[1]
+	probe.close()
+	return port
+
+
+class SupervisorTest(unittest.TestCase):
+	def setUp(self):
+		fd, self.path = tempfile.mkstemp()
+		os.close(fd)
+	
+	def tearDown(self):
+		os.unlink(self.path)
+	
+	def _starts(self):
+		with open(self.path) as log:
+			return [line.split() for line in log]
+	
+	def testWorkerRestarted(self):
+		""" A worker that exits is started again, in a new process, until
+		    the supervisor is stopped by SIGTERM.
+		"""
+		def target(index):
+			with open(self.path, "a") as log:
+				log.write("%d %d\n" % (index, os.getpid()))
+			if len(self._starts()) >= 3:
+				os.kill(os.getppid(), signal.SIGTERM)
+		Supervisor(target, 1, restartDelay = 0.01).run()
+		starts = self._starts()
+		self.assertEqual(len(starts), 3)
+		self.assertEqual({index for index, _ in starts}, {"0"})
+		self.assertEqual(len({pid for _, pid in starts}), 3)
+	
+	def testReusePortListener(self):
+		""" Workers each listening on the same port with reusePort all
+		    accept connections made to it.
+		"""
+		port = _freePort()
+		def target(index):
+			listener = USocket.listener(("127.0.0.1", port), 8,
+			                            reusePort = True)
+			while True:
+				sock = await(listener.accept())
+				await(sock.send(b"%d" % index))
+				sock.forceClose()
+		supervisor = Supervisor(target, 2)
+		supervisor.start()
+		supervising = threading.Thread(target = supervisor.supervise)
+		supervising.start()
+		served = set()
+		try:
+			deadline = time.time() + 5
+			while len(served) < 2 and time.time() < deadline:
+				try:
+					client = socket.create_connection(("127.0.0.1", port))
+				# The workers may not be listening yet.
+				except ConnectionRefusedError:
+					time.sleep(0.01)
+					continue
+				with client:
+					served.add(client.recv(1))
+		finally:
+			supervisor.stop()
+			supervising.join(5)
+		self.assertEqual(served, {b"0", b"1"})
+		self.assertEqual(supervisor.pids, {})
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,99 @@
+import os
+import threading
+from collections import deque
+
+from .core import Future
+
+__all__ = ["ThreadExecutor", "runInThread"]
+
+
+class ThreadExecutor:
+	""" Runs blocking calls on a bounded pool of worker threads.
+	
+	    Each call submitted with `run' is queued for the worker threads and a
+	    Future is returned, which is fulfilled on the loop once the call has
+	    finished. Up to `maxWorkers' threads are started, as they are needed.
+	
+	    The workers hand their results back with setResultThreadsafe, so a
+	    burst of completions causes one wake-up of the loop, after which all
+	    of their Futures are fulfilled in one go. The loop itself never blocks
+	    on the workers.
+	
+	    A worker is counted in `idleWorkers' only while it waits for a call,
+	    and a call wakes one of those rather than starting another thread.
+	"""
+	def __init__(self, maxWorkers = None):
+		if maxWorkers is None:
+			maxWorkers = min(32, (os.cpu_count() or 1) + 4)
+		self.maxWorkers = maxWorkers
+		self.threads = []
+		self.idleWorkers = 0
+		self.jobs = deque()
+		self.jobReady = threading.Condition()
+	
+	def run(self, function, *args):
+		""" Call `function' with `args' on a worker thread.
+		
+		    Returns a Future for the result of the call.
+		"""
+		fut = Future()
+		with self.jobReady:
+			self.jobs.append((fut, function, args))
+			# Wake an idle worker if there is one, which is no longer counted
+			# as idle, so that a call made before it wakes does not count on
+			# it too.
+			if self.idleWorkers > 0:
+				self.idleWorkers -= 1
+				self.jobReady.notify()
+				return fut
+		# Otherwise start another, or leave the call for a busy worker.
+		if len(self.threads) < self.maxWorkers:
+			thread = threading.Thread(target = self.__work, daemon = True)
+			self.threads.append(thread)
+			thread.start()
+		return fut
+	
+	def shutdown(self):
+		""" Stop the worker threads once they have finished the queued calls.
+		"""
+		with self.jobReady:
+			self.jobs.extend([None] * len(self.threads))
+			self.idleWorkers = 0
+			self.jobReady.notify_all()
+		self.threads = []
+	
+	def __work(self):
+		""" The body of a worker thread.
+		"""
+		jobs = self.jobs
+		jobReady = self.jobReady
+		while True:
+			with jobReady:
+				# The worker that wakes to find the call taken by one that
+				# finished meanwhile is idle again.
+				while len(jobs) == 0:
+					self.idleWorkers += 1
+					jobReady.wait()
+				job = jobs.popleft()
+			if job is None:
+				return
+			fut, function, args = job
+			try:
+				fut.setResultThreadsafe(function(*args))
+			except Exception as error:
+				fut.setErrorThreadsafe(error)
+
+
+_defaultExecutor = None
+
+
+def runInThread(function, *args):
+	""" Call `function' with `args' on the default ThreadExecutor.
+	
+	    Returns a Future for the result. Used to keep blocking calls, such as
+	    file reads, name lookups or hashing, from stalling the loop.
+	"""
+	global _defaultExecutor
+	if _defaultExecutor is None:
+		_defaultExecutor = ThreadExecutor()
+	return _defaultExecutor.run(function, *args)
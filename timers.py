@@ -0,0 +1,379 @@
+from collections import deque
+from time import time
+import heapq
+
+inf = float("inf")
+
+
+class TimerHandle:
+	""" A timer that has been scheduled with a timer store.
+	
+	    This is returned when a handle is scheduled by time, and can be used to
+	    cancel that handle before it runs. Cancellation is lazy: the timer is
+	    only marked as dead (tombstoned) and is skipped when its time comes.
+	    The store compacts itself once the tombstones outnumber the live timers
+	    so that neither memory nor expiry cost grow with cancelled timers.
+	    A timer that has already fired cannot be cancelled.
+	"""
+	__slots__ = ("when", "entry", "store")
+	
+	def __init__(self, when, entry, store):
+		self.when = when
+		self.entry = entry
+		self.store = store
+	
+	@property
+	def pending(self):
+		""" True if the timer has neither fired nor been cancelled.
+		"""
+		return self.store is not None
+	
+	def cancel(self):
+		""" Cancel the timer, so that its handle will not be run.
+		
+		    Returns True if the timer was cancelled and False if it had
+		    already fired or been cancelled.
+		"""
+		store = self.store
+		if store is None:
+			return False
+		self.store = None
+		store.tombstone()
+		return True
+
+
+class _TimerStore:
+	""" Tombstone book-keeping shared by the timer stores.
+	
+	    Once there are more than `compactMinimum' tombstones and more than
+	    `compactRatio' tombstones for every live timer, the store is compacted.
+	"""
+	compactRatio = 1.0
+	compactMinimum = 64
+	
+	def tombstone(self):
+		""" Called by a TimerHandle when it is cancelled.
+		"""
+		self.tombstones += 1
+		if self.tombstones > self.compactMinimum and \
+		   self.tombstones > self.compactRatio * len(self):
+			self.compact()
+
+
+class HeapTimerStore(_TimerStore):
+	""" Timer store backed by a binary heap.
+	
+	    This is the original scheduling structure: timers are kept in a heap
+	    ordered by their expiry time, giving O(log n) insertion and removal.
+	    Entries are plain tuples so that comparisons are carried out in C
+	    rather than through Python-level comparison methods. The sequence
+	    number breaks ties, so that timers with equal expiry times fire in the
+	    order in which they were scheduled.
+	"""
+	def __init__(self):
+		self.heap = []
+		self.sequence = 0
+		self.tombstones = 0
+	
+	def __len__(self):
+		return len(self.heap) - self.tombstones
+	
+	def push(self, timer):
+		""" Add `timer' to the store, to expire at `timer.when'.
+		"""
+		self.sequence += 1
+		heapq.heappush(self.heap, (timer.when, self.sequence, timer))
+	
+	def timeToNext(self, now):
+		""" Returns the number of seconds from `now' until the next expiry.
+		"""
+		heap = self.heap
+		# Tombstones at the top of the heap would cause early wake-ups.
+		while len(heap) > 0 and heap[0][2].store is None:
+			heapq.heappop(heap)
+			self.tombstones -= 1
+		if len(heap) == 0:
+			return inf
+		return heap[0][0] - now
+	
+	def expire(self, now, append):
+		""" Pass the entry of every timer that has expired by `now' to
+		    `append'.
+		"""
+		heap = self.heap
+		while len(heap) > 0 and heap[0][0] <= now:
+			timer = heapq.heappop(heap)[2]
+			if timer.store is None:
+				self.tombstones -= 1
+			else:
+				timer.store = None
+				append(timer.entry)
+	
+	def compact(self):
+		""" Remove all the tombstones from the heap.
+		"""
+		self.heap = [item for item in self.heap if item[2].store is not None]
+		heapq.heapify(self.heap)
+		self.tombstones = 0
+	
+	def clear(self):
+		""" Drop every timer, as if each had been cancelled.
+		"""
+		for _, _, timer in self.heap:
+			timer.store = None
+		self.heap = []
+		self.tombstones = 0
+
+
+class TimingWheel(_TimerStore):
+	""" Timer store backed by a hierarchical timing wheel.
+	
+	    Time is divided into ticks of `resolution' seconds. The bottom wheel
+	    holds one slot per tick, for the next 256 ticks. Each wheel above it
+	    holds 64 slots, with each slot spanning a whole revolution of the wheel
+	    below. A timer is dropped into the slot of the lowest wheel that can
+	    reach it, which is O(1). As time advances, the slots of the bottom
+	    wheel are emptied into the ready queue and, whenever a wheel completes
+	    a revolution, the next slot of the wheel above it is cascaded down.
+	    The cost of expiry is thereby amortised over the loop iterations
+	    rather than being paid per timer through a heap.
+	
+	    Each wheel keeps a bitmap of its occupied slots, so that empty slots
+	    are skipped over without being visited. Timers further away than the
+	    top wheel can reach are kept on an overflow list, which is re-examined
+	    each time the top wheel turns. A timer will never fire early but may
+	    fire up to one tick late.
+	"""
+	def __init__(self, resolution = 0.001, wheelBits = (8, 6, 6, 6),
+	                   now = None):
+		if now is None:
+			now = time()
+		self.resolution = resolution
+		self.ticksPerSecond = 1.0 / resolution
+		self.current = int(now * self.ticksPerSecond)
+		
+		# Per-wheel tables: the slots themselves, the bitmap of occupied
+		# slots, the shift and mask used to find a slot from a tick, the
+		# number of ticks that a wheel can reach and the mask of the tick bits
+		# below the wheel.
+		self.slots = []
+		self.occupied = [0] * len(wheelBits)
+		self.shifts = []
+		self.masks = []
+		self.limits = []
+		self.lowMasks = []
+		shift = 0
+		for bits in wheelBits:
+			self.slots.append([[] for _ in range(1 << bits)])
+			self.shifts.append(shift)
+			self.masks.append((1 << bits) - 1)
+			self.lowMasks.append((1 << shift) - 1)
+			shift += bits
+			self.limits.append(1 << shift)
+		self.span = 1 << shift
+		
+		# The wheel that a timer belongs on, indexed by the bit-length of the
+		# number of ticks until it expires.
+		self.levelByBits = [0]
+		for bits in range(1, shift + 1):
+			self.levelByBits.append(min(level
+			                            for level, limit in enumerate(self.limits)
+			                            if 1 << bits <= limit))
+		
+		self.overflow = []
+		self.due = deque()
+		self.size = 0
+		self.tombstones = 0
+	
+	def __len__(self):
+		return self.size - self.tombstones
+	
+	def push(self, timer):
+		""" Add `timer' to the wheel, to expire at `timer.when'.
+		"""
+		self.size += 1
+		self.__place(int(timer.when * self.ticksPerSecond) + 1, timer)
+	
+	def timeToNext(self, now):
+		""" Returns the number of seconds from `now' until the next expiry.
+		
+		    The value returned is a lower bound: For timers on the upper wheels
+		    it is the time at which their slot will be cascaded, after which a
+		    second call will return a more precise answer.
+		"""
+		if len(self.due) > 0:
+			return 0.0
+		if self.size == 0:
+			return inf
+		
+		best = inf
+		for level in range(len(self.slots)):
+			nextTick = self.__nextOccupied(level)
+			if nextTick is not None and nextTick < best:
+				best = nextTick
+		
+		# The overflow is only looked at as the top wheel completes its
+		# revolution, which may come before any occupied slot.
+		if len(self.overflow) > 0:
+			best = min(best, (self.current // self.span + 1) * self.span)
+		return best * self.resolution - now
+	
+	def expire(self, now, append):
+		""" Pass the entry of every timer that has expired by `now' to
+		    `append'.
+		
+		    The wheel is turned up to `now', stopping only at the ticks where
+		    either a bottom slot is occupied or an upper wheel must cascade.
+		"""
+		self.__fire(self.due, append)
+		self.due = deque()
+		
+		target = int(now * self.ticksPerSecond)
+		bottom = self.slots[0]
+		mask = self.masks[0]
+		occupied = self.occupied
+		current = self.current
+		while current < target and self.size > 0:
+			# Find the next tick that needs attention: the next occupied slot
+			# of the bottom wheel, or the next cascade of the lowest occupied
+			# wheel above it.
+			level = 0
+			while level < len(occupied) and occupied[level] == 0:
+				level += 1
+			if level == len(occupied):
+				nextTick = (current | (self.span - 1)) + 1
+			elif level > 0:
+				nextTick = (current | self.lowMasks[level]) + 1
+			else:
+				nextTick = min(self.__nextOccupied(0), (current | mask) + 1)
+			if nextTick > target:
+				break
+			
+			current = nextTick
+			index = current & mask
+			if index == 0:
+				self.current = current
+				self.__cascade(current)
+			
+			slot = bottom[index]
+			if slot:
+				bottom[index] = []
+				occupied[0] &= ~(1 << index)
+				self.size -= len(slot)
+				for _, timer in slot:
+					if timer.store is None:
+						self.tombstones -= 1
+					else:
+						timer.store = None
+						append(timer.entry)
+		self.current = max(current, target)
+		
+		# Cascading may have landed timers on the current tick.
+		if len(self.due) > 0:
+			self.__fire(self.due, append)
+			self.due = deque()
+	
+	def compact(self):
+		""" Remove all the tombstones from the wheels.
+		"""
+		for level, slots in enumerate(self.slots):
+			for index, slot in enumerate(slots):
+				if slot:
+					slots[index] = slot = [item for item in slot
+					                       if item[1].store is not None]
+					if not slot:
+						self.occupied[level] &= ~(1 << index)
+		self.overflow = [item for item in self.overflow
+		                 if item[1].store is not None]
+		self.due = deque(timer for timer in self.due if timer.store is not None)
+		self.size -= self.tombstones
+		self.tombstones = 0
+	
+	def clear(self):
+		""" Drop every timer, as if each had been cancelled.
+		"""
+		for level, slots in enumerate(self.slots):
+			for index, slot in enumerate(slots):
+				for _, timer in slot:
+					timer.store = None
+				slots[index] = []
+			self.occupied[level] = 0
+		for _, timer in self.overflow:
+			timer.store = None
+		for timer in self.due:
+			timer.store = None
+		self.overflow = []
+		self.due = deque()
+		self.size = 0
+		self.tombstones = 0
+	
+	def __fire(self, due, append):
+		""" Pass on the entries of the live timers in `due', which is about to
+		    be discarded.
+		"""
+		self.size -= len(due)
+		for timer in due:
+			if timer.store is None:
+				self.tombstones -= 1
+			else:
+				timer.store = None
+				append(timer.entry)
+	
+	def __nextOccupied(self, level):
+		""" Returns the first tick after the current one at which an occupied
+		    slot of wheel `level' is reached, or None if the wheel is empty.
+		"""
+		bitmap = self.occupied[level]
+		if bitmap == 0:
+			return None
+		shift = self.shifts[level]
+		mask = self.masks[level]
+		base = self.current >> shift
+		
+		# Rotate the bitmap so that bit 0 is the slot after the current one.
+		start = (base + 1) & mask
+		rotated = ((bitmap >> start) | (bitmap << (mask + 1 - start))) & \
+		          ((1 << (mask + 1)) - 1)
+		return (base + (rotated & -rotated).bit_length()) << shift
+	
+	def __place(self, tick, timer):
+		""" Put a timer, expiring at `tick', into the appropriate slot.
+		"""
+		delta = tick - self.current
+		if delta <= 0:
+			self.due.append(timer)
+		elif delta < self.span:
+			level = self.levelByBits[delta.bit_length()]
+			index = (tick >> self.shifts[level]) & self.masks[level]
+			self.slots[level][index].append((tick, timer))
+			self.occupied[level] |= 1 << index
+		else:
+			self.overflow.append((tick, timer))
+	
+	def __cascade(self, tick):
+		""" Move the timers of the upper wheels down as the wheels turn.
+		
+		    Called when the bottom wheel completes a revolution at `tick'. The
+		    wheels that complete a revolution at the same time are cascaded
+		    from the top down, so that timers can fall through several wheels
+		    in one go.
+		"""
+		# With a single wheel, only the overflow is cascaded.
+		top = min(1, len(self.slots) - 1)
+		while top + 1 < len(self.slots) and not tick & self.lowMasks[top + 1]:
+			top += 1
+		
+		if top + 1 == len(self.slots) and not tick & (self.span - 1):
+			overflow, self.overflow = self.overflow, []
+			for timerTick, timer in overflow:
+				self.__place(timerTick, timer)
+		
+		for level in range(top, 0, -1):
+			slots = self.slots[level]
+			index = (tick >> self.shifts[level]) & self.masks[level]
+			slot = slots[index]
+			if slot:
+				slots[index] = []
+				self.occupied[level] &= ~(1 << index)
+				for timerTick, timer in slot:
+					self.__place(timerTick, timer)
@@ -75,11 +75,28 @@ class USocket:
 		return self.socket.bind(address)
 	
 	@classmethod
-	def listener(self, address, backlog = 1):
+	def listener(self, address, backlog = 1, reusePort = False,
+	                   exclusive = False):
+		""" Create a socket listening on `address'.
+		
+		    With `reusePort', the socket is bound with SO_REUSEPORT, so that
+		    several worker processes can each bind their own listener to the
+		    same address and have the kernel balance connections between them.
+		
+		    With `exclusive', accepts are polled for with EPOLLEXCLUSIVE. This
+		    is for a listener that is created before forking a set of workers
+		    that all accept from it, so that each connection wakes only one.
+		"""
 		listener = USocket()
 		listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		if reusePort:
+			listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 		listener.bind(address)
 		listener.listen(backlog)
+		# Only marked once listening, so that a failed bind leaves no mark
+		# behind for an fd number that will be reused.
+		if exclusive:
+			dispatcher.setExclusiveWakeup(listener.socket.fileno())
 		return listener
 		
 
@@ -210,12 +227,14 @@ class _USocketStream(USocket):
 	@asynchronous
 	def __listenCloser(self):
 		yield from self.acceptQueue.close()
+		dispatcher.setExclusiveWakeup(self.socket.fileno(), False)
 		self.__commonCloser()
 		self.acceptQueue = None
 	
 	def __rudeListenCloser(self, error):
 		for item in self.acceptQueue.forceClose():
 			item.setError(error)
+		dispatcher.setExclusiveWakeup(self.socket.fileno(), False)
 		self.__commonCloser()
 		self.acceptQueue = None
 	
@@ -6,6 +6,7 @@ try:
 	import numpy
 except:
 	numpy = None
+from ..core import asynchronous
 from .errors import *
 
 inf = float("inf")
@@ -58,6 +59,7 @@ if numpy:
 else:
 	applyMask = applyMaskSlow
 
+@asynchronous
 def readFragment(socket, mask, maxSize = inf):
 	# Read the header
 	data = yield from socket.recv(2)
@@ -109,6 +111,7 @@ def readFragment(socket, mask, maxSize = inf):
 	return opcode, data, finalFragment
 
 
+@asynchronous
 def writeFragment(socket, mask, opcode, data, final):
 	length = len(data)
 	
@@ -4,6 +4,7 @@ import base64
 import hashlib
 import random
 
+from ..core import asynchronous
 from .errors import *
 
 __all__ = ["clientHandshake", "serverHandshake"]
@@ -18,6 +19,7 @@ USER_AGENT = (' '.join((
 ))).encode()
 WEBSOCKETS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
 
+@asynchronous
 def clientHandshake(socket, host, resourceName = "/", origin = None,
 	                        subprotocols = None):
 	""" Perform the client side of the opening handshake.
@@ -65,6 +67,7 @@ def clientHandshake(socket, host, resourceName = "/", origin = None,
 	return subprotocol
 
 
+@asynchronous
 def serverHandshake(socket, origins=None, subprotocols=None):
 	""" Perform the server side of the opening handshake.
 	    If provided, `origins` is a list of acceptable HTTP Origin values.
@@ -126,6 +129,7 @@ def buildRequest(host, resourceName, origin, subprotocols):
 	return key, request
 
 
+@asynchronous
 def readRequest(stream):
 	""" Stolen from aaugustin
 	
@@ -184,6 +188,7 @@ def buildResponse(key, subprotocol = None):
 	return response
 
 
+@asynchronous
 def readResponse(stream):
 	""" Read an HTTP/1.1 response from `stream'.
 	
@@ -223,6 +228,7 @@ def acceptKeyEncode(key):
 	return base64.b64encode(sha1)
 
 
+@asynchronous
 def readMessage(stream):
 	""" Read an HTTP message from `stream`.
 	    Return `(start_line, headers)` where `start_line` is :class:`bytes` and
@@ -3,6 +3,7 @@ from ..aux import *
 from ..queue import *
 from ..core import *
 from ..streams import InterruptedTransfer
+from ..usocket import USocket
 from .framing import *
 from .errors import *
 import traceback
@@ -60,6 +61,10 @@ class Websocket:
 		
 		# Write waiter
 		self.curWait = doneFuture
+		
+		# Timer that forces the socket closed if the remote end does not
+		# answer a close frame in time.
+		self.closeTimer = None
 	
 	def __del__(self):
 		# If the websocket is collected whilst open, then forceClose the
@@ -83,6 +88,19 @@ class Websocket:
 		else:
 			return errorFuture(WebsocketClosed(self.closingData))
 	
+	def __aiter__(self):
+		return self
+	
+	@asynchronous
+	def __anext__(self):
+		""" Receive the next packet in an `async for' loop, which ends when
+		    the websocket is closed.
+		"""
+		try:
+			return (yield from self.recv())
+		except WebsocketClosed:
+			raise StopAsyncIteration
+	
 	@asynchronous
 	def send(self, data):
 		""" Send one complete packet through the websocket.
@@ -193,6 +211,8 @@ class Websocket:
 				self.closingData = (self.closingData[0], closeData,
 				                    self.closingData[2])
 			self.state = STATE_CLOSED
+			if self.closeTimer is not None:
+				self.closeTimer.cancel()
 			yield from self.socket.close()
 			return RECV_CLOSE, None
 		
@@ -262,7 +282,7 @@ class Websocket:
 		try:
 			data = struct.pack("!H", reason[0]) + reason[1].encode()
 			yield from self.__writeCloseFrame(data)
-			dispatcher.scheduleHandle(time() + timeout, self.__closeTimeout)
+			self.closeTimer = callAt(time() + timeout, self.__closeTimeout)
 		except (InterruptedTransfer, BrokenPipeError):
 			self.state = STATE_ERROR
 			self.__closeTimeout()
@@ -280,11 +300,13 @@ class Websocket:
 					pass
 
 
-def websocketServer(port, handler, backlog = 3):
-	listener = USocket()
-	listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-	listener.bind(("",port))
-	listener.listen(backlog)
+def websocketServer(port, handler, backlog = 3, reusePort = False):
+	""" Serve websockets on `port', passing each to `handler'.
+	
+	    With `reusePort', each worker of a Supervisor can run its own server
+	    on the same port.
+	"""
+	listener = USocket.listener(("", port), backlog, reusePort)
 	while True:
 		socket = await(listener.accept())
 		path, _ = await(serverHandshake(socket))
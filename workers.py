@@ -0,0 +1,145 @@
+import os
+import signal
+import sys
+import time
+import traceback
+
+from .core import forkDispatcher
+
+__all__ = ["Supervisor", "runWorkers"]
+
+
+def availableCpus():
+	""" Returns the sorted list of the CPUs that this process may run on.
+	"""
+	if hasattr(os, "sched_getaffinity"):
+		return sorted(os.sched_getaffinity(0))
+	return list(range(os.cpu_count() or 1))
+
+
+class Supervisor:
+	""" Starts and supervises a set of worker processes.
+	
+	    The dispatcher is single-threaded, so a server running in one process
+	    can only use one core. A Supervisor forks `workers' children, by
+	    default one per available CPU, each of which gets a dispatcher of its
+	    own through forkDispatcher and then calls `target' with its worker
+	    index. A worker serving a port would normally create its own listener
+	    with `USocket.listener(address, backlog, reusePort = True)', so that
+	    the kernel balances the incoming connections between the workers.
+	
+	    Alternatively, in the pre-fork model, the listener is created once,
+	    before the Supervisor is started, and every worker accepts from it.
+	    forkDispatcher carries the listener's registration over into each
+	    worker. Creating it with `exclusive' set avoids waking every worker
+	    for each connection.
+	
+	    If `pinCpus' is set then each worker is pinned to one of the CPUs
+	    available to the supervisor, in turn. A worker that exits, for any
+	    reason, is restarted after `restartDelay' seconds, unless `restart'
+	    is false or the supervisor is stopping.
+	
+	    The supervising process itself does not run the event loop, it only
+	    waits on its children.
+	"""
+	def __init__(self, target, workers = None, pinCpus = False,
+	                   restart = True, restartDelay = 0.1):
+		self.cpus = availableCpus()
+		if workers is None:
+			workers = len(self.cpus)
+		self.target = target
+		self.workers = workers
+		self.pinCpus = pinCpus
+		self.restart = restart
+		self.restartDelay = restartDelay
+		self.pids = {}
+		self.running = False
+	
+	def start(self):
+		""" Fork all the workers.
+		"""
+		self.running = True
+		for index in range(self.workers):
+			self.__spawn(index)
+	
+	def run(self):
+		""" Start the workers and supervise them.
+		
+		    Returns once the supervisor has been stopped, by a call to stop or
+		    by SIGTERM or SIGINT, and all the workers have exited, or when all
+		    the workers have exited and are not to be restarted.
+		"""
+		previous = {sig: signal.signal(sig, self.__handleSignal)
+		            for sig in (signal.SIGTERM, signal.SIGINT)}
+		try:
+			self.start()
+			self.supervise()
+		finally:
+			for sig, handler in previous.items():
+				signal.signal(sig, handler)
+	
+	def supervise(self):
+		""" Wait on the workers, restarting those that die.
+		"""
+		while len(self.pids) > 0:
+			try:
+				pid, status = os.wait()
+			except ChildProcessError:
+				break
+			index = self.pids.pop(pid, None)
+			if index is not None and self.running and self.restart:
+				time.sleep(self.restartDelay)
+				# The supervisor may have been stopped while sleeping.
+				if self.running:
+					self.__spawn(index)
+	
+	def stop(self, sig = signal.SIGTERM):
+		""" Stop restarting workers and send `sig' to those still running.
+		"""
+		self.running = False
+		for pid in list(self.pids):
+			try:
+				os.kill(pid, sig)
+			except ProcessLookupError:
+				pass
+	
+	def __handleSignal(self, sig, frame):
+		self.stop(signal.SIGTERM)
+	
+	def __spawn(self, index):
+		""" Fork worker `index'.
+		"""
+		# Buffered output would otherwise be written by both processes.
+		sys.stdout.flush()
+		sys.stderr.flush()
+		pid = os.fork()
+		if pid == 0:
+			self.__runWorker(index)
+		self.pids[pid] = index
+	
+	def __runWorker(self, index):
+		""" The body of a worker process, which never returns.
+		"""
+		status = 0
+		try:
+			signal.signal(signal.SIGTERM, signal.SIG_DFL)
+			signal.signal(signal.SIGINT, signal.SIG_DFL)
+			forkDispatcher()
+			if self.pinCpus and hasattr(os, "sched_setaffinity"):
+				os.sched_setaffinity(0, {self.cpus[index % len(self.cpus)]})
+			self.target(index)
+		except BaseException:
+			traceback.print_exc()
+			status = 1
+		finally:
+			sys.stdout.flush()
+			sys.stderr.flush()
+			os._exit(status)
+
+
+def runWorkers(target, workers = None, pinCpus = False):
+	""" Run `target' in supervised worker processes until stopped.
+	
+	    See Supervisor.
+	"""
+	Supervisor(target, workers, pinCpus).run()